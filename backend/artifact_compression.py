@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Smaller, faster-loading model artifacts for Surplus2Serve.
+
+A fitted RandomForest keeps sklearn's 64-byte node struct plus a float64
+class distribution for every node, internal ones included, and a plain
+joblib.dump stores all of it uncompressed. compact_pipeline replaces the forest of a
+pipeline with a CompactForestClassifier that predicts the same classes from
+flat arrays:
+
+- internal nodes keep only the split: feature (int16), threshold and child
+  indices (int32). Thresholds are float32, rounded down, so every input
+  takes the same branch as before (sklearn compares float32 inputs anyway);
+- only leaves keep a class distribution, quantized to MODEL_LEAF_PRECISION
+  (uint16 by default, i.e. probabilities to within 1e-5);
+- optionally, sibling leaves whose distributions differ by at most
+  MODEL_NODE_PRUNING_DELTA are merged into their parent, and the forest is
+  cut to the fewest trees whose predictions still agree with the whole
+  forest on all but MODEL_TREE_PRUNING_TOLERANCE of the training rows.
+
+Artifacts are written by dump_artifact with MODEL_COMPRESSION: any joblib
+compressor or zstd ("zstd:3", "zlib:6", "lz4", "none"). load_artifact
+memory-maps uncompressed artifacts, so API worker processes share one copy in
+the page cache. To compact and compare an existing model:
+    python artifact_compression.py --model ../Model/best_spoilage_model_with_xgboost.pkl --data training_data.csv --output compact.pkl
+"""
+
+import io
+import os
+import json
+import time
+import argparse
+import logging
+import tempfile
+import warnings
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
+
+logger = logging.getLogger(__name__)
+
+# Replace random forests with CompactForestClassifier before they are saved
+MODEL_COMPACTION = os.getenv("MODEL_COMPACTION", "true").lower() == "true"
+# Storage of leaf class distributions: 'uint16', 'uint8' or 'float32'
+MODEL_LEAF_PRECISION = os.getenv("MODEL_LEAF_PRECISION", "uint16")
+# Merge sibling leaves whose class probabilities differ by at most this much (0 = off)
+MODEL_NODE_PRUNING_DELTA = float(os.getenv("MODEL_NODE_PRUNING_DELTA", "0"))
+# Share of training rows whose predicted class may change by dropping trees (0 = off)
+MODEL_TREE_PRUNING_TOLERANCE = float(os.getenv("MODEL_TREE_PRUNING_TOLERANCE", "0"))
+# Compression of saved artifacts: '<compressor>[:<level 1-9>]' or 'none'
+MODEL_COMPRESSION = os.getenv("MODEL_COMPRESSION", "zstd:3")
+
+LEAF_SCALES = {'uint16': 65535, 'uint8': 255, 'float32': None}
+FOREST_CLASSES = (RandomForestClassifier, ExtraTreesClassifier)
+# Training rows used to choose how many trees to keep
+TREE_PRUNING_ROWS = 5000
+# Rows traversed at a time; bounds the (rows x trees) working arrays
+PREDICT_CHUNK_ROWS = 2048
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# Uncompressed joblib files start with the pickle protocol opcode
+PICKLE_PROTOCOL_OPCODE = b'\x80'
+
+def _float32_floor(values: np.ndarray) -> np.ndarray:
+    """Largest float32 not above each value: x <= t and x <= floor32(t) agree for float32 x."""
+    rounded = values.astype(np.float32)
+    above = rounded.astype(np.float64) > values
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+def _compact_tree(tree, node_pruning_delta: float):
+    """Split arrays, child references and leaf probabilities of one fitted sklearn tree."""
+    left, right = tree.children_left, tree.children_right
+    value = tree.value[:, 0, :].astype(np.float64)
+    proba = value / np.maximum(value.sum(axis=1, keepdims=True), np.finfo(np.float64).tiny)
+
+    is_leaf = left == -1
+    if node_pruning_delta > 0:
+        # Collapse parents of two similar leaves; repeat as merges create new leaf pairs
+        while True:
+            candidates = np.flatnonzero(~is_leaf)
+            candidates = candidates[is_leaf[left[candidates]] & is_leaf[right[candidates]]]
+            close = np.abs(proba[left[candidates]] - proba[right[candidates]]).max(axis=1) <= node_pruning_delta
+            if not close.any():
+                break
+            is_leaf[candidates[close]] = True
+
+    # Nodes below a merged parent are dropped
+    reachable = np.zeros(tree.node_count, dtype=bool)
+    frontier = np.array([0])
+    while frontier.size:
+        reachable[frontier] = True
+        frontier = frontier[~is_leaf[frontier]]
+        frontier = np.concatenate([left[frontier], right[frontier]])
+    internal = np.flatnonzero(reachable & ~is_leaf)
+    leaves = np.flatnonzero(reachable & is_leaf)
+
+    # Internal children are referenced by position, leaves by ~position (negative)
+    reference = np.zeros(tree.node_count, dtype=np.int64)
+    reference[internal] = np.arange(len(internal))
+    reference[leaves] = ~np.arange(len(leaves))
+    return {
+        "feature": tree.feature[internal],
+        "threshold": _float32_floor(tree.threshold[internal]),
+        "left": reference[left[internal]],
+        "right": reference[right[internal]],
+        "root": int(reference[0]),
+        "proba": proba[leaves]
+    }
+
+class CompactForestClassifier(ClassifierMixin, BaseEstimator):
+    """
+    Inference-only random forest over flat arrays (see the module docstring).
+    Built from a fitted forest with compact(); extend() adds the trees of
+    another fitted forest, which is how incremental training grows it.
+    """
+
+    def __init__(self, leaf_precision: str = MODEL_LEAF_PRECISION,
+                 node_pruning_delta: float = MODEL_NODE_PRUNING_DELTA):
+        self.leaf_precision = leaf_precision
+        self.node_pruning_delta = node_pruning_delta
+
+    def __sklearn_is_fitted__(self) -> bool:
+        return hasattr(self, "roots_")
+
+    @property
+    def n_estimators(self) -> int:
+        return len(self.roots_)
+
+    @property
+    def node_count(self) -> int:
+        return len(self.threshold_) + len(self.leaf_values_)
+
+    def compact(self, forest) -> "CompactForestClassifier":
+        """Take over the trees of a fitted RandomForest / ExtraTrees classifier."""
+        if self.leaf_precision not in LEAF_SCALES:
+            raise ValueError(f"Unknown leaf precision '{self.leaf_precision}', use one of {list(LEAF_SCALES)}")
+        self.classes_ = forest.classes_
+        self.n_classes_ = len(forest.classes_)
+        self.n_features_in_ = forest.n_features_in_
+        self.feature_importances_ = forest.feature_importances_.astype(np.float32)
+        self.forest_class_ = type(forest)
+        self.forest_params_ = forest.get_params()
+        self.feature_ = np.zeros(0, dtype=np.int16 if self.n_features_in_ < 2 ** 15 else np.int32)
+        self.threshold_ = np.zeros(0, dtype=np.float32)
+        self.left_ = np.zeros(0, dtype=np.int32)
+        self.right_ = np.zeros(0, dtype=np.int32)
+        self.roots_ = np.zeros(0, dtype=np.int32)
+        self.leaf_values_ = np.zeros((0, self.n_classes_), dtype=self.leaf_precision)
+        self.tree_offsets_ = np.zeros((1, 2), dtype=np.int64)
+        return self.extend(forest)
+
+    def extend(self, forest) -> "CompactForestClassifier":
+        """Append the trees of another fitted forest over the same classes and features."""
+        if list(forest.classes_) != list(self.classes_):
+            raise ValueError("Forest classes differ from the compact forest's")
+        scale = LEAF_SCALES[self.leaf_precision]
+        trees = [_compact_tree(estimator.tree_, self.node_pruning_delta) for estimator in forest.estimators_]
+
+        internal_offset, leaf_offset = self.tree_offsets_[-1]
+        features, thresholds, lefts, rights, roots, leaf_values, offsets = [], [], [], [], [], [], []
+        for tree in trees:
+            def shift(reference):
+                return np.where(reference >= 0, reference + internal_offset, reference - leaf_offset)
+            features.append(tree["feature"])
+            thresholds.append(tree["threshold"])
+            lefts.append(shift(tree["left"]))
+            rights.append(shift(tree["right"]))
+            roots.append(shift(np.array([tree["root"]])))
+            leaf_values.append(tree["proba"] if scale is None else np.rint(tree["proba"] * scale))
+            internal_offset += len(tree["threshold"])
+            leaf_offset += len(tree["proba"])
+            offsets.append((internal_offset, leaf_offset))
+
+        self.feature_ = np.concatenate([self.feature_] + features).astype(self.feature_.dtype)
+        self.threshold_ = np.concatenate([self.threshold_] + thresholds)
+        self.left_ = np.concatenate([self.left_] + lefts).astype(np.int32)
+        self.right_ = np.concatenate([self.right_] + rights).astype(np.int32)
+        self.roots_ = np.concatenate([self.roots_] + roots).astype(np.int32)
+        self.leaf_values_ = np.concatenate([self.leaf_values_] + leaf_values).astype(self.leaf_precision)
+        self.tree_offsets_ = np.concatenate([self.tree_offsets_, np.array(offsets, dtype=np.int64)])
+        return self
+
+    def fit(self, X, y) -> "CompactForestClassifier":
+        """Fit a forest with the parameters of the compacted one (a default RandomForest otherwise) and compact it."""
+        forest_class = getattr(self, "forest_class_", RandomForestClassifier)
+        return self.compact(forest_class(**getattr(self, "forest_params_", {})).fit(X, y))
+
+    def grow(self, X, y, n_trees: int) -> "CompactForestClassifier":
+        """Fit n_trees more trees on X, y with the compacted forest's parameters and append them."""
+        params = dict(self.forest_params_, n_estimators=n_trees, warm_start=False)
+        return self.extend(self.forest_class_(**params).fit(X, y))
+
+    def truncate(self, n_trees: int) -> "CompactForestClassifier":
+        """Keep only the first n_trees trees."""
+        internal_end, leaf_end = self.tree_offsets_[n_trees]
+        self.feature_ = self.feature_[:internal_end].copy()
+        self.threshold_ = self.threshold_[:internal_end].copy()
+        self.left_ = self.left_[:internal_end].copy()
+        self.right_ = self.right_[:internal_end].copy()
+        self.roots_ = self.roots_[:n_trees].copy()
+        self.leaf_values_ = self.leaf_values_[:leaf_end].copy()
+        self.tree_offsets_ = self.tree_offsets_[:n_trees + 1].copy()
+        return self
+
+    def apply(self, X) -> np.ndarray:
+        """Leaf reached in every tree, as an (n_rows, n_trees) array of leaf positions."""
+        X = np.ascontiguousarray(X.toarray() if hasattr(X, "toarray") else X, dtype=np.float32)
+        n_trees = len(self.roots_)
+        values = X.ravel()
+        nodes = np.tile(self.roots_.astype(np.int64), len(X))
+        # Offset of each (row, tree) path's row in the flattened inputs
+        row_offsets = np.repeat(np.arange(len(X), dtype=np.int64) * X.shape[1], n_trees)
+        # Paths that reached a leaf (negative reference) drop out of the active set
+        active = np.flatnonzero(nodes >= 0)
+        while active.size:
+            current = nodes[active]
+            go_left = values[row_offsets[active] + self.feature_[current]] <= self.threshold_[current]
+            following = np.where(go_left, self.left_[current], self.right_[current])
+            nodes[active] = following
+            active = active[following >= 0]
+        return (~nodes).reshape(len(X), n_trees)
+
+    def _tree_votes(self, X) -> np.ndarray:
+        """Per-tree leaf values, (n_rows, n_trees, n_classes), in leaf storage units."""
+        return self.leaf_values_[self.apply(X)]
+
+    def predict_proba(self, X) -> np.ndarray:
+        scale = LEAF_SCALES[self.leaf_precision] or 1
+        n_rows = X.shape[0]
+        proba = np.empty((n_rows, self.n_classes_), dtype=np.float64)
+        for start in range(0, n_rows, PREDICT_CHUNK_ROWS):
+            chunk = X[start:start + PREDICT_CHUNK_ROWS]
+            proba[start:start + PREDICT_CHUNK_ROWS] = self._tree_votes(chunk).sum(axis=1, dtype=np.float64)
+        return proba / (len(self.roots_) * scale)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def prune_trees(forest: CompactForestClassifier, X, tolerance: float) -> Dict[str, Any]:
+    """
+    Cut the forest to the fewest leading trees whose predicted classes agree
+    with the whole forest on at least 1 - tolerance of the rows in X.
+    """
+    votes = np.cumsum(forest._tree_votes(X), axis=1, dtype=np.float64)
+    predicted = np.argmax(votes, axis=2)
+    agreement = (predicted == predicted[:, -1:]).mean(axis=0)
+    n_trees = int(np.argmax(agreement >= 1 - tolerance)) + 1
+    before = forest.n_estimators
+    forest.truncate(n_trees)
+    return {"trees_before": before, "trees_after": n_trees, "agreement": round(float(agreement[n_trees - 1]), 5)}
+
+def _forest_bytes(classifier) -> int:
+    """Bytes held by the node arrays of a sklearn forest or a compact forest."""
+    if isinstance(classifier, CompactForestClassifier):
+        return sum(getattr(classifier, name).nbytes for name in
+                   ("feature_", "threshold_", "left_", "right_", "roots_", "leaf_values_"))
+    return sum(estimator.tree_.__getstate__()["nodes"].nbytes + estimator.tree_.value.nbytes
+               for estimator in classifier.estimators_)
+
+def compact_pipeline(pipeline, X_check: Optional[pd.DataFrame] = None,
+                     leaf_precision: str = MODEL_LEAF_PRECISION,
+                     node_pruning_delta: float = MODEL_NODE_PRUNING_DELTA,
+                     tree_pruning_tolerance: float = MODEL_TREE_PRUNING_TOLERANCE) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Replace the random forest of a fitted pipeline with a CompactForestClassifier,
+    in place. X_check holds engineered training rows for tree pruning.
+    Returns (pipeline, report); pipelines without a forest are returned unchanged.
+    """
+    forest = pipeline.steps[-1][1]
+    if not isinstance(forest, FOREST_CLASSES):
+        return pipeline, {"compacted": False, "reason": f"{type(forest).__name__} is not a random forest"}
+
+    start = time.perf_counter()
+    compact = CompactForestClassifier(leaf_precision, node_pruning_delta).compact(forest)
+    report: Dict[str, Any] = {
+        "compacted": True,
+        "leaf_precision": leaf_precision,
+        "nodes_before": int(sum(estimator.tree_.node_count for estimator in forest.estimators_)),
+        "nodes_after": compact.node_count,
+        "tree_bytes_before": _forest_bytes(forest),
+    }
+    if tree_pruning_tolerance > 0 and X_check is not None and len(X_check):
+        sample = X_check.sample(min(len(X_check), TREE_PRUNING_ROWS), random_state=42)
+        report["tree_pruning"] = prune_trees(compact, pipeline[:-1].transform(sample), tree_pruning_tolerance)
+        report["nodes_after"] = compact.node_count
+    report["tree_bytes_after"] = _forest_bytes(compact)
+    report["seconds"] = round(time.perf_counter() - start, 3)
+
+    pipeline.steps[-1] = (pipeline.steps[-1][0], compact)
+    logger.info(f"Compacted forest from {report['nodes_before']} to {report['nodes_after']} nodes, "
+                f"{report['tree_bytes_before'] / 2 ** 20:.1f}MB to {report['tree_bytes_after'] / 2 ** 20:.1f}MB")
+    return pipeline, report
+
+class ZstdFile(io.RawIOBase):
+    """File object joblib compresses / decompresses zstd artifacts through."""
+
+    def __init__(self, fileobj, mode: str = "rb", compresslevel: int = 3):
+        import zstandard
+        super().__init__()
+        self._mode = mode
+        # joblib passes a path when dumping and an open file when loading
+        if isinstance(fileobj, (str, os.PathLike)):
+            fileobj = open(fileobj, mode)
+        if 'w' in mode:
+            self._stream = zstandard.ZstdCompressor(level=compresslevel).stream_writer(fileobj)
+        else:
+            self._stream = zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+    def readable(self) -> bool:
+        return 'r' in self._mode
+
+    def writable(self) -> bool:
+        return 'w' in self._mode
+
+    def readinto(self, buffer) -> int:
+        return self._stream.readinto(buffer)
+
+    def write(self, data) -> int:
+        return self._stream.write(data)
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+        super().close()
+
+_zstd_registered = False
+
+def register_zstd() -> bool:
+    """Make zstd available to joblib.dump / joblib.load; False without the zstandard package."""
+    global _zstd_registered
+    if not _zstd_registered:
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            return False
+        from joblib.compressor import CompressorWrapper
+        joblib.register_compressor('zstd', CompressorWrapper(ZstdFile, prefix=ZSTD_MAGIC, extension='.zst'),
+                                   force=True)
+        _zstd_registered = True
+    return True
+
+def parse_compression(spec: str):
+    """'zstd:3' -> ('zstd', 3), 'lz4' -> 'lz4', 'none' -> 0 (joblib's compress argument)."""
+    name, _, level = (spec or "none").strip().lower().partition(":")
+    if name in ("none", "0", ""):
+        return 0
+    if name == "zstd" and not register_zstd():
+        logger.warning("zstd model compression needs the zstandard package; using zlib")
+        name = "zlib"
+    return (name, int(level)) if level else name
+
+def dump_artifact(obj, path: str, compression: str = MODEL_COMPRESSION):
+    """joblib.dump with the configured compression."""
+    joblib.dump(obj, path, compress=parse_compression(compression))
+
+def load_artifact(path: str, mmap: bool = True):
+    """
+    joblib.load for artifacts written by dump_artifact. Uncompressed artifacts
+    are memory-mapped (read-only) unless mmap is False, e.g. to update them.
+    """
+    register_zstd()
+    with open(path, "rb") as f:
+        compressed = not f.read(1).startswith(PICKLE_PROTOCOL_OPCODE)
+    if compressed or not mmap:
+        return joblib.load(path)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return joblib.load(path, mmap_mode='r')
+
+def measure_artifact(pipeline, X_test: pd.DataFrame, y_test: pd.Series,
+                     compression: str = MODEL_COMPRESSION) -> Dict[str, Any]:
+    """Size, load time, single-row latency and accuracy of a pipeline saved with the given compression."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "model.pkl")
+        start = time.perf_counter()
+        dump_artifact(pipeline, path, compression)
+        dump_seconds = time.perf_counter() - start
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        loaded = load_artifact(path)
+        load_seconds = time.perf_counter() - start
+
+        loaded.predict_proba(X_test.iloc[:1])
+        timings = []
+        for i in range(min(200, len(X_test))):
+            start = time.perf_counter()
+            loaded.predict_proba(X_test.iloc[i:i + 1])
+            timings.append((time.perf_counter() - start) * 1000)
+        y_pred = loaded.predict(X_test)
+        del loaded
+    return {
+        "compression": compression,
+        "size_mb": round(size / 2 ** 20, 3),
+        "dump_seconds": round(dump_seconds, 4),
+        "load_seconds": round(load_seconds, 4),
+        "latency_p50_ms": round(float(np.percentile(timings, 50)), 3),
+        "accuracy": round(float(np.mean(y_pred == np.asarray(y_test))), 5),
+        "predictions": y_pred
+    }
+
+def compare_artifacts(pipeline, X_train: pd.DataFrame, X_test: pd.DataFrame, y_test: pd.Series,
+                      compression: str = MODEL_COMPRESSION, **compact_options) -> Tuple[Any, Dict[str, Any]]:
+    """Compact a fitted pipeline and report size, load time and accuracy before and after."""
+    before = measure_artifact(pipeline, X_test, y_test, compression="none")
+    compact, report = compact_pipeline(pipeline, X_train, **compact_options)
+    after = measure_artifact(compact, X_test, y_test, compression=compression)
+    report["agreement"] = round(float(np.mean(before.pop("predictions") == after.pop("predictions"))), 5)
+    report["before"], report["after"] = before, after
+    return compact, report
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Compact and compress a model artifact")
+    parser.add_argument("--model", default="../Model/best_spoilage_model_with_xgboost.pkl")
+    parser.add_argument("--data", default="training_data.csv",
+                        help="Training data path for the comparison, read through the training store")
+    parser.add_argument("--output", default=None, help="Write the optimized artifact to this path")
+    parser.add_argument("--compression", default=MODEL_COMPRESSION)
+    parser.add_argument("--leaf-precision", default=MODEL_LEAF_PRECISION, choices=list(LEAF_SCALES))
+    parser.add_argument("--node-pruning-delta", type=float, default=MODEL_NODE_PRUNING_DELTA)
+    parser.add_argument("--tree-pruning-tolerance", type=float, default=MODEL_TREE_PRUNING_TOLERANCE)
+    args = parser.parse_args()
+
+    from utils import engineer_features
+    from training import holdout_mask
+    from training_store import open_training_data
+
+    pipeline = load_artifact(args.model, mmap=False)
+    data = open_training_data(args.data).read()
+    X = engineer_features(data.drop(['Spoilage_Risk'], axis=1), features=getattr(pipeline, 'feature_set', None))
+    test_mask = holdout_mask(0, len(data))
+    compact, report = compare_artifacts(pipeline, X[~test_mask], X[test_mask], data['Spoilage_Risk'][test_mask],
+                                        compression=args.compression, leaf_precision=args.leaf_precision,
+                                        node_pruning_delta=args.node_pruning_delta,
+                                        tree_pruning_tolerance=args.tree_pruning_tolerance)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        dump_artifact(compact, args.output, args.compression)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Stress test for concurrent training data ingestion.
+
+Starts several uploader processes, each with several threads appending
+synthetic uploads to one segment store, while reader threads keep taking
+snapshots. Afterwards the store is checked for consistency:
+
+- every stored row has a unique, contiguous _ingest_seq,
+- the stored rows equal the sum of rows_added reported to the uploaders,
+- no row is stored twice, and the manifest and dedup index agree,
+- every snapshot a reader saw was a complete prefix of the final store.
+
+Usage:
+    python benchmark_ingest_concurrency.py --processes 4 --threads 4 --uploads 10 --rows 2000
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import logging
+import tempfile
+import threading
+import multiprocessing
+from typing import Dict, Any, List
+
+import numpy as np
+
+from synthetic_data import generate_synthetic_data
+from training_store import TrainingDataStore, row_hashes
+from dedup_index import RowHashIndex
+
+logger = logging.getLogger(__name__)
+
+# Share of each upload repeated from the uploader's previous upload, to exercise deduplication
+REPEATED_FRACTION = 0.1
+
+def _uploader(store_dir: str, worker: int, threads: int, uploads: int, rows: int,
+              results: "multiprocessing.Queue"):
+    """One uploader process: threads appending uploads through the process's writer."""
+    store = TrainingDataStore(store_dir)
+    latencies: List[float] = []
+    added = [0]
+    lock = threading.Lock()
+
+    def upload_loop(thread: int):
+        previous = None
+        for upload in range(uploads):
+            seed = (worker * 1000 + thread) * 1000 + upload
+            data = generate_synthetic_data(rows, seed=seed)
+            if previous is not None:
+                data.iloc[:int(rows * REPEATED_FRACTION)] = previous.iloc[:int(rows * REPEATED_FRACTION)].values
+            start = time.perf_counter()
+            _, report = store.append(data)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                added[0] += report["rows_added"]
+            previous = data
+
+    pool = [threading.Thread(target=upload_loop, args=(thread,)) for thread in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put({"worker": worker, "rows_added": added[0], "latencies": latencies})
+
+def _stored_seqs(store: TrainingDataStore) -> np.ndarray:
+    positions = [positions for positions, _ in store.iter_chunks(100_000, columns=['Spoilage_Risk'])]
+    return np.sort(np.concatenate(positions)) if positions else np.array([], dtype=np.int64)
+
+def _reader(store_dir: str, stop: threading.Event, observed: List[Dict[str, Any]]):
+    """Take snapshots until stopped; every one must be a contiguous prefix of sequence numbers."""
+    store = TrainingDataStore(store_dir)
+    while not stop.is_set():
+        snapshot = store.snapshot()
+        seqs = _stored_seqs(store)
+        observed.append({
+            "rows": len(seqs),
+            # Another append may commit between the two reads, never a partial one
+            "consistent": bool(len(seqs) >= snapshot["next_seq"]
+                               and np.array_equal(seqs, np.arange(len(seqs))))
+        })
+
+def run_benchmark(store_dir: str, processes: int, threads: int, uploads: int, rows: int,
+                  readers: int = 2) -> Dict[str, Any]:
+    TrainingDataStore(store_dir)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    stop = threading.Event()
+    observed: List[Dict[str, Any]] = []
+    reader_threads = [threading.Thread(target=_reader, args=(store_dir, stop, observed)) for _ in range(readers)]
+
+    start = time.perf_counter()
+    for reader in reader_threads:
+        reader.start()
+    workers = [context.Process(target=_uploader, args=(store_dir, worker, threads, uploads, rows, results))
+               for worker in range(processes)]
+    for worker in workers:
+        worker.start()
+    worker_results = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for reader in reader_threads:
+        reader.join()
+
+    store = TrainingDataStore(store_dir)
+    stored = store.read(columns=None)
+    seqs = _stored_seqs(store)
+    reported_added = sum(result["rows_added"] for result in worker_results)
+    latencies = np.array([latency for result in worker_results for latency in result["latencies"]])
+    index = RowHashIndex(os.path.join(store_dir, "dedup_index"))
+
+    checks = {
+        "seqs_contiguous": bool(np.array_equal(seqs, np.arange(len(seqs)))),
+        "rows_match_reported": len(stored) == reported_added,
+        "rows_match_state": len(stored) == store.snapshot()["next_seq"],
+        "no_duplicate_rows": not bool(np.unique(row_hashes(stored)).size != len(stored)),
+        "manifest_matches": store.stats()["rows"] == len(stored),
+        "index_matches": index.covered_seq == len(stored),
+        "snapshots_consistent": all(snapshot["consistent"] for snapshot in observed),
+        "wal_checkpointed": os.path.getsize(os.path.join(store_dir, "wal.log")) == 0
+    }
+    total_uploads = processes * threads * uploads
+    return {
+        "processes": processes,
+        "threads_per_process": threads,
+        "uploads": total_uploads,
+        "rows_per_upload": rows,
+        "rows_stored": len(stored),
+        "duplicates_dropped": total_uploads * rows - len(stored),
+        "seconds": round(elapsed, 3),
+        "uploads_per_second": round(total_uploads / elapsed, 2),
+        "rows_per_second": round(total_uploads * rows / elapsed, 1),
+        "upload_latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "upload_latency_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+        "reader_snapshots": len(observed),
+        "checks": checks,
+        "passed": all(checks.values())
+    }
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Stress test concurrent training data ingestion")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4, help="Uploader threads per process")
+    parser.add_argument("--uploads", type=int, default=10, help="Uploads per thread")
+    parser.add_argument("--rows", type=int, default=2000, help="Rows per upload")
+    parser.add_argument("--readers", type=int, default=2, help="Concurrent snapshot reader threads")
+    parser.add_argument("--store-dir", default=None,
+                        help="Store directory (default: a temporary directory that is removed afterwards)")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    store_dir = args.store_dir or tempfile.mkdtemp(prefix="ingest-benchmark-")
+    try:
+        report = run_benchmark(store_dir, args.processes, args.threads, args.uploads, args.rows, args.readers)
+    finally:
+        if args.store_dir is None:
+            shutil.rmtree(store_dir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    raise SystemExit(0 if report["passed"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Benchmark candidate models on accuracy and serving cost.
+
+Every candidate is trained (or loaded from an existing artifact) on each
+dataset and measured on the same deterministic holdout: accuracy and macro /
+weighted F1, single-row p50/p95/p99 latency, batch-of-1k throughput, fit time,
+feature matrix memory, artifact size and load time. Candidates are the
+production model families plus the soft-voting and stacking ensembles from the
+notebooks; existing pipelines can be added with --model name=path.pkl.
+
+Runs are reproducible: fixed seeds, the training code's hash-based holdout and
+a fixed sample of latency rows. The report (JSON) also records the dataset
+fingerprints, library versions and machine, and, with --latency-slo-ms, the
+most accurate candidate per dataset whose p99 latency meets the SLO.
+
+Usage:
+    python benchmark_model_families.py
+    python benchmark_model_families.py --families random_forest xgboost voting --latency-slo-ms 50
+    python benchmark_model_families.py --data training_data.csv --model current=../Model/best_spoilage_model_with_xgboost.pkl
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import logging
+import platform
+import tempfile
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.metrics import accuracy_score, f1_score
+
+from utils import engineer_features
+from training import build_model_pipeline, holdout_mask
+from dataset_loader import load_source, DEFAULT_DATASET_SOURCES
+from distillation import build_teacher_pipeline, ENSEMBLE_FAMILIES
+from artifact_compression import load_artifact
+
+logger = logging.getLogger(__name__)
+
+# The two bundled datasets large enough to benchmark on
+BENCHMARK_DATASETS = DEFAULT_DATASET_SOURCES[:2]
+DEFAULT_FAMILIES = ['random_forest', 'hist_gradient_boosting', 'hist_gradient_boosting_native',
+                    'xgboost'] + ENSEMBLE_FAMILIES
+LATENCY_SAMPLE_ROWS = 200
+BATCH_ROWS = 1000
+BATCH_REPEATS = 5
+DEFAULT_REPORT_PATH = "benchmark_report.json"
+
+def build_candidate(model_family: str, X_train: pd.DataFrame, n_jobs: int = -1):
+    """Unfitted pipeline for a production model family or one of the notebook ensembles."""
+    if model_family in ENSEMBLE_FAMILIES:
+        return build_teacher_pipeline(X_train, model_family, n_jobs=n_jobs)
+    return build_model_pipeline(X_train, n_jobs=n_jobs, model_family=model_family)
+
+def measure_pipeline(pipeline, X_test: pd.DataFrame, y_test: pd.Series) -> Dict[str, Any]:
+    """Serving cost and holdout quality of a fitted pipeline."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_file = os.path.join(tmp_dir, "model.pkl")
+        joblib.dump(pipeline, model_file)
+        model_size = os.path.getsize(model_file)
+        start = time.perf_counter()
+        joblib.load(model_file)
+        load_seconds = time.perf_counter() - start
+
+    # One warm-up call so lazy initialisation is not counted as latency
+    pipeline.predict_proba(X_test.iloc[:1])
+    timings = []
+    for i in range(min(LATENCY_SAMPLE_ROWS, len(X_test))):
+        row = X_test.iloc[i:i + 1]
+        start = time.perf_counter()
+        pipeline.predict_proba(row)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    batch = X_test.iloc[:BATCH_ROWS]
+    batch_timings = []
+    for _ in range(BATCH_REPEATS):
+        start = time.perf_counter()
+        pipeline.predict_proba(batch)
+        batch_timings.append(time.perf_counter() - start)
+
+    y_pred = pipeline.predict(X_test)
+    return {
+        "model_size_mb": round(model_size / 1024 / 1024, 3),
+        "load_seconds": round(load_seconds, 4),
+        "latency_p50_ms": round(float(np.percentile(timings, 50)), 3),
+        "latency_p95_ms": round(float(np.percentile(timings, 95)), 3),
+        "latency_p99_ms": round(float(np.percentile(timings, 99)), 3),
+        "batch_rows": len(batch),
+        "batch_rows_per_second": round(len(batch) / float(np.median(batch_timings)), 1),
+        "accuracy": round(float(accuracy_score(y_test, y_pred)), 4),
+        "f1_macro": round(float(f1_score(y_test, y_pred, average='macro')), 4),
+        "f1_weighted": round(float(f1_score(y_test, y_pred, average='weighted')), 4)
+    }
+
+def benchmark_family(model_family: str, X_train: pd.DataFrame, y_train: pd.Series,
+                     X_test: pd.DataFrame, y_test: pd.Series, n_jobs: int = -1) -> Dict[str, Any]:
+    """Fit one model family and measure its cost and accuracy."""
+    pipeline = build_candidate(model_family, X_train, n_jobs=n_jobs)
+
+    start = time.perf_counter()
+    pipeline.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    matrix = pipeline[:-1].transform(X_train)
+
+    result = {
+        "model_family": model_family,
+        "source": "trained",
+        "fit_seconds": round(fit_seconds, 3),
+        "feature_columns": int(matrix.shape[1]),
+        "feature_matrix_mb": round(matrix.nbytes / 1024 / 1024, 2),
+        "feature_dtype": str(matrix.dtype)
+    }
+    result.update(measure_pipeline(pipeline, X_test, y_test))
+    return result
+
+def benchmark_artifact(name: str, path: str, X_test: pd.DataFrame, y_test: pd.Series) -> Dict[str, Any]:
+    """Measure an existing pipeline artifact; it is not refit."""
+    pipeline = load_artifact(path, mmap=False)
+    result = {"model_family": name, "source": os.path.abspath(path), "fit_seconds": None}
+    result.update(measure_pipeline(pipeline, X_test, y_test))
+    return result
+
+def benchmark_model_families(data: pd.DataFrame, families: List[str], n_jobs: int = -1,
+                             artifacts: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+    """Benchmark each family (and artifact) on the same deterministic train/holdout split."""
+    X = engineer_features(data.drop(['Spoilage_Risk'], axis=1, errors='ignore'))
+    y = data['Spoilage_Risk']
+    test_mask = holdout_mask(0, len(data))
+
+    results = []
+    for family in families:
+        logger.info(f"Benchmarking {family}")
+        try:
+            results.append(benchmark_family(family, X[~test_mask], y[~test_mask],
+                                            X[test_mask], y[test_mask], n_jobs=n_jobs))
+        except Exception as e:
+            logger.error(f"Benchmark of {family} failed: {str(e)}")
+            results.append({"model_family": family, "error": str(e)})
+    for name, path in (artifacts or {}).items():
+        logger.info(f"Benchmarking artifact {name} ({path})")
+        try:
+            results.append(benchmark_artifact(name, path, X[test_mask], y[test_mask]))
+        except Exception as e:
+            logger.error(f"Benchmark of artifact {name} failed: {str(e)}")
+            results.append({"model_family": name, "source": os.path.abspath(path), "error": str(e)})
+    return results
+
+def dataset_fingerprint(path: str, data: pd.DataFrame) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest() if hasattr(hashlib, "file_digest") \
+            else hashlib.sha256(f.read()).hexdigest()
+    return {
+        "path": os.path.abspath(path),
+        "sha256": digest,
+        "rows": len(data),
+        "holdout_rows": int(holdout_mask(0, len(data)).sum()),
+        "class_counts": {str(k): int(v) for k, v in data['Spoilage_Risk'].value_counts().sort_index().items()}
+    }
+
+def environment() -> Dict[str, Any]:
+    """Library versions and machine details the results depend on."""
+    versions = {}
+    for module in ("numpy", "pandas", "sklearn", "xgboost", "joblib"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "libraries": versions
+    }
+
+def recommend(results: List[Dict[str, Any]], latency_slo_ms: float) -> Optional[Dict[str, Any]]:
+    """Most accurate (macro F1) candidate whose p99 single-row latency meets the SLO."""
+    eligible = [r for r in results if "error" not in r and r["latency_p99_ms"] <= latency_slo_ms]
+    if not eligible:
+        return None
+    best = max(eligible, key=lambda r: (r["f1_macro"], r["accuracy"], -r["latency_p99_ms"]))
+    return {key: best[key] for key in ("model_family", "f1_macro", "accuracy", "latency_p99_ms")}
+
+def run_benchmark(datasets: List[str], families: List[str], n_jobs: int = -1,
+                  artifacts: Optional[Dict[str, str]] = None,
+                  latency_slo_ms: Optional[float] = None) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        "created_at": datetime.now().isoformat(),
+        "environment": environment(),
+        "settings": {
+            "families": families,
+            "artifacts": artifacts or {},
+            "n_jobs": n_jobs,
+            "latency_sample_rows": LATENCY_SAMPLE_ROWS,
+            "batch_rows": BATCH_ROWS,
+            "latency_slo_ms": latency_slo_ms
+        },
+        "datasets": []
+    }
+    for path in datasets:
+        data, _ = load_source(path)
+        logger.info(f"Benchmarking on {path} ({len(data)} rows)")
+        results = benchmark_model_families(data, families, n_jobs=n_jobs, artifacts=artifacts)
+        entry = {"dataset": dataset_fingerprint(path, data), "results": results}
+        if latency_slo_ms is not None:
+            for result in results:
+                if "error" not in result:
+                    result["meets_latency_slo"] = result["latency_p99_ms"] <= latency_slo_ms
+            entry["recommended"] = recommend(results, latency_slo_ms)
+        report["datasets"].append(entry)
+    return report
+
+def parse_artifacts(values: List[str]) -> Dict[str, str]:
+    artifacts = {}
+    for value in values:
+        name, sep, path = value.partition("=")
+        if not sep:
+            name, path = os.path.splitext(os.path.basename(value))[0], value
+        artifacts[name] = path
+    return artifacts
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Benchmark candidate models on accuracy and serving cost")
+    parser.add_argument("--datasets", nargs="+", default=BENCHMARK_DATASETS,
+                        help="Datasets to benchmark on (default: the bundled datasets)")
+    parser.add_argument("--data", default=None, help="Benchmark on this single dataset instead")
+    parser.add_argument("--families", nargs="+", default=DEFAULT_FAMILIES)
+    parser.add_argument("--model", action="append", default=[], metavar="NAME=PATH",
+                        help="Also benchmark an existing pipeline artifact (repeatable)")
+    parser.add_argument("--latency-slo-ms", type=float, default=None,
+                        help="Flag candidates by p99 single-row latency and recommend one per dataset")
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--output", default=DEFAULT_REPORT_PATH, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    datasets = [args.data] if args.data else args.datasets
+    report = run_benchmark(datasets, args.families, n_jobs=args.n_jobs,
+                           artifacts=parse_artifacts(args.model), latency_slo_ms=args.latency_slo_ms)
+
+    for entry in report["datasets"]:
+        print(f"\n{os.path.basename(entry['dataset']['path'])} ({entry['dataset']['rows']} rows)")
+        print(f"{'Model':<30} {'Fit s':<7} {'Size MB':<8} {'Load s':<7} {'p50 ms':<7} {'p99 ms':<7} "
+              f"{'1k rows/s':<10} {'Accuracy':<9} {'F1 macro'}")
+        for r in entry["results"]:
+            if "error" in r:
+                print(f"{r['model_family']:<30} failed: {r['error']}")
+                continue
+            print(f"{r['model_family']:<30} {str(r['fit_seconds']):<7} {r['model_size_mb']:<8} "
+                  f"{r['load_seconds']:<7} {r['latency_p50_ms']:<7} {r['latency_p99_ms']:<7} "
+                  f"{r['batch_rows_per_second']:<10} {r['accuracy']:<9} {r['f1_macro']}")
+        if entry.get("recommended"):
+            print(f"Recommended under {args.latency_slo_ms} ms p99: {entry['recommended']['model_family']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+if __name__ == "__main__":
+    main()
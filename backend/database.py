@@ -188,31 +188,31 @@ def get_database():
 # Collection helpers
 def get_users_collection():
     """Get users collection"""
-    if not MONGODB_AVAILABLE or not mongodb.database:
+    if not MONGODB_AVAILABLE or mongodb.database is None:
         return None
     return mongodb.database.users
 
 def get_products_collection():
     """Get products collection"""
-    if not MONGODB_AVAILABLE or not mongodb.database:
+    if not MONGODB_AVAILABLE or mongodb.database is None:
         return None
     return mongodb.database.products
 
 def get_predictions_collection():
     """Get predictions collection"""
-    if not MONGODB_AVAILABLE or not mongodb.database:
+    if not MONGODB_AVAILABLE or mongodb.database is None:
         return None
     return mongodb.database.predictions
 
 def get_training_data_collection():
     """Get training data collection"""
-    if not MONGODB_AVAILABLE or not mongodb.database:
+    if not MONGODB_AVAILABLE or mongodb.database is None:
         return None
     return mongodb.database.training_data
 
 def get_analytics_collection():
     """Get analytics collection"""
-    if not MONGODB_AVAILABLE or not mongodb.database:
+    if not MONGODB_AVAILABLE or mongodb.database is None:
         return None
     return mongodb.database.analytics
 
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Multi-source dataset loader for Surplus2Serve.
+
+Unions every configured training data source (CSV or .xlsx) into one frame
+with a harmonized schema:
+
+- missing Commodity_Category is derived from Commodity_name,
+- missing Location / Ethylene_Level columns are added ('Unknown' / NaN),
+- storage spellings such as 'open_air_storage' are mapped to the API's values.
+
+Columns use compact dtypes (category, float32, int8). CSVs are parsed with the
+pyarrow engine when available, and each source is converted once into a cached
+Parquet copy that is reused until the source file changes. The uploaded
+training data is added through the training store (training_store.py), so it
+includes every upload rather than a snapshot of training_data.csv.
+
+Usage:
+    python dataset_loader.py [--no-cache] [source ...]
+"""
+
+import os
+import sys
+import time
+import hashlib
+import argparse
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils import get_commodity_category
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_DATASET_SOURCES = [
+    os.path.join(BACKEND_DIR, "..", "Model", "large_enhanced_produce_spoilage_dataset.csv"),
+    os.path.join(BACKEND_DIR, "..", "Model", "Datasets", "datasets_20000.csv"),
+    os.path.join(BACKEND_DIR, "..", "Model", "Datasets", "enhanced_produce_spoilage_dataset.csv"),
+    os.path.join(BACKEND_DIR, "..", "Model", "Datasets", "datasets_better version.xlsx"),
+]
+# Uploaded training data; read through the training store, not as a source file
+TRAINING_DATA_PATH = os.path.join(BACKEND_DIR, "training_data.csv")
+
+# Sources to load, separated by os.pathsep; defaults to DEFAULT_DATASET_SOURCES
+DATASET_SOURCES = [path for path in os.getenv("DATASET_SOURCES", "").split(os.pathsep) if path] \
+    or DEFAULT_DATASET_SOURCES
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", os.path.join(BACKEND_DIR, "dataset_cache"))
+
+# Bump when harmonization changes so stale Parquet copies are not reused
+SCHEMA_VERSION = 1
+
+CATEGORY_COLUMNS = ['Storage_Type', 'Packaging_Quality', 'Commodity_name', 'Commodity_Category', 'Location']
+FLOAT_COLUMNS = ['Temperature', 'Humidity', 'Transport_Duration', 'Ethylene_Level']
+INT8_COLUMNS = ['Days_Since_Harvest', 'Month_num', 'Spoilage_Risk']
+REQUIRED_COLUMNS = ['Temperature', 'Humidity', 'Storage_Type', 'Days_Since_Harvest',
+                    'Commodity_name', 'Spoilage_Risk']
+SCHEMA_COLUMNS = [
+    'Temperature', 'Humidity', 'Storage_Type', 'Days_Since_Harvest', 'Transport_Duration',
+    'Packaging_Quality', 'Month_num', 'Commodity_name', 'Commodity_Category', 'Location',
+    'Ethylene_Level', 'Spoilage_Risk'
+]
+
+STORAGE_TYPE_ALIASES = {
+    'open_air_storage': 'open_air',
+    'open air': 'open_air',
+    'cold storage': 'cold_storage',
+    'room temperature': 'room_temperature',
+}
+# Defaults for optional columns, matching PredictionRequest
+COLUMN_DEFAULTS = {
+    'Transport_Duration': 8.0,
+    'Packaging_Quality': 'good',
+    'Month_num': 7,
+    'Location': 'Unknown',
+    'Ethylene_Level': np.nan,
+}
+
+def harmonize_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Bring a raw source frame to the shared schema with compact dtypes."""
+    df = df.rename(columns=lambda col: str(col).strip())
+    # Frames read back from the training store are categorical, and fillna cannot add categories
+    df = df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+    missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {missing}")
+
+    for col, default in COLUMN_DEFAULTS.items():
+        if col not in df.columns:
+            df[col] = default
+        elif not pd.isna(default):
+            df[col] = df[col].fillna(default)
+
+    for col in ('Storage_Type', 'Packaging_Quality'):
+        values = df[col].astype(str).str.strip().str.lower()
+        df[col] = values.replace(STORAGE_TYPE_ALIASES) if col == 'Storage_Type' else values
+    df['Commodity_name'] = df['Commodity_name'].astype(str).str.strip()
+
+    derived_category = df['Commodity_name'].map(get_commodity_category)
+    if 'Commodity_Category' in df.columns:
+        df['Commodity_Category'] = df['Commodity_Category'].where(df['Commodity_Category'].notna(),
+                                                                  derived_category)
+    else:
+        df['Commodity_Category'] = derived_category
+
+    df = df.dropna(subset=REQUIRED_COLUMNS)
+    for col in FLOAT_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype(np.float32)
+    for col in INT8_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df = df.dropna(subset=INT8_COLUMNS)
+    for col in INT8_COLUMNS:
+        df[col] = df[col].astype(np.int8)
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype(str).astype('category')
+
+    return df[SCHEMA_COLUMNS].reset_index(drop=True)
+
+def _read_source(path: str) -> pd.DataFrame:
+    if path.lower().endswith(('.xlsx', '.xls')):
+        return pd.read_excel(path)
+    if PYARROW_AVAILABLE:
+        return pd.read_csv(path, engine='pyarrow')
+    return pd.read_csv(path)
+
+def _cache_path(path: str, cache_dir: str) -> str:
+    stat = os.stat(path)
+    key = hashlib.sha1(
+        f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{SCHEMA_VERSION}".encode()
+    ).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(path))[0].replace(' ', '_')
+    return os.path.join(cache_dir, f"{stem}-{key}.parquet")
+
+def load_source(path: str, cache_dir: Optional[str] = DATASET_CACHE_DIR) -> Tuple[pd.DataFrame, bool]:
+    """
+    Load and harmonize one source, going through its cached Parquet copy when
+    possible. Returns (frame, whether the cache was used).
+    """
+    use_cache = cache_dir is not None and PYARROW_AVAILABLE
+    if use_cache:
+        cached = _cache_path(path, cache_dir)
+        if os.path.exists(cached):
+            return pd.read_parquet(cached), True
+
+    df = harmonize_schema(_read_source(path))
+
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cached}.tmp-{os.getpid()}"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, cached)
+    return df, False
+
+def load_training_store(training_data_path: str = TRAINING_DATA_PATH) -> pd.DataFrame:
+    """Harmonized uploaded training data, read through the training store."""
+    from training_store import open_training_data  # training_store imports this module
+    store = open_training_data(training_data_path)
+    if not store.row_count():
+        raise FileNotFoundError(f"No training data in {training_data_path}")
+    return harmonize_schema(store.read())
+
+def load_datasets(sources: Optional[List[str]] = None,
+                  cache_dir: Optional[str] = DATASET_CACHE_DIR,
+                  deduplicate: bool = True) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Union all available sources into one compact frame.
+    Without explicit sources the uploaded training data is added as well.
+    Returns (data, report) where report lists rows and load time per source,
+    the total load time and the memory used by the result.
+    """
+    start = time.perf_counter()
+    frames = []
+    report: Dict[str, Any] = {"sources": [], "parquet_cache": cache_dir is not None and PYARROW_AVAILABLE}
+
+    for path in sources or DATASET_SOURCES:
+        if not os.path.exists(path):
+            continue
+        source_start = time.perf_counter()
+        try:
+            df, cached = load_source(path, cache_dir)
+        except Exception as e:
+            logger.warning(f"Skipping dataset source {path}: {str(e)}")
+            report["sources"].append({"path": path, "error": str(e)})
+            continue
+        frames.append(df)
+        report["sources"].append({
+            "path": path,
+            "rows": len(df),
+            "cached": cached,
+            "seconds": round(time.perf_counter() - source_start, 4)
+        })
+
+    if sources is None:
+        source_start = time.perf_counter()
+        try:
+            df = load_training_store()
+        except Exception as e:
+            logger.warning(f"Skipping uploaded training data: {str(e)}")
+            report["sources"].append({"path": TRAINING_DATA_PATH, "error": str(e)})
+        else:
+            frames.append(df)
+            report["sources"].append({
+                "path": TRAINING_DATA_PATH,
+                "rows": len(df),
+                "cached": False,
+                "seconds": round(time.perf_counter() - source_start, 4)
+            })
+
+    if not frames:
+        raise FileNotFoundError("No dataset sources could be loaded")
+
+    data = pd.concat(frames, ignore_index=True)
+    # Concatenating categoricals with different levels falls back to object
+    for col in CATEGORY_COLUMNS:
+        data[col] = data[col].astype('category')
+    rows_before = len(data)
+    if deduplicate:
+        data = data.drop_duplicates(ignore_index=True)
+
+    report.update({
+        "rows": len(data),
+        "duplicates_dropped": rows_before - len(data),
+        "memory_mb": round(data.memory_usage(deep=True).sum() / 1024 / 1024, 2),
+        "load_seconds": round(time.perf_counter() - start, 4)
+    })
+    logger.info(f"Loaded {report['rows']} rows from {len(frames)} source(s) in "
+                f"{report['load_seconds']:.2f}s using {report['memory_mb']:.1f} MB")
+    return data, report
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Load and harmonize all training data sources")
+    parser.add_argument("sources", nargs="*",
+                        help="Source files (defaults to DATASET_SOURCES plus the uploaded training data)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write Parquet copies")
+    args = parser.parse_args()
+
+    data, report = load_datasets(args.sources or None,
+                                 cache_dir=None if args.no_cache else DATASET_CACHE_DIR)
+    for source in report["sources"]:
+        if "error" in source:
+            print(f"  {source['path']}: skipped ({source['error']})")
+        else:
+            print(f"  {source['path']}: {source['rows']} rows in {source['seconds']:.2f}s"
+                  f"{' (cached)' if source['cached'] else ''}")
+    print(f"Total: {report['rows']} rows ({report['duplicates_dropped']} duplicates dropped), "
+          f"{report['memory_mb']} MB, {report['load_seconds']:.2f}s")
+    data.info(memory_usage='deep', buf=sys.stdout)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Incrementally maintained statistics for the training dataset.
+
+The manifest is a small JSON file updated with every append to the training
+data (see training_store.py), so row counts and dataset statistics can be
+served without reading the data:
+
+- total rows, class distribution, rows per commodity, category and storage type,
+- count / min / max / mean / std of the numeric columns,
+- fixed-bin histograms of the numeric inputs, overall and per commodity
+  category (the reference distribution of drift_monitor.py),
+- details of the last upload.
+
+Numeric columns keep running sums so appends merge in O(upload). If the
+manifest does not match the data it describes (e.g. after a crash or a manual
+edit), it is rebuilt with one chunked pass over the data.
+"""
+
+import os
+import math
+import json
+import logging
+from datetime import datetime
+from typing import Dict, Any, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 2
+
+NUMERIC_COLUMNS = ['Temperature', 'Humidity', 'Days_Since_Harvest', 'Transport_Duration',
+                   'Month_num', 'Ethylene_Level']
+COUNT_COLUMNS = {
+    'class_counts': 'Spoilage_Risk',
+    'commodity_counts': 'Commodity_name',
+    'category_counts': 'Commodity_Category',
+    'storage_type_counts': 'Storage_Type',
+    'packaging_quality_counts': 'Packaging_Quality',
+}
+# Histogram bins (low, high, number of bins) of the prediction inputs, spanning the
+# ranges PredictionRequest accepts; values outside fall into the outer bins.
+# Ethylene_Level is left out: predictions without it are served as 0.
+HISTOGRAM_BINS = {
+    'Temperature': (0.0, 50.0, 25),
+    'Humidity': (0.0, 100.0, 20),
+    'Days_Since_Harvest': (0.0, 31.0, 31),
+    'Transport_Duration': (0.0, 72.0, 24),
+    'Month_num': (0.5, 12.5, 12),
+}
+# Histogram key of all rows, next to the per commodity category histograms
+ALL_GROUP = "__all__"
+
+def histogram_bins(col: str, values: np.ndarray) -> np.ndarray:
+    """Bin index of every value of a histogram column."""
+    low, high, bins = HISTOGRAM_BINS[col]
+    index = np.floor((np.asarray(values, dtype=np.float64) - low) * (bins / (high - low)))
+    return np.clip(index, 0, bins - 1).astype(np.int64)
+
+def histogram_bin(col: str, value: float) -> int:
+    """histogram_bins for a single value, without numpy overhead."""
+    low, high, bins = HISTOGRAM_BINS[col]
+    return min(max(int(math.floor((value - low) * (bins / (high - low)))), 0), bins - 1)
+
+def empty_manifest() -> Dict[str, Any]:
+    manifest: Dict[str, Any] = {"version": MANIFEST_VERSION, "rows": 0}
+    manifest.update({key: {} for key in COUNT_COLUMNS})
+    manifest["numeric"] = {}
+    manifest["histograms"] = {}
+    manifest["last_upload"] = None
+    manifest["updated_at"] = None
+    return manifest
+
+def add_rows(manifest: Dict[str, Any], rows: pd.DataFrame) -> Dict[str, Any]:
+    """Merge the statistics of newly stored rows into the manifest (in place)."""
+    manifest["rows"] += len(rows)
+    if rows.empty:
+        return manifest
+
+    for key, col in COUNT_COLUMNS.items():
+        if col not in rows.columns:
+            continue
+        counts = manifest[key]
+        for value, count in rows[col].astype(str).value_counts().items():
+            counts[value] = counts.get(value, 0) + int(count)
+
+    for col in NUMERIC_COLUMNS:
+        if col not in rows.columns:
+            continue
+        values = pd.to_numeric(rows[col], errors='coerce').to_numpy(dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            continue
+        stats = manifest["numeric"].setdefault(col, {"count": 0, "sum": 0.0, "sum_sq": 0.0,
+                                                     "min": None, "max": None})
+        stats["count"] += len(values)
+        stats["sum"] += float(values.sum())
+        stats["sum_sq"] += float(np.square(values).sum())
+        stats["min"] = float(values.min()) if stats["min"] is None else min(stats["min"], float(values.min()))
+        stats["max"] = float(values.max()) if stats["max"] is None else max(stats["max"], float(values.max()))
+        stats["mean"] = stats["sum"] / stats["count"]
+        stats["std"] = float(np.sqrt(max(stats["sum_sq"] / stats["count"] - stats["mean"] ** 2, 0.0)))
+
+    groups = rows['Commodity_Category'].astype(str).to_numpy() if 'Commodity_Category' in rows.columns else None
+    for col in HISTOGRAM_BINS:
+        if col not in rows.columns:
+            continue
+        values = pd.to_numeric(rows[col], errors='coerce').to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        if not valid.any():
+            continue
+        n_bins = HISTOGRAM_BINS[col][2]
+        bins = histogram_bins(col, values[valid])
+        histograms = manifest["histograms"].setdefault(col, {})
+        counts = {ALL_GROUP: np.bincount(bins, minlength=n_bins)}
+        if groups is not None:
+            # One bincount over (group, bin) pairs covers every category
+            names, codes = np.unique(groups[valid], return_inverse=True)
+            grouped = np.bincount(codes * n_bins + bins, minlength=len(names) * n_bins).reshape(len(names), n_bins)
+            counts.update(zip(names, grouped))
+        for group, group_counts in counts.items():
+            previous = histograms.get(group)
+            merged = group_counts if previous is None else group_counts + np.asarray(previous, dtype=np.int64)
+            histograms[group] = merged.astype(int).tolist()
+    return manifest
+
+class DatasetManifest:
+    """Statistics manifest stored as JSON next to the training data."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "r") as f:
+            manifest = json.load(f)
+        return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+    def update(self, rows: pd.DataFrame, upload: Optional[Dict[str, Any]] = None,
+               extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Add stored rows and record the upload they came from."""
+        manifest = add_rows(self.load() or empty_manifest(), rows)
+        if upload is not None:
+            manifest["last_upload"] = dict(upload, timestamp=datetime.now().isoformat())
+        manifest.update(extra or {})
+        self._write(manifest)
+        return manifest
+
+    def rebuild(self, chunks: Iterable[pd.DataFrame],
+                extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Recompute the manifest from all stored rows, keeping last_upload."""
+        previous = self.load()
+        manifest = empty_manifest()
+        for chunk in chunks:
+            add_rows(manifest, chunk)
+        manifest["last_upload"] = previous.get("last_upload") if previous else None
+        manifest.update(extra or {})
+        self._write(manifest)
+        logger.info(f"Rebuilt dataset manifest from {manifest['rows']} rows")
+        return manifest
+
+    def _write(self, manifest: Dict[str, Any]):
+        manifest["updated_at"] = datetime.now().isoformat()
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+def public_stats(manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """Manifest as served by the API, without the running sums."""
+    stats = {key: value for key, value in manifest.items() if key not in ("numeric", "histograms", "version")}
+    stats["numeric"] = {
+        col: {name: values[name] for name in ("count", "min", "max", "mean", "std")}
+        for col, values in manifest["numeric"].items()
+    }
+    return stats
@@ -217,14 +217,17 @@ class TrainingDataInDB(BaseModel):
     uploaded_by: PyObjectId
     filename: str
     
-    # Data content
-    data_records: List[Dict[str, Any]]
+    # Data content (rows are kept in the training data store, not in MongoDB)
+    data_records: Optional[List[Dict[str, Any]]] = None
     total_records: int
+    rows_added: Optional[int] = None
+    duplicates_existing: Optional[int] = None
+    duplicates_in_upload: Optional[int] = None
     
     # Metadata
     upload_timestamp: datetime = Field(default_factory=datetime.utcnow)
     file_size: int  # in bytes
-    validation_status: str = "pending"  # pending, valid, invalid
+    validation_status: str = "pending"  # pending, valid, quarantined (invalid rows set aside), invalid
     validation_errors: Optional[List[str]] = None
     
     class Config:
@@ -0,0 +1,201 @@
+"""
+Persistent row-fingerprint index for training data deduplication.
+
+Holds the 64-bit content hash of every stored training row (see
+training_store.row_hashes) as sorted runs of uint64 on disk, each with its
+own Bloom filter. Checking an upload costs O(upload) Bloom lookups per run;
+only rows a run's filter cannot rule out are binary searched in that run.
+Runs and filters are memory-mapped rather than loaded. New hashes are
+written as a new run with a new filter, so an upload never rewrites the
+existing ones. Runs are merged by size tier: once RUN_MERGE_FACTOR runs fall
+in the same tier (floor(log_factor(rows))) they are merged into one run of a
+higher tier, which keeps the number of runs logarithmic in the row count and
+rewrites every hash only once per tier.
+
+Layout (all files replaced atomically, the manifest last):
+    index.json          runs (file, Bloom filter, size, row count), covered_seq
+    bloom-<id>.npy      Bloom filter bits of one run (uint8)
+    run-<id>.npy        sorted unique hashes
+"""
+
+import os
+import json
+import uuid
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "index.json"
+# Runs of the same size tier merged into one
+RUN_MERGE_FACTOR = 4
+# Bloom filter sizing: ~1% false positives at 10 bits and 7 probes per entry
+BLOOM_BITS_PER_ENTRY = 10
+BLOOM_HASHES = 7
+BLOOM_MIN_BITS = 1 << 10
+
+class RowHashIndex:
+    """Sorted-run hash set with a Bloom filter pre-check per run."""
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self._manifest = self._read_manifest()
+        self._runs: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None
+
+    # -- manifest ------------------------------------------------------------
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                manifest = json.load(f)
+            # Indexes written with a single shared Bloom filter are rebuilt by the store
+            if all(isinstance(run, dict) for run in manifest["runs"]):
+                return manifest
+        return {"runs": [], "count": 0, "covered_seq": 0}
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+
+        referenced = {run[key] for run in manifest["runs"] for key in ("file", "bloom")}
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy") and name not in referenced:
+                os.remove(os.path.join(self.directory, name))
+        self._manifest = manifest
+        self._runs = None
+
+    def _save_array(self, prefix: str, values: np.ndarray) -> str:
+        name = f"{prefix}-{uuid.uuid4().hex[:12]}.npy"
+        path = os.path.join(self.directory, name)
+        tmp_path = os.path.join(self.directory, f".{name}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, values)
+        os.replace(tmp_path, path)
+        return name
+
+    @property
+    def covered_seq(self) -> int:
+        """Store sequence number up to which rows have been indexed."""
+        return int(self._manifest.get("covered_seq", 0))
+
+    def __len__(self) -> int:
+        return int(self._manifest["count"])
+
+    # -- lookups ---------------------------------------------------------------
+
+    def _load(self):
+        if self._runs is None:
+            self._runs = [(np.load(os.path.join(self.directory, run["file"]), mmap_mode="r"),
+                           np.load(os.path.join(self.directory, run["bloom"]), mmap_mode="r"))
+                          for run in self._manifest["runs"]]
+
+    @staticmethod
+    def _bloom_positions(hashes: np.ndarray, n_bits: int) -> np.ndarray:
+        """Probe positions by double hashing the two 32-bit halves, shape (k, n)."""
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        probes = np.arange(BLOOM_HASHES, dtype=np.uint64)[:, None]
+        return (h1[None, :] + probes * h2[None, :]) % np.uint64(n_bits)
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """Boolean mask of the hashes already in the index."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        found = np.zeros(len(hashes), dtype=bool)
+        if not len(self) or not len(hashes):
+            return found
+        self._load()
+
+        for run_info, (run, bloom) in zip(self._manifest["runs"], self._runs):
+            pending = np.flatnonzero(~found)
+            if not len(pending):
+                break
+            positions = self._bloom_positions(hashes[pending], run_info["bloom_bits"])
+            bits = (bloom[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+            candidates = pending[bits.all(axis=0)]
+            if not len(candidates):
+                continue
+            lookup = hashes[candidates]
+            slots = np.minimum(np.searchsorted(run, lookup), len(run) - 1)
+            found[candidates] = np.asarray(run[slots]) == lookup
+        return found
+
+    # -- updates ---------------------------------------------------------------
+
+    def _save_run(self, hashes: np.ndarray) -> Dict[str, Any]:
+        """Write a sorted run and its Bloom filter; returns its manifest entry."""
+        bloom_bits = self._bloom_size(len(hashes))
+        return {
+            "file": self._save_array("run", hashes),
+            "bloom": self._save_array("bloom", self._build_bloom(hashes, bloom_bits)),
+            "bloom_bits": bloom_bits,
+            "count": int(len(hashes))
+        }
+
+    @staticmethod
+    def _tier(count: int) -> int:
+        tier = 0
+        while count >= RUN_MERGE_FACTOR:
+            count //= RUN_MERGE_FACTOR
+            tier += 1
+        return tier
+
+    def _merge_tiers(self, runs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Merge runs while RUN_MERGE_FACTOR of them share a size tier."""
+        while True:
+            tiers: Dict[int, List[Dict[str, Any]]] = {}
+            for run in runs:
+                tiers.setdefault(self._tier(run["count"]), []).append(run)
+            full = [group for group in tiers.values() if len(group) >= RUN_MERGE_FACTOR]
+            if not full:
+                return runs
+            group = full[0]
+            merged = np.unique(np.concatenate(
+                [np.load(os.path.join(self.directory, run["file"]), mmap_mode="r") for run in group]))
+            # Larger runs first, so lookups usually finish in the oldest data
+            runs = sorted([run for run in runs if run not in group] + [self._save_run(merged)],
+                          key=lambda run: -run["count"])
+
+    def add(self, hashes: np.ndarray, covered_seq: int):
+        """Record hashes of newly stored rows (callers pass only new, unique hashes)."""
+        hashes = np.unique(np.asarray(hashes, dtype=np.uint64))
+        manifest = dict(self._manifest)
+        manifest["covered_seq"] = int(covered_seq)
+        if len(hashes):
+            manifest["runs"] = self._merge_tiers(list(manifest["runs"]) + [self._save_run(hashes)])
+            manifest["count"] = len(self) + len(hashes)
+        self._write_manifest(manifest)
+
+    def rebuild(self, hash_chunks, covered_seq: int):
+        """Replace the index with the hashes yielded by hash_chunks."""
+        chunks = [np.asarray(chunk, dtype=np.uint64) for chunk in hash_chunks]
+        merged = np.unique(np.concatenate(chunks)) if chunks else np.zeros(0, dtype=np.uint64)
+        self._write_manifest({
+            "runs": [self._save_run(merged)] if len(merged) else [],
+            "count": len(merged),
+            "covered_seq": int(covered_seq)
+        })
+        logger.info(f"Rebuilt row hash index with {len(merged)} rows")
+
+    @staticmethod
+    def _bloom_size(entries: int) -> int:
+        bits = max(BLOOM_MIN_BITS, entries * BLOOM_BITS_PER_ENTRY)
+        return 1 << int(np.ceil(np.log2(bits)))
+
+    @classmethod
+    def _build_bloom(cls, hashes: np.ndarray, n_bits: int) -> np.ndarray:
+        bloom = np.zeros(n_bits // 8, dtype=np.uint8)
+        cls._set_bits(bloom, hashes, n_bits)
+        return bloom
+
+    @classmethod
+    def _set_bits(cls, bloom: np.ndarray, hashes: np.ndarray, n_bits: int):
+        positions = cls._bloom_positions(hashes, n_bits).ravel()
+        np.bitwise_or.at(bloom, positions >> np.uint64(3),
+                         (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Knowledge distillation for Surplus2Serve.
+
+The v5 notebook's best models are stacking / voting ensembles over XGBoost,
+RandomForest and gradient boosting, each costing several single-model
+predictions. distill_student trains a compact student instead (a shallow
+HistGradientBoosting on native categoricals) to reproduce the teacher
+ensemble's soft probabilities, over the training rows plus synthetic
+augmentations of them. It then reports how closely the student follows the
+teacher and what it saves at serving time.
+
+Soft targets are fitted with an ordinary classifier: every row is repeated
+once per class, labelled with that class and weighted by the teacher's
+(temperature-softened) probability for it. The student's log loss is then
+exactly the cross-entropy against the teacher's distribution.
+
+Augmentations perturb real training rows. Numeric inputs get Gaussian noise
+of DISTILL_NOISE standard deviations, clipped to the observed range. Each
+categorical input (commodity name and category together) is swapped, with
+probability DISTILL_SWAP_PROB, for the value of another random row. The
+teacher labels these rows too, so the student learns its behaviour between
+and around the training points.
+
+Full rebuilds distill when DISTILLATION_TEACHER is set (see training.py). To
+run it stand-alone:
+    python distillation.py --data training_data.csv --teacher stacking --output student.pkl
+"""
+
+import os
+import json
+import time
+import argparse
+import logging
+import tempfile
+import importlib.util
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.metrics import accuracy_score, f1_score
+
+from utils import engineer_features
+from training import build_model_pipeline, make_classifier, holdout_mask
+from training_store import open_training_data
+
+logger = logging.getLogger(__name__)
+
+# Teacher ensemble distilled by full rebuilds: 'stacking', 'voting' or empty (off)
+DISTILLATION_TEACHER = os.getenv("DISTILLATION_TEACHER", "")
+# Synthetic rows generated per training row
+DISTILL_AUGMENT_FACTOR = float(os.getenv("DISTILL_AUGMENT_FACTOR", "1.0"))
+# Softmax temperature applied to the teacher's probabilities (> 1 softens them)
+DISTILL_TEMPERATURE = float(os.getenv("DISTILL_TEMPERATURE", "1.0"))
+# Numeric noise in standard deviations, and probability of swapping a categorical value
+DISTILL_NOISE = 0.05
+DISTILL_SWAP_PROB = 0.1
+# Expanded rows whose teacher probability is below this carry no information
+MIN_SOFT_WEIGHT = 1e-4
+FIDELITY_LATENCY_ROWS = 200
+
+ENSEMBLE_FAMILIES = ['voting', 'stacking']
+STUDENT_FAMILY = 'hist_gradient_boosting_native'
+# Few, moderately sized trees: single-row latency grows with the number of trees. Early
+# stopping would validate on expanded copies of the training rows, so it is off.
+STUDENT_PARAMS = {'max_iter': 80, 'max_leaf_nodes': 31, 'max_depth': 8, 'learning_rate': 0.15,
+                  'early_stopping': False}
+
+AUGMENT_NUMERIC = ['Temperature', 'Humidity', 'Transport_Duration', 'Days_Since_Harvest', 'Ethylene_Level']
+AUGMENT_INTEGER = ['Days_Since_Harvest']
+# Columns swapped together so commodity name and category stay consistent
+AUGMENT_SWAP_GROUPS = [['Commodity_name', 'Commodity_Category'], ['Storage_Type'],
+                       ['Packaging_Quality'], ['Month_num'], ['Location']]
+
+def build_teacher_pipeline(X_engineered: pd.DataFrame, kind: str = 'stacking', n_jobs: int = -1):
+    """Unfitted soft-voting or stacking ensemble over the production model families."""
+    from sklearn.ensemble import VotingClassifier, StackingClassifier
+    from sklearn.linear_model import LogisticRegression
+
+    if kind not in ENSEMBLE_FAMILIES:
+        raise ValueError(f"Unknown teacher ensemble: {kind}")
+    members = ['random_forest', 'hist_gradient_boosting']
+    if importlib.util.find_spec("xgboost") is not None:
+        members.append('xgboost')
+    estimators = [(family, make_classifier(family, n_jobs=n_jobs)) for family in members]
+    if kind == 'voting':
+        ensemble = VotingClassifier(estimators, voting='soft')
+    else:
+        ensemble = StackingClassifier(estimators, final_estimator=LogisticRegression(max_iter=1000),
+                                      cv=3, n_jobs=n_jobs)
+    pipeline = build_model_pipeline(X_engineered, n_jobs=n_jobs, model_family='random_forest')
+    pipeline.steps[-1] = ('classifier', ensemble)
+    return pipeline
+
+def augment_rows(X_raw: pd.DataFrame, factor: float = DISTILL_AUGMENT_FACTOR,
+                 rng: Optional[np.random.Generator] = None) -> pd.DataFrame:
+    """Synthetic rows: perturbed copies of randomly chosen input rows."""
+    n_rows = int(round(len(X_raw) * factor))
+    if n_rows <= 0 or X_raw.empty:
+        return X_raw.iloc[0:0]
+    rng = rng or np.random.default_rng(42)
+    augmented = X_raw.iloc[rng.integers(0, len(X_raw), n_rows)].reset_index(drop=True)
+
+    for col in AUGMENT_NUMERIC:
+        if col not in augmented.columns:
+            continue
+        values = pd.to_numeric(X_raw[col], errors='coerce')
+        noisy = augmented[col].to_numpy(dtype=np.float64) + rng.normal(0, DISTILL_NOISE * values.std(), n_rows)
+        noisy = np.clip(noisy, values.min(), values.max())
+        if col in AUGMENT_INTEGER:
+            noisy = np.round(noisy)
+        augmented[col] = noisy.astype(augmented[col].dtype)
+
+    for group in AUGMENT_SWAP_GROUPS:
+        group = [col for col in group if col in augmented.columns]
+        if not group:
+            continue
+        swap = rng.random(n_rows) < DISTILL_SWAP_PROB
+        donors = X_raw.iloc[rng.integers(0, len(X_raw), int(swap.sum()))]
+        for col in group:
+            column = augmented[col].astype(object).to_numpy()
+            column[swap] = donors[col].astype(object).to_numpy()
+            augmented[col] = pd.Series(column).astype(X_raw[col].dtype)
+    return augmented
+
+def soften(probabilities: np.ndarray, temperature: float = DISTILL_TEMPERATURE) -> np.ndarray:
+    """Apply a softmax temperature to probability rows."""
+    if temperature == 1.0:
+        return probabilities
+    logits = np.log(np.clip(probabilities, 1e-12, 1.0)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    softened = np.exp(logits)
+    return softened / softened.sum(axis=1, keepdims=True)
+
+def fit_student(X_engineered: pd.DataFrame, soft_targets: np.ndarray, classes: np.ndarray,
+                n_jobs: int = -1, student_params: Optional[Dict[str, Any]] = None):
+    """Fit the student on soft targets via per-class row expansion with probability weights."""
+    n_rows = len(X_engineered)
+    rows = np.tile(np.arange(n_rows), len(classes))
+    labels = np.repeat(classes, n_rows)
+    weights = soft_targets.T.ravel()
+    keep = weights >= MIN_SOFT_WEIGHT
+    student = build_model_pipeline(X_engineered, n_jobs=n_jobs, model_family=STUDENT_FAMILY,
+                                   classifier_params=dict(STUDENT_PARAMS, **(student_params or {})))
+    student.fit(X_engineered.iloc[rows[keep]].reset_index(drop=True), labels[keep],
+                classifier__sample_weight=weights[keep])
+    return student
+
+def _latency_ms(pipeline, X: pd.DataFrame) -> Dict[str, float]:
+    pipeline.predict_proba(X.iloc[:1])
+    timings = []
+    for i in range(min(FIDELITY_LATENCY_ROWS, len(X))):
+        start = time.perf_counter()
+        pipeline.predict_proba(X.iloc[i:i + 1])
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"p50": round(float(np.percentile(timings, 50)), 3),
+            "p99": round(float(np.percentile(timings, 99)), 3)}
+
+def _size_mb(pipeline) -> float:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "model.pkl")
+        joblib.dump(pipeline, path)
+        return round(os.path.getsize(path) / 1024 / 1024, 3)
+
+def fidelity_report(teacher, student, X_test: pd.DataFrame, y_test: pd.Series) -> Dict[str, Any]:
+    """How closely the student follows the teacher on held-out rows, and what it costs to serve."""
+    teacher_proba = teacher.predict_proba(X_test)
+    student_proba = student.predict_proba(X_test)
+    teacher_pred = teacher.classes_[teacher_proba.argmax(axis=1)]
+    student_pred = student.classes_[student_proba.argmax(axis=1)]
+    clipped_teacher = np.clip(teacher_proba, 1e-12, 1.0)
+    kl = (clipped_teacher * (np.log(clipped_teacher) - np.log(np.clip(student_proba, 1e-12, 1.0)))).sum(axis=1)
+
+    teacher_latency, student_latency = _latency_ms(teacher, X_test), _latency_ms(student, X_test)
+    report = {
+        "test_rows": len(X_test),
+        "agreement": round(float((teacher_pred == student_pred).mean()), 4),
+        "mean_kl_divergence": round(float(kl.mean()), 5),
+        "mean_total_variation": round(float(0.5 * np.abs(teacher_proba - student_proba).sum(axis=1).mean()), 5),
+        "teacher_accuracy": round(float(accuracy_score(y_test, teacher_pred)), 4),
+        "student_accuracy": round(float(accuracy_score(y_test, student_pred)), 4),
+        "teacher_f1_macro": round(float(f1_score(y_test, teacher_pred, average='macro')), 4),
+        "student_f1_macro": round(float(f1_score(y_test, student_pred, average='macro')), 4),
+        "teacher_latency_ms": teacher_latency,
+        "student_latency_ms": student_latency,
+        "latency_speedup": round(teacher_latency["p50"] / student_latency["p50"], 2) if student_latency["p50"] else None,
+        "teacher_size_mb": _size_mb(teacher),
+        "student_size_mb": _size_mb(student)
+    }
+    report["accuracy_gap"] = round(report["teacher_accuracy"] - report["student_accuracy"], 4)
+    return report
+
+def distill_student(teacher, X_train_raw: pd.DataFrame, X_test_raw: pd.DataFrame, y_test: pd.Series,
+                    n_jobs: int = -1, augment_factor: float = DISTILL_AUGMENT_FACTOR,
+                    temperature: float = DISTILL_TEMPERATURE, seed: int = 42,
+                    features: Optional[List[str]] = None) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Distill a fitted teacher pipeline into a student on the training rows plus
+    augmentations. Inputs are raw (not yet engineered) feature frames; features
+    restricts the student to a pruned feature set.
+    Returns (fitted student pipeline, fidelity report).
+    """
+    start = time.perf_counter()
+    augmented = augment_rows(X_train_raw, augment_factor, np.random.default_rng(seed))
+    X_fit = engineer_features(pd.concat([X_train_raw, augmented], ignore_index=True))
+    if features is not None:
+        X_fit = X_fit[features]
+    soft_targets = soften(teacher.predict_proba(X_fit), temperature)
+    student = fit_student(X_fit, soft_targets, teacher.classes_, n_jobs=n_jobs)
+    fit_seconds = time.perf_counter() - start
+
+    report = fidelity_report(teacher, student, engineer_features(X_test_raw), y_test)
+    report.update({
+        "student_family": STUDENT_FAMILY,
+        "training_rows": len(X_train_raw),
+        "augmented_rows": len(augmented),
+        "temperature": temperature,
+        "distill_seconds": round(fit_seconds, 3)
+    })
+    logger.info(f"Distilled student agrees with the teacher on {report['agreement']:.1%} of held-out rows "
+                f"(accuracy {report['student_accuracy']:.4f} vs {report['teacher_accuracy']:.4f}, "
+                f"{report['latency_speedup']}x faster)")
+    return student, report
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Distill an ensemble teacher into a compact student")
+    parser.add_argument("--data", default="training_data.csv",
+                        help="Training data path, read through the training store")
+    parser.add_argument("--teacher", default=DISTILLATION_TEACHER or 'stacking', choices=ENSEMBLE_FAMILIES)
+    parser.add_argument("--augment-factor", type=float, default=DISTILL_AUGMENT_FACTOR)
+    parser.add_argument("--temperature", type=float, default=DISTILL_TEMPERATURE)
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--output", default=None, help="Save the student pipeline to this path")
+    parser.add_argument("--report", default=None, help="Write the fidelity report as JSON to this path")
+    args = parser.parse_args()
+
+    data = open_training_data(args.data).read()
+    X_raw = data.drop(['Spoilage_Risk'], axis=1)
+    y = data['Spoilage_Risk']
+    test_mask = holdout_mask(0, len(data))
+    X_train = engineer_features(X_raw[~test_mask])
+
+    teacher = build_teacher_pipeline(X_train, args.teacher, n_jobs=args.n_jobs)
+    teacher.fit(X_train, y[~test_mask])
+    student, report = distill_student(teacher, X_raw[~test_mask], X_raw[test_mask], y[test_mask],
+                                      n_jobs=args.n_jobs, augment_factor=args.augment_factor,
+                                      temperature=args.temperature)
+    report["teacher"] = args.teacher
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        joblib.dump(student, args.output)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
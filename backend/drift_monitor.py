@@ -0,0 +1,290 @@
+"""
+Drift monitoring of live prediction inputs for Surplus2Serve.
+
+Every prediction adds its inputs to a window of fixed-size histograms: the
+numeric inputs use the bins of dataset_manifest.HISTOGRAM_BINS, overall and
+per commodity category, and the categorical inputs are counted per value.
+Calendar inputs (SEASONAL_INPUTS) are left out: live requests carry the
+current month, which never matches the year-round training distribution.
+An update costs a few increments, and memory is bounded because only
+MAX_TRACKED_VALUES categories / values are tracked, the rest share one bucket.
+
+Every DRIFT_CHECK_EVERY predictions (or DRIFT_CHECK_INTERVAL_SECONDS, once
+DRIFT_MIN_SAMPLES have been seen) the window is compared with the histograms
+and counts of the training data manifest, which the training store keeps up to
+date with every upload. Nothing is read from the predictions collection. The
+check runs on a background thread, so the prediction that completes a window
+does not wait for the manifest to be read or a retrain to be queued, and the
+manifest is reread at most every REFERENCE_CACHE_SECONDS. Each
+input gets a population stability index (PSI) and, for numeric inputs, a
+Kolmogorov-Smirnov statistic over the binned distributions. Crossing
+DRIFT_PSI_THRESHOLD or DRIFT_KS_THRESHOLD marks the input as drifted, and
+when DRIFT_RETRAIN is set the retrain scheduler is asked to queue a retrain.
+The window then starts over.
+
+Each API process monitors the predictions it serves itself.
+"""
+
+import os
+import copy
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+
+import numpy as np
+
+from dataset_manifest import HISTOGRAM_BINS, ALL_GROUP, histogram_bin
+
+logger = logging.getLogger(__name__)
+
+# Monitor the inputs of live predictions
+DRIFT_MONITORING = os.getenv("DRIFT_MONITORING", "true").lower() == "true"
+# Compare the window with the training data every this many predictions...
+DRIFT_CHECK_EVERY = int(os.getenv("DRIFT_CHECK_EVERY", "1000"))
+# ...or after this long, provided the window holds DRIFT_MIN_SAMPLES predictions
+DRIFT_CHECK_INTERVAL_SECONDS = float(os.getenv("DRIFT_CHECK_INTERVAL_SECONDS", "300"))
+# Predictions an input (overall or for one commodity category) needs before it is compared
+DRIFT_MIN_SAMPLES = int(os.getenv("DRIFT_MIN_SAMPLES", "200"))
+# PSI above 0.25 is conventionally read as a significant population shift
+DRIFT_PSI_THRESHOLD = float(os.getenv("DRIFT_PSI_THRESHOLD", "0.25"))
+DRIFT_KS_THRESHOLD = float(os.getenv("DRIFT_KS_THRESHOLD", "0.2"))
+# Queue a retrain when drift is detected
+DRIFT_RETRAIN = os.getenv("DRIFT_RETRAIN", "true").lower() == "true"
+
+# Calendar inputs always follow the current date, so they differ from the
+# year-round training data by construction and are not checked for drift
+SEASONAL_INPUTS = ('Month_num',)
+# Numeric inputs that are checked, with the histogram bins of the manifest
+DRIFT_NUMERIC_INPUTS = tuple(col for col in HISTOGRAM_BINS if col not in SEASONAL_INPUTS)
+# Categorical inputs and the manifest counts they are compared with
+CATEGORICAL_DRIFT_COUNTS = {
+    'Commodity_Category': 'category_counts',
+    'Storage_Type': 'storage_type_counts',
+    'Packaging_Quality': 'packaging_quality_counts',
+}
+# Distinct categories / values tracked per window; later ones share OTHER_VALUE
+MAX_TRACKED_VALUES = 64
+OTHER_VALUE = "__other__"
+# Smoothing of empty bins, which would make PSI infinite
+PSI_EPSILON = 1e-4
+# How long a loaded training data manifest is compared against before it is reread
+REFERENCE_CACHE_SECONDS = 60.0
+
+def psi(reference: np.ndarray, live: np.ndarray) -> float:
+    """Population stability index of the live distribution against the reference counts."""
+    expected = np.asarray(reference, dtype=np.float64)
+    actual = np.asarray(live, dtype=np.float64)
+    expected = np.maximum(expected / expected.sum(), PSI_EPSILON)
+    actual = np.maximum(actual / actual.sum(), PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+def ks_statistic(reference: np.ndarray, live: np.ndarray) -> float:
+    """Largest gap between the two cumulative distributions, at bin resolution."""
+    expected = np.cumsum(reference, dtype=np.float64)
+    actual = np.cumsum(live, dtype=np.float64)
+    return float(np.max(np.abs(actual / actual[-1] - expected / expected[-1])))
+
+class LiveWindow:
+    """Fixed-size histograms and counts of the predictions in one window."""
+
+    def __init__(self):
+        self.count = 0
+        self.started_at = datetime.now().isoformat()
+        self.started = time.monotonic()
+        self.group_counts: Dict[str, int] = {}
+        self.numeric: Dict[str, Dict[str, np.ndarray]] = {}
+        self.categorical: Dict[str, Dict[str, int]] = {col: {} for col in CATEGORICAL_DRIFT_COUNTS}
+
+    def _histograms(self, group: str) -> Dict[str, np.ndarray]:
+        if group not in self.numeric:
+            self.numeric[group] = {col: np.zeros(HISTOGRAM_BINS[col][2], dtype=np.int64)
+                                  for col in DRIFT_NUMERIC_INPUTS}
+        return self.numeric[group]
+
+    def add(self, row: Dict[str, Any]):
+        self.count += 1
+        group = str(row.get('Commodity_Category'))
+        if group not in self.group_counts and len(self.group_counts) >= MAX_TRACKED_VALUES:
+            group = OTHER_VALUE
+        self.group_counts[group] = self.group_counts.get(group, 0) + 1
+
+        overall, by_group = self._histograms(ALL_GROUP), self._histograms(group)
+        for col in DRIFT_NUMERIC_INPUTS:
+            value = row.get(col)
+            if value is None or value != value:
+                continue
+            index = histogram_bin(col, float(value))
+            overall[col][index] += 1
+            by_group[col][index] += 1
+
+        for col, counts in self.categorical.items():
+            value = str(row.get(col))
+            if value not in counts and len(counts) >= MAX_TRACKED_VALUES:
+                value = OTHER_VALUE
+            counts[value] = counts.get(value, 0) + 1
+
+class DriftMonitor:
+    """
+    Compare live prediction inputs with the training data manifest.
+    reference returns the current manifest; on_drift is called with the
+    drifted inputs when a check finds drift and returns the queued job, if any.
+    """
+
+    def __init__(self, reference: Callable[[], Dict[str, Any]],
+                 on_drift: Optional[Callable[[List[str]], Optional[Dict[str, Any]]]] = None,
+                 check_every: int = DRIFT_CHECK_EVERY,
+                 check_interval_seconds: float = DRIFT_CHECK_INTERVAL_SECONDS,
+                 min_samples: int = DRIFT_MIN_SAMPLES,
+                 psi_threshold: float = DRIFT_PSI_THRESHOLD,
+                 ks_threshold: float = DRIFT_KS_THRESHOLD):
+        self.reference = reference
+        self.on_drift = on_drift
+        self.check_every = check_every
+        self.check_interval_seconds = check_interval_seconds
+        self.min_samples = min_samples
+        self.psi_threshold = psi_threshold
+        self.ks_threshold = ks_threshold
+        self.window = LiveWindow()
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._reference: Optional[Dict[str, Any]] = None
+        self._reference_loaded = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="drift-check")
+
+    def observe(self, row: Dict[str, Any]) -> Optional[Future]:
+        """Add one prediction's inputs; if this completed a window, returns the future of its check."""
+        with self._lock:
+            self.window.add(row)
+            due = self.window.count >= self.check_every or (
+                self.window.count >= self.min_samples
+                and time.monotonic() - self.window.started >= self.check_interval_seconds
+            )
+            if not due:
+                return None
+            window, self.window = self.window, LiveWindow()
+        return self._executor.submit(self._check_logged, window)
+
+    def _check_logged(self, window: LiveWindow) -> Optional[Dict[str, Any]]:
+        try:
+            return self._check(window)
+        except Exception as e:
+            logger.error(f"Drift check failed: {str(e)}")
+            return None
+
+    def check(self) -> Optional[Dict[str, Any]]:
+        """Evaluate the current window now and start a new one."""
+        with self._lock:
+            if not self.window.count:
+                return None
+            window, self.window = self.window, LiveWindow()
+        return self._check(window)
+
+    def _check(self, window: LiveWindow) -> Dict[str, Any]:
+        report = self.evaluate(window)
+        if report["drift_detected"]:
+            logger.warning(f"Input drift detected over {window.count} predictions: {report['drifted_features']}")
+            if self.on_drift is not None:
+                try:
+                    job = self.on_drift(report["drifted_features"])
+                    report["retrain_job_id"] = job["id"] if job else None
+                except Exception as e:
+                    logger.error(f"Failed to queue a retrain for input drift: {str(e)}")
+        self.last_report = report
+        return report
+
+    def _compare(self, reference: Optional[List[int]], live: np.ndarray, numeric: bool) -> Optional[Dict[str, Any]]:
+        reference_samples, live_samples = int(np.sum(reference or [])), int(np.sum(live))
+        if not reference_samples or live_samples < self.min_samples:
+            return None
+        result = {"psi": round(psi(reference, live), 4), "ks": None,
+                  "live_samples": live_samples, "reference_samples": reference_samples}
+        drifted = result["psi"] >= self.psi_threshold
+        if numeric:
+            result["ks"] = round(ks_statistic(reference, live), 4)
+            drifted = drifted or result["ks"] >= self.ks_threshold
+        result["drifted"] = drifted
+        return result
+
+    def _manifest(self) -> Dict[str, Any]:
+        """The reference manifest, reread at most every REFERENCE_CACHE_SECONDS."""
+        if self._reference is None or time.monotonic() - self._reference_loaded >= REFERENCE_CACHE_SECONDS:
+            self._reference = self.reference() or {}
+            self._reference_loaded = time.monotonic()
+        return self._reference
+
+    def evaluate(self, window: Optional[LiveWindow] = None) -> Dict[str, Any]:
+        """PSI / KS of a window (default: the current one) against the training data manifest."""
+        window = window or self.window
+        manifest = self._manifest()
+        histograms = manifest.get("histograms", {})
+
+        features: Dict[str, Any] = {}
+        for col in DRIFT_NUMERIC_INPUTS:
+            live = window.numeric.get(ALL_GROUP, {}).get(col)
+            if live is not None:
+                features[col] = self._compare(histograms.get(col, {}).get(ALL_GROUP), live, numeric=True)
+        for col, counts_key in CATEGORICAL_DRIFT_COUNTS.items():
+            reference_counts = manifest.get(counts_key, {})
+            values = sorted(set(reference_counts) | set(window.categorical[col]))
+            if values:
+                features[col] = self._compare([reference_counts.get(value, 0) for value in values],
+                                              np.array([window.categorical[col].get(value, 0) for value in values]),
+                                              numeric=False)
+
+        groups: Dict[str, Dict[str, Any]] = {}
+        for group, live_histograms in window.numeric.items():
+            if group in (ALL_GROUP, OTHER_VALUE):
+                continue
+            compared = {col: self._compare(histograms.get(col, {}).get(group), live, numeric=True)
+                        for col, live in live_histograms.items()}
+            compared = {col: result for col, result in compared.items() if result is not None}
+            if compared:
+                groups[group] = compared
+
+        drifted = [col for col, result in features.items() if result and result["drifted"]]
+        drifted += [f"{group}/{col}" for group, compared in groups.items()
+                    for col, result in compared.items() if result["drifted"]]
+        return {
+            "checked_at": datetime.now().isoformat(),
+            "window_started_at": window.started_at,
+            "window_predictions": window.count,
+            "reference_rows": manifest.get("rows", 0),
+            "features": features,
+            "categories": groups,
+            "drifted_features": drifted,
+            "drift_detected": bool(drifted)
+        }
+
+    def status(self) -> Dict[str, Any]:
+        """Thresholds, the last completed check and an evaluation of the current window."""
+        with self._lock:
+            window = copy.deepcopy(self.window)
+        current = self.evaluate(window) if window.count else None
+        return {
+            "check_every": self.check_every,
+            "check_interval_seconds": self.check_interval_seconds,
+            "min_samples": self.min_samples,
+            "psi_threshold": self.psi_threshold,
+            "ks_threshold": self.ks_threshold,
+            "retrain_on_drift": self.on_drift is not None,
+            "last_check": self.last_report,
+            "current_window": current
+        }
+
+def create_drift_monitor(training_data_path: str, model_path: str, retrain_scheduler=None) -> Optional[DriftMonitor]:
+    """The API's drift monitor, or None when DRIFT_MONITORING is off."""
+    if not DRIFT_MONITORING:
+        return None
+    from training_store import open_training_data
+
+    def reference() -> Dict[str, Any]:
+        return open_training_data(training_data_path).manifest()
+
+    on_drift = None
+    if DRIFT_RETRAIN and retrain_scheduler is not None:
+        def on_drift(drifted_features: List[str]) -> Optional[Dict[str, Any]]:
+            return retrain_scheduler.notify_drift(training_data_path, model_path, drifted_features)
+    return DriftMonitor(reference, on_drift)
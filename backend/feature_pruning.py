@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Latency-aware feature pruning for Surplus2Serve.
+
+preprocess_input hands 33 engineered columns to the model (24 numeric and 9
+categorical, the latter one-hot expanded), and several of them are
+near-copies of each other (Temp_Squared, Heat_Index and
+Temp_Humidity_Interaction all follow Temperature). prune_features finds a
+smaller feature set that predicts as well:
+
+1. A model is fitted on part of the training rows. The remaining
+   validation rows are used for every pruning decision, so the evaluation
+   holdout of training.py is never looked at.
+2. Features are ranked for dropping by permutation importance, discounted
+   for redundancy (the highest absolute correlation with a more important
+   numeric feature) and divided by the number of model inputs the feature
+   expands to (its one-hot width). Cheap-to-lose, expensive-to-serve
+   features come first.
+3. Going down the ranking, each feature is dropped for good if a refit
+   without it keeps validation accuracy within FEATURE_PRUNING_TOLERANCE of
+   the unpruned model. The search stops after FEATURE_PRUNING_MAX_REFITS
+   refits or PRUNING_PATIENCE rejected candidates in a row.
+
+The retained features are stored on the pipeline (feature_set) and in the
+model registry entry; preprocess_input then engineers only those features.
+Full rebuilds prune when FEATURE_PRUNING is set (see training.py). To run it
+stand-alone:
+    python feature_pruning.py --data training_data.csv --model-family random_forest
+"""
+
+import os
+import json
+import time
+import argparse
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.inspection import permutation_importance
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+
+from utils import engineer_features
+from training import (build_model_pipeline, CATEGORICAL_FEATURES, NUMERICAL_FEATURES,
+                      NATIVE_CATEGORICAL_FAMILIES, DEFAULT_MODEL_FAMILY)
+from training_store import open_training_data
+
+logger = logging.getLogger(__name__)
+
+# Prune features during full rebuilds
+FEATURE_PRUNING = os.getenv("FEATURE_PRUNING", "false").lower() == "true"
+# Largest drop in validation accuracy accepted versus the unpruned model
+FEATURE_PRUNING_TOLERANCE = float(os.getenv("FEATURE_PRUNING_TOLERANCE", "0.005"))
+# Refits spent on trying to drop features
+FEATURE_PRUNING_MAX_REFITS = int(os.getenv("FEATURE_PRUNING_MAX_REFITS", "12"))
+# Rejected candidates in a row after which the remaining features are kept
+PRUNING_PATIENCE = 4
+# Share of the training rows pruning decisions are validated on
+VALIDATION_FRACTION = 0.2
+# Validation rows permutation importance is computed on, and its repeats
+IMPORTANCE_ROWS = 5000
+IMPORTANCE_REPEATS = 3
+LATENCY_ROWS = 200
+
+def model_features(X_engineered: pd.DataFrame) -> List[str]:
+    """Features build_model_pipeline uses from an engineered frame."""
+    return [col for col in CATEGORICAL_FEATURES + NUMERICAL_FEATURES if col in X_engineered.columns]
+
+def input_widths(X_engineered: pd.DataFrame, features: List[str], model_family: str) -> Dict[str, int]:
+    """Model inputs each feature becomes: its one-hot width for categoricals, else 1."""
+    if model_family in NATIVE_CATEGORICAL_FAMILIES:
+        return {feature: 1 for feature in features}
+    return {feature: max(int(X_engineered[feature].nunique()), 1) if feature in CATEGORICAL_FEATURES else 1
+            for feature in features}
+
+def redundancy(X_engineered: pd.DataFrame, features: List[str],
+               importances: Dict[str, float]) -> Dict[str, float]:
+    """Highest absolute correlation of each numeric feature with a more important one (0 for categoricals)."""
+    numeric = [feature for feature in features if feature in NUMERICAL_FEATURES]
+    correlation = X_engineered[numeric].astype(np.float64).corr().abs().fillna(0.0)
+    scores = {feature: 0.0 for feature in features}
+    for feature in numeric:
+        stronger = [other for other in numeric if other != feature and importances[other] > importances[feature]]
+        if stronger:
+            scores[feature] = float(correlation.loc[feature, stronger].max())
+    return scores
+
+def rank_features(pipeline, X_val: pd.DataFrame, y_val: pd.Series, features: List[str],
+                  model_family: str, n_jobs: int = -1, seed: int = 42) -> List[Dict[str, Any]]:
+    """Features ordered from the first to the last candidate for dropping."""
+    if len(X_val) > IMPORTANCE_ROWS:
+        X_val, _, y_val, _ = train_test_split(X_val, y_val, train_size=IMPORTANCE_ROWS,
+                                              random_state=seed, stratify=y_val)
+    result = permutation_importance(pipeline, X_val[features], y_val, scoring='accuracy',
+                                    n_repeats=IMPORTANCE_REPEATS, random_state=seed, n_jobs=n_jobs)
+    importances = dict(zip(features, result.importances_mean.tolist()))
+    spread = dict(zip(features, result.importances_std.tolist()))
+    redundant = redundancy(X_val, features, importances)
+    widths = input_widths(X_val, features, model_family)
+
+    ranking = []
+    for feature in features:
+        ranking.append({
+            "feature": feature,
+            "importance": round(importances[feature], 5),
+            "importance_std": round(spread[feature], 5),
+            "redundancy": round(redundant[feature], 4),
+            "input_width": widths[feature],
+            "drop_score": max(importances[feature], 0.0) * (1 - redundant[feature]) / widths[feature]
+        })
+    ranking.sort(key=lambda item: (item["drop_score"], -item["input_width"]))
+    return ranking
+
+def serving_latency_ms(pipeline, X_raw: pd.DataFrame, features: List[str]) -> float:
+    """Median single-row latency of feature engineering plus prediction, as in preprocess_input."""
+    rows = [X_raw.iloc[i:i + 1] for i in range(min(LATENCY_ROWS, len(X_raw)))]
+    pipeline.predict_proba(engineer_features(rows[0], features=features)[features])
+    timings = []
+    for row in rows:
+        start = time.perf_counter()
+        pipeline.predict_proba(engineer_features(row, features=features)[features])
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(float(np.median(timings)), 3)
+
+def prune_features(X_raw: pd.DataFrame, y: pd.Series, model_family: str = DEFAULT_MODEL_FAMILY,
+                   classifier_params: Optional[Dict[str, Any]] = None, n_jobs: int = -1,
+                   tolerance: float = FEATURE_PRUNING_TOLERANCE,
+                   max_refits: int = FEATURE_PRUNING_MAX_REFITS,
+                   seed: int = 42) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    Greedily drop features while validation accuracy stays within tolerance of
+    the unpruned model. X_raw holds training rows before feature engineering.
+    Returns (retained features in pipeline order, pruning report).
+    """
+    start = time.perf_counter()
+    X_engineered = engineer_features(X_raw)
+    features = model_features(X_engineered)
+    X_fit, X_val, y_fit, y_val = train_test_split(X_engineered, y, test_size=VALIDATION_FRACTION,
+                                                  random_state=seed, stratify=y)
+
+    def fit(candidate_features: List[str]):
+        pipeline = build_model_pipeline(X_fit[candidate_features], n_jobs=n_jobs, model_family=model_family,
+                                        classifier_params=classifier_params)
+        pipeline.fit(X_fit[candidate_features], y_fit)
+        return pipeline, float(accuracy_score(y_val, pipeline.predict(X_val[candidate_features])))
+
+    baseline, baseline_accuracy = fit(features)
+    ranking = rank_features(baseline, X_val, y_val, features, model_family, n_jobs=n_jobs, seed=seed)
+
+    retained = list(features)
+    pruned, pruned_accuracy = baseline, baseline_accuracy
+    dropped: List[Dict[str, Any]] = []
+    refits = rejected_in_row = 0
+    for candidate in ranking:
+        if refits >= max_refits or rejected_in_row >= PRUNING_PATIENCE or len(retained) <= 1:
+            break
+        trial = [feature for feature in retained if feature != candidate["feature"]]
+        pipeline, accuracy = fit(trial)
+        refits += 1
+        if accuracy >= baseline_accuracy - tolerance:
+            retained, pruned, pruned_accuracy = trial, pipeline, accuracy
+            dropped.append({"feature": candidate["feature"], "validation_accuracy": round(accuracy, 5)})
+            rejected_in_row = 0
+        else:
+            rejected_in_row += 1
+
+    X_val_raw = X_raw.loc[X_val.index]
+    latency_before = serving_latency_ms(baseline, X_val_raw, features)
+    latency_after = serving_latency_ms(pruned, X_val_raw, retained) if dropped else latency_before
+    report = {
+        "model_family": model_family,
+        "tolerance": tolerance,
+        "baseline_accuracy": round(baseline_accuracy, 5),
+        "pruned_accuracy": round(pruned_accuracy, 5),
+        "features_before": len(features),
+        "features_after": len(retained),
+        "inputs_before": sum(input_widths(X_engineered, features, model_family).values()),
+        "inputs_after": sum(input_widths(X_engineered, retained, model_family).values()),
+        "dropped": dropped,
+        "ranking": ranking,
+        "refits": refits,
+        "latency_ms_before": latency_before,
+        "latency_ms_after": latency_after,
+        "seconds": round(time.perf_counter() - start, 3)
+    }
+    logger.info(f"Feature pruning kept {len(retained)} of {len(features)} features "
+                f"(validation accuracy {pruned_accuracy:.4f} vs {baseline_accuracy:.4f}, "
+                f"single-row latency {latency_after}ms vs {latency_before}ms)")
+    return retained, report
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Find a smaller feature set with the same accuracy")
+    parser.add_argument("--data", default="training_data.csv",
+                        help="Training data path, read through the training store")
+    parser.add_argument("--model-family", default=DEFAULT_MODEL_FAMILY)
+    parser.add_argument("--tolerance", type=float, default=FEATURE_PRUNING_TOLERANCE)
+    parser.add_argument("--max-refits", type=int, default=FEATURE_PRUNING_MAX_REFITS)
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--report", default=None, help="Write the pruning report as JSON to this path")
+    args = parser.parse_args()
+
+    data = open_training_data(args.data).read()
+    feature_set, report = prune_features(data.drop(['Spoilage_Risk'], axis=1), data['Spoilage_Risk'],
+                                         model_family=args.model_family, n_jobs=args.n_jobs,
+                                         tolerance=args.tolerance, max_refits=args.max_refits)
+    report["feature_set"] = feature_set
+    print(json.dumps(report, indent=2))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
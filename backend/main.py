@@ -3,13 +3,15 @@ Simplified FastAPI backend for Surplus2Serve - Basic Version
 This version works without MongoDB dependencies for initial testing
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query
+from pydantic import ValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import pandas as pd
 import numpy as np
 import joblib
 import os
+import time
 import traceback
 from datetime import datetime
 import logging
@@ -17,7 +19,7 @@ from typing import Optional, List
 import uvicorn
 
 # Import only the basic models that don't require MongoDB
-from models import PredictionRequest, PredictionResponse, HealthResponse, UploadResponse
+from models import PredictionRequest, PredictionResponse, HealthResponse, UploadResponse, TrainingJobResponse
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -51,16 +53,26 @@ app.add_middleware(
 model = None
 model_path = "../Model/best_spoilage_model_with_xgboost.pkl"
 training_data_path = "training_data.csv"
+training_queue = None
+retrain_scheduler = None
+drift_monitor = None
+similar_cases_index = None
 
 @app.on_event("startup")
 async def startup_event():
     """Load the trained model on startup."""
-    global model
+    global model, training_queue, retrain_scheduler, drift_monitor, similar_cases_index
     try:
         # Import utils here to avoid import issues at module level
         from utils import load_model, create_fallback_model
+        from model_suite import load_model_suite
         
         model = load_model(model_path)
+        # Serve the commodity-specific suite instead when MODEL_SUITE_DIR is configured
+        model = load_model_suite() or model
+        # Nearest historical cases, indexed by each training run next to the model
+        from similar_cases import load_similar_cases
+        similar_cases_index = load_similar_cases(model_path)
         
         # Check if it's a fallback model
         if hasattr(model, 'version') and 'fallback' in str(model.version):
@@ -88,6 +100,27 @@ async def startup_event():
         except Exception as fallback_error:
             logger.error(f"Even fallback model failed: {str(fallback_error)}")
             model = None
+    
+    # Retraining runs in a separate worker process fed by a persistent job queue
+    try:
+        from training_jobs import TrainingJobQueue
+        from training_worker import ensure_worker_running
+        from retrain_scheduler import RetrainScheduler
+        training_queue = TrainingJobQueue()
+        retrain_scheduler = RetrainScheduler(training_queue)
+        ensure_worker_running(training_queue.db_path)
+    except Exception as e:
+        logger.error(f"Failed to initialize training job queue: {str(e)}")
+        training_queue = None
+        retrain_scheduler = None
+    
+    # Live prediction inputs are compared with the training data to detect drift
+    try:
+        from drift_monitor import create_drift_monitor
+        drift_monitor = create_drift_monitor(training_data_path, model_path, retrain_scheduler)
+    except Exception as e:
+        logger.error(f"Failed to initialize drift monitoring: {str(e)}")
+        drift_monitor = None
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
@@ -139,6 +172,23 @@ async def predict_spoilage_risk(request: PredictionRequest):
         prediction_proba = model.predict_proba(processed_data)[0]
         prediction_class = model.predict(processed_data)[0]
         
+        input_row = input_data.iloc[0].to_dict()
+        
+        # Track the inputs for drift monitoring; this never fails the prediction
+        if drift_monitor is not None:
+            try:
+                drift_monitor.observe(input_row)
+            except Exception as e:
+                logger.warning(f"Drift monitoring failed: {str(e)}")
+        
+        # Distance to the nearest historical cases flags inputs unlike the training data
+        ood = None
+        if similar_cases_index is not None:
+            try:
+                ood = similar_cases_index.ood(input_row)
+            except Exception as e:
+                logger.warning(f"Out-of-distribution check failed: {str(e)}")
+        
         # Calculate results
         risk_score = float(np.max(prediction_proba))
         risk_labels = {0: "Low Risk", 1: "Medium Risk", 2: "High Risk"}
@@ -161,6 +211,8 @@ async def predict_spoilage_risk(request: PredictionRequest):
             },
             Model_Version=model_version,
             Estimated_Shelf_Life=estimated_shelf_life,
+            OOD_Distance=ood["distance"] if ood else None,
+            Is_Out_Of_Distribution=ood["is_out_of_distribution"] if ood else None,
             Timestamp=datetime.now().isoformat(),
             Input_Summary={
                 "commodity": request.Commodity_name,
@@ -177,46 +229,93 @@ async def predict_spoilage_risk(request: PredictionRequest):
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
+@app.get("/predict/similar")
+async def get_similar_cases(Commodity_name: str = Query(..., description="Name of the commodity"),
+                            Temperature: float = Query(..., description="Temperature in Celsius (0-50°C)"),
+                            Humidity: float = Query(..., description="Relative humidity percentage (0-100%)"),
+                            Storage_Type: str = Query(..., description="Type of storage"),
+                            Days_Since_Harvest: int = Query(..., description="Days since harvest (0-30 days)"),
+                            Transport_Duration: float = Query(8.0, description="Transport duration in hours"),
+                            Packaging_Quality: str = Query("good", description="Quality of packaging"),
+                            Month_num: int = Query(7, description="Month number (1-12)"),
+                            k: int = Query(5, ge=1, le=50, description="Number of similar cases to return")):
+    """
+    Get the k most similar labelled historical lots of the commodity with their
+    actual spoilage outcomes, and how far the inputs are from the training data.
+    """
+    if similar_cases_index is None:
+        raise HTTPException(status_code=503, detail="Similar cases index not available")
+    
+    try:
+        # Same limits as prediction requests
+        request = PredictionRequest(
+            Commodity_name=Commodity_name, Temperature=Temperature, Humidity=Humidity,
+            Storage_Type=Storage_Type, Days_Since_Harvest=Days_Since_Harvest,
+            Transport_Duration=Transport_Duration, Packaging_Quality=Packaging_Quality, Month_num=Month_num
+        )
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    
+    try:
+        start = time.perf_counter()
+        result = similar_cases_index.query(request.model_dump(), k=k)
+        result["query_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return result
+    except Exception as e:
+        logger.error(f"Similar cases error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to find similar cases: {str(e)}")
+
 @app.post("/upload_data", response_model=UploadResponse)
 async def upload_training_data(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(..., description="CSV file with new training data")
+    file: UploadFile = File(..., description="CSV file with new training data (optionally .gz or .zst compressed)"),
+    quarantine: bool = Query(False, description="Store the valid rows and quarantine invalid ones instead of rejecting the upload")
 ):
     """Upload new training data and trigger model retraining."""
     try:
-        # Import utils functions here
-        from utils import validate_csv_data, save_training_data, retrain_model_background
-        from io import StringIO
-        
-        if not file.filename or not file.filename.endswith('.csv'):
-            raise HTTPException(status_code=400, detail="Only CSV files are supported")
+        from fastapi.concurrency import run_in_threadpool
+        from upload_ingest import ingest_upload, is_supported_upload, UploadFormatError, UploadValidationError
+        from training_store import open_training_data
         
-        contents = await file.read()
+        if not is_supported_upload(file.filename):
+            raise HTTPException(status_code=400, detail="Only CSV files (.csv, .csv.gz, .csv.zst) are supported")
         
+        # Parsing, validation and storage run chunk by chunk off the event loop
         try:
-            new_data = pd.read_csv(StringIO(contents.decode('utf-8')))
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid CSV format: {str(e)}")
-        
-        validation_result = validate_csv_data(new_data)
-        if not validation_result["is_valid"]:
-            raise HTTPException(status_code=400, detail=validation_result["error"])
-        
-        rows_added = save_training_data(new_data, training_data_path)
+            ingested = await run_in_threadpool(ingest_upload, file.file, file.filename, training_data_path,
+                                               quarantine=quarantine)
+        except UploadFormatError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except UploadValidationError as e:
+            raise HTTPException(status_code=400, detail={
+                "error": str(e),
+                "rows_added": e.report["rows_added"],
+                "validation_errors": e.report["validation"]["errors"]
+            })
+        rows_added = ingested["rows_added"]
         
-        background_tasks.add_task(
-            retrain_model_background, 
-            training_data_path, 
-            model_path
-        )
+        # Let the scheduler coalesce this upload into a (debounced) retraining job
+        training_job = None
+        if retrain_scheduler is not None:
+            # Enqueueing waits on the SQLite job queue's write lock
+            training_job = await run_in_threadpool(retrain_scheduler.notify_upload, rows_added,
+                                                   training_data_path, model_path,
+                                                   categories=ingested["categories"])
         
         logger.info(f"Training data uploaded: {rows_added} rows added")
         
+        total_rows = await run_in_threadpool(lambda: open_training_data(training_data_path).row_count())
+        
         return UploadResponse(
             message="Training data uploaded successfully",
             rows_added=rows_added,
-            total_rows=len(pd.read_csv(training_data_path)),
-            retraining_started=True,
+            duplicates_existing=ingested["duplicates_existing"],
+            duplicates_in_upload=ingested["duplicates_in_upload"],
+            rows_quarantined=ingested["rows_quarantined"],
+            quarantine_file=os.path.basename(ingested["quarantine_file"]) if ingested["quarantine_file"] else None,
+            validation_errors=ingested["validation"]["errors"],
+            total_rows=total_rows,
+            retraining_started=training_job is not None,
+            training_job_id=training_job["id"] if training_job else None,
             timestamp=datetime.now().isoformat()
         )
         
@@ -226,17 +325,74 @@ async def upload_training_data(
         logger.error(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+@app.get("/training/jobs/{job_id}", response_model=TrainingJobResponse)
+async def get_training_job(job_id: str):
+    """Get progress, stage timings, peak memory and metrics of a retraining job."""
+    if training_queue is None:
+        raise HTTPException(status_code=503, detail="Training job queue not available")
+    
+    job = training_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    
+    return TrainingJobResponse.from_job(job)
+
+@app.get("/training/scheduler")
+async def get_retrain_scheduler_status():
+    """Get retrain scheduler thresholds and the uploads waiting for a retrain."""
+    if retrain_scheduler is None:
+        raise HTTPException(status_code=503, detail="Retrain scheduler not available")
+    
+    return retrain_scheduler.status()
+
+@app.get("/training/history")
+async def get_training_history(limit: int = Query(50, ge=1, le=1000,
+                                                  description="Number of most recent runs to return"),
+                               run_status: Optional[str] = Query(None, alias="status",
+                                                                 description="Only runs with this status"),
+                               mode: Optional[str] = Query(None, description="Only runs in this training mode")):
+    """Get telemetry of recent training runs: stage timings, peak RSS, throughput, model size and per-class metrics."""
+    try:
+        from training_history import TrainingHistory
+        
+        runs = TrainingHistory().runs(limit=limit, status=run_status, mode=mode)
+        return {"count": len(runs), "runs": runs}
+    except Exception as e:
+        logger.error(f"Training history error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get training history: {str(e)}")
+
+@app.get("/monitoring/drift")
+async def get_drift_status():
+    """Get PSI/KS drift of live prediction inputs against the training data, overall and per commodity category."""
+    if drift_monitor is None:
+        raise HTTPException(status_code=503, detail="Drift monitoring not available")
+    
+    try:
+        from fastapi.concurrency import run_in_threadpool
+        
+        # Evaluating the current window may read the training data manifest
+        return await run_in_threadpool(drift_monitor.status)
+    except Exception as e:
+        logger.error(f"Drift monitoring error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get drift status: {str(e)}")
+
 @app.get("/model_info")
 async def get_model_info():
     """Get information about the current model."""
     try:
+        from fastapi.concurrency import run_in_threadpool
+        from training_store import open_training_data
+        
         if model is None:
             return {"status": "Model not loaded"}
         
+        training_data_rows = await run_in_threadpool(
+            lambda: open_training_data(training_data_path).row_count()
+        )
         model_info = {
             "model_type": str(type(model)),
             "model_loaded": True,
-            "training_data_rows": len(pd.read_csv(training_data_path)) if os.path.exists(training_data_path) else 0,
+            "training_data_rows": training_data_rows,
             "last_updated": datetime.fromtimestamp(
                 os.path.getmtime(model_path)
             ).isoformat() if os.path.exists(model_path) else None
@@ -248,6 +404,17 @@ async def get_model_info():
         logger.error(f"Model info error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get model info: {str(e)}")
 
+@app.get("/dataset/stats")
+async def get_dataset_stats():
+    """Get training dataset statistics (row counts, class balance, numeric ranges, last upload)."""
+    try:
+        from training_store import open_training_data
+        
+        return open_training_data(training_data_path).stats()
+    except Exception as e:
+        logger.error(f"Dataset stats error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get dataset stats: {str(e)}")
+
 @app.get("/commodities")
 async def get_commodities():
     """Get list of supported commodities by category."""
@@ -271,6 +438,12 @@ async def root():
             "predict": "/predict",
             "upload_data": "/upload_data",
             "model_info": "/model_info",
+            "dataset_stats": "/dataset/stats",
+            "training_job": "/training/jobs/{id}",
+            "retrain_scheduler": "/training/scheduler",
+            "training_history": "/training/history",
+            "drift_monitoring": "/monitoring/drift",
+            "similar_cases": "/predict/similar",
             "commodities": "/commodities",
             "docs": "/docs"
         }
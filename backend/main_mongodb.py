@@ -3,14 +3,17 @@ FastAPI backend for Surplus2Serve food spoilage risk prediction platform.
 Provides real-time spoilage risk predictions with continuous learning capabilities.
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks, Depends, status, Request
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Depends, status, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
 import pandas as pd
 import numpy as np
 import joblib
 import os
+import time
 import traceback
 from datetime import datetime, timedelta
 import logging
@@ -20,9 +23,8 @@ from bson import ObjectId
 import bcrypt
 import jwt
 import json
-from io import StringIO
 
-from models import PredictionRequest, PredictionResponse, HealthResponse, UploadResponse
+from models import PredictionRequest, PredictionResponse, HealthResponse, UploadResponse, TrainingJobResponse
 from db_models import (
     UserCreate, UserResponse, UserInDB, UserType,
     ProductCreate, ProductResponse, ProductInDB, ProductUpdate, ProductFilter, ProductSearch,
@@ -38,11 +40,14 @@ from utils import (
     load_model, 
     preprocess_input, 
     engineer_features,
-    get_commodity_category,
-    retrain_model_background,
-    validate_csv_data,
-    save_training_data
+    get_commodity_category
 )
+from model_suite import load_model_suite
+from similar_cases import load_similar_cases
+from training_store import open_training_data
+from training_history import TrainingHistory
+from upload_ingest import ingest_upload, is_supported_upload, UploadFormatError, UploadValidationError
+from write_behind import create_write_behind_logger
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -84,20 +89,49 @@ app.add_middleware(
 model = None
 model_path = "../Model/best_spoilage_model_with_xgboost.pkl"
 training_data_path = "training_data.csv"
+training_queue = None
+retrain_scheduler = None
+drift_monitor = None
+similar_cases_index = None
+write_behind = None
+
+# Collections whose records are logged through the write-behind buffer
+LOG_COLLECTIONS = {
+    "predictions": get_predictions_collection,
+    "analytics": get_analytics_collection
+}
+
+async def log_record(collection: str, document: Dict[str, Any]):
+    """Log a prediction or analytics record without waiting for MongoDB, if buffering is on."""
+    if write_behind is not None:
+        await write_behind.log(collection, document)
+    else:
+        await LOG_COLLECTIONS[collection]().insert_one(document)
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize application on startup."""
-    global model
+    global model, training_queue, retrain_scheduler, drift_monitor, similar_cases_index, write_behind
     
     # Connect to MongoDB
     mongo_connected = await connect_to_mongo()
     if not mongo_connected:
         logger.warning("MongoDB connection failed - some features will be limited")
     
+    # Prediction and analytics records are written in batches off the request path
+    try:
+        write_behind = create_write_behind_logger(LOG_COLLECTIONS)
+    except Exception as e:
+        logger.error(f"Failed to initialize write-behind logging: {str(e)}")
+        write_behind = None
+    
     # Load the trained model
     try:
         model = load_model(model_path)
+        # Serve the commodity-specific suite instead when MODEL_SUITE_DIR is configured
+        model = load_model_suite() or model
+        # Nearest historical cases, indexed by each training run next to the model
+        similar_cases_index = load_similar_cases(model_path)
         
         # Check if it's a fallback model
         if hasattr(model, 'version') and 'fallback' in str(model.version):
@@ -128,10 +162,34 @@ async def startup_event():
         except Exception as fallback_error:
             logger.error(f"Even fallback model failed: {str(fallback_error)}")
             model = None
+    
+    # Retraining runs in a separate worker process fed by a persistent job queue
+    try:
+        from training_jobs import TrainingJobQueue
+        from training_worker import ensure_worker_running
+        from retrain_scheduler import RetrainScheduler
+        training_queue = TrainingJobQueue()
+        retrain_scheduler = RetrainScheduler(training_queue)
+        ensure_worker_running(training_queue.db_path)
+    except Exception as e:
+        logger.error(f"Failed to initialize training job queue: {str(e)}")
+        training_queue = None
+        retrain_scheduler = None
+    
+    # Live prediction inputs are compared with the training data to detect drift
+    try:
+        from drift_monitor import create_drift_monitor
+        drift_monitor = create_drift_monitor(training_data_path, model_path, retrain_scheduler)
+    except Exception as e:
+        logger.error(f"Failed to initialize drift monitoring: {str(e)}")
+        drift_monitor = None
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean up on shutdown."""
+    # Flush buffered records while the connection is still open
+    if write_behind is not None:
+        await write_behind.stop()
     await close_mongo_connection()
 
 # Authentication Utilities
@@ -234,8 +292,7 @@ async def register_user(user_data: UserCreate):
         result = await users_collection.insert_one(user_dict)
         
         # Log registration analytics
-        analytics_collection = get_analytics_collection()
-        await analytics_collection.insert_one({
+        await log_record("analytics", {
             "event_type": "user_registration",
             "user_id": result.inserted_id,
             "details": {
@@ -282,8 +339,7 @@ async def login_user(email: str, password: str):
         access_token = create_access_token(data={"sub": str(user["_id"])})
         
         # Log login analytics
-        analytics_collection = get_analytics_collection()
-        await analytics_collection.insert_one({
+        await log_record("analytics", {
             "event_type": "user_login",
             "user_id": user["_id"],
             "details": {"user_type": user["user_type"]},
@@ -367,6 +423,23 @@ async def predict_spoilage_risk(
         prediction_proba = model.predict_proba(processed_data)[0]
         prediction_class = model.predict(processed_data)[0]
         
+        input_row = input_data.iloc[0].to_dict()
+        
+        # Track the inputs for drift monitoring; this never fails the prediction
+        if drift_monitor is not None:
+            try:
+                drift_monitor.observe(input_row)
+            except Exception as e:
+                logger.warning(f"Drift monitoring failed: {str(e)}")
+        
+        # Distance to the nearest historical cases flags inputs unlike the training data
+        ood = None
+        if similar_cases_index is not None:
+            try:
+                ood = similar_cases_index.ood(input_row)
+            except Exception as e:
+                logger.warning(f"Out-of-distribution check failed: {str(e)}")
+        
         # Calculate risk score (0-1 scale)
         risk_score = float(np.max(prediction_proba))
         
@@ -398,6 +471,8 @@ async def predict_spoilage_risk(
             },
             Model_Version=model_version,
             Estimated_Shelf_Life=estimated_shelf_life,
+            OOD_Distance=ood["distance"] if ood else None,
+            Is_Out_Of_Distribution=ood["is_out_of_distribution"] if ood else None,
             Timestamp=datetime.now().isoformat(),
             Input_Summary={
                 "commodity": request.Commodity_name,
@@ -411,7 +486,6 @@ async def predict_spoilage_risk(
         
         # Log prediction to MongoDB (if available)
         try:
-            predictions_collection = get_predictions_collection()
             prediction_record = {
                 "user_id": current_user.id if current_user else None,
                 "input_data": request.dict(),
@@ -425,11 +499,10 @@ async def predict_spoilage_risk(
                 "timestamp": datetime.utcnow(),
                 "ip_address": getattr(background_request, 'client', {}).get('host') if background_request else None
             }
-            await predictions_collection.insert_one(prediction_record)
+            await log_record("predictions", prediction_record)
             
             # Log analytics
-            analytics_collection = get_analytics_collection()
-            await analytics_collection.insert_one({
+            await log_record("analytics", {
                 "event_type": "prediction_made",
                 "user_id": current_user.id if current_user else None,
                 "details": {
@@ -451,10 +524,47 @@ async def predict_spoilage_risk(
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
+@app.get("/predict/similar")
+async def get_similar_cases(Commodity_name: str = Query(..., description="Name of the commodity"),
+                            Temperature: float = Query(..., description="Temperature in Celsius (0-50°C)"),
+                            Humidity: float = Query(..., description="Relative humidity percentage (0-100%)"),
+                            Storage_Type: str = Query(..., description="Type of storage"),
+                            Days_Since_Harvest: int = Query(..., description="Days since harvest (0-30 days)"),
+                            Transport_Duration: float = Query(8.0, description="Transport duration in hours"),
+                            Packaging_Quality: str = Query("good", description="Quality of packaging"),
+                            Month_num: int = Query(7, description="Month number (1-12)"),
+                            k: int = Query(5, ge=1, le=50, description="Number of similar cases to return"),
+                            current_user: UserInDB = Depends(get_current_user)):
+    """
+    Get the k most similar labelled historical lots of the commodity with their
+    actual spoilage outcomes, and how far the inputs are from the training data.
+    """
+    if similar_cases_index is None:
+        raise HTTPException(status_code=503, detail="Similar cases index not available")
+    
+    try:
+        # Same limits as prediction requests
+        request = PredictionRequest(
+            Commodity_name=Commodity_name, Temperature=Temperature, Humidity=Humidity,
+            Storage_Type=Storage_Type, Days_Since_Harvest=Days_Since_Harvest,
+            Transport_Duration=Transport_Duration, Packaging_Quality=Packaging_Quality, Month_num=Month_num
+        )
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    
+    try:
+        start = time.perf_counter()
+        result = similar_cases_index.query(request.model_dump(), k=k)
+        result["query_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return result
+    except Exception as e:
+        logger.error(f"Similar cases error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to find similar cases: {str(e)}")
+
 @app.post("/upload_data", response_model=UploadResponse)
 async def upload_training_data(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(..., description="CSV file with new training data"),
+    file: UploadFile = File(..., description="CSV file with new training data (optionally .gz or .zst compressed)"),
+    quarantine: bool = Query(False, description="Store the valid rows and quarantine invalid ones instead of rejecting the upload"),
     current_user: UserInDB = Depends(get_current_user)
 ):
     """
@@ -470,55 +580,50 @@ async def upload_training_data(
             raise HTTPException(status_code=403, detail="Insufficient permissions to upload training data")
         
         # Validate file type
-        if not file.filename or not file.filename.endswith('.csv'):
-            raise HTTPException(status_code=400, detail="Only CSV files are supported")
-        
-        # Read uploaded CSV
-        contents = await file.read()
+        if not is_supported_upload(file.filename):
+            raise HTTPException(status_code=400, detail="Only CSV files (.csv, .csv.gz, .csv.zst) are supported")
         
-        # Load and validate data
+        # Parse, validate and store the upload chunk by chunk, off the event loop
         try:
-            new_data = pd.read_csv(StringIO(contents.decode('utf-8')))
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid CSV format: {str(e)}")
-        
-        # Validate data structure
-        validation_result = validate_csv_data(new_data)
-        if not validation_result["is_valid"]:
-            raise HTTPException(status_code=400, detail=validation_result["error"])
-        
-        # Save to traditional CSV file (for backward compatibility)
-        rows_added = save_training_data(new_data, training_data_path)
+            ingested = await run_in_threadpool(ingest_upload, file.file, file.filename, training_data_path,
+                                               quarantine=quarantine)
+        except UploadFormatError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except UploadValidationError as e:
+            raise HTTPException(status_code=400, detail={
+                "error": str(e),
+                "rows_added": e.report["rows_added"],
+                "validation_errors": e.report["validation"]["errors"]
+            })
+        rows_added = ingested["rows_added"]
         
-        # Save to MongoDB
+        # Record the upload in MongoDB (the rows themselves live in the training data store)
         try:
             training_data_collection = get_training_data_collection()
             
-            # Convert DataFrame to list of dictionaries
-            data_records = new_data.to_dict('records')
-            
             training_record = {
                 "uploaded_by": current_user.id,
                 "filename": file.filename,
-                "data_records": data_records,
-                "total_records": len(data_records),
+                "total_records": ingested["rows_received"],
+                "rows_added": rows_added,
+                "duplicates_existing": ingested["duplicates_existing"],
+                "duplicates_in_upload": ingested["duplicates_in_upload"],
                 "upload_timestamp": datetime.utcnow(),
-                "file_size": len(contents),
-                "validation_status": "valid",
-                "validation_errors": None
+                "file_size": file.size,
+                "validation_status": "quarantined" if ingested["rows_quarantined"] else "valid",
+                "validation_errors": [error["message"] for error in ingested["validation"]["errors"]] or None
             }
             
             await training_data_collection.insert_one(training_record)
             
             # Log analytics
-            analytics_collection = get_analytics_collection()
-            await analytics_collection.insert_one({
+            await log_record("analytics", {
                 "event_type": "training_data_uploaded",
                 "user_id": current_user.id,
                 "details": {
                     "filename": file.filename,
                     "rows_added": rows_added,
-                    "file_size": len(contents)
+                    "file_size": file.size
                 },
                 "timestamp": datetime.utcnow()
             })
@@ -526,20 +631,29 @@ async def upload_training_data(
         except Exception as db_error:
             logger.warning(f"Failed to save training data to MongoDB: {str(db_error)}")
         
-        # Trigger background retraining
-        background_tasks.add_task(
-            retrain_model_background, 
-            training_data_path, 
-            model_path
-        )
+        # Let the scheduler coalesce this upload into a (debounced) retraining job
+        training_job = None
+        if retrain_scheduler is not None:
+            # Enqueueing waits on the SQLite job queue's write lock
+            training_job = await run_in_threadpool(retrain_scheduler.notify_upload, rows_added,
+                                                   training_data_path, model_path,
+                                                   categories=ingested["categories"])
         
         logger.info(f"Training data uploaded: {rows_added} rows added by user {current_user.username}")
         
+        total_rows = await run_in_threadpool(lambda: open_training_data(training_data_path).row_count())
+        
         return UploadResponse(
             message="Training data uploaded successfully",
             rows_added=rows_added,
-            total_rows=len(pd.read_csv(training_data_path)),
-            retraining_started=True,
+            duplicates_existing=ingested["duplicates_existing"],
+            duplicates_in_upload=ingested["duplicates_in_upload"],
+            rows_quarantined=ingested["rows_quarantined"],
+            quarantine_file=os.path.basename(ingested["quarantine_file"]) if ingested["quarantine_file"] else None,
+            validation_errors=ingested["validation"]["errors"],
+            total_rows=total_rows,
+            retraining_started=training_job is not None,
+            training_job_id=training_job["id"] if training_job else None,
             timestamp=datetime.now().isoformat()
         )
         
@@ -551,6 +665,60 @@ async def upload_training_data(
         logger.error(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+@app.get("/training/jobs/{job_id}", response_model=TrainingJobResponse)
+async def get_training_job(job_id: str):
+    """Get progress, stage timings, peak memory and metrics of a retraining job."""
+    if training_queue is None:
+        raise HTTPException(status_code=503, detail="Training job queue not available")
+    
+    job = training_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    
+    return TrainingJobResponse.from_job(job)
+
+@app.get("/training/scheduler")
+async def get_retrain_scheduler_status():
+    """Get retrain scheduler thresholds and the uploads waiting for a retrain."""
+    if retrain_scheduler is None:
+        raise HTTPException(status_code=503, detail="Retrain scheduler not available")
+    
+    return retrain_scheduler.status()
+
+@app.get("/training/history")
+async def get_training_history(limit: int = Query(50, ge=1, le=1000,
+                                                  description="Number of most recent runs to return"),
+                               run_status: Optional[str] = Query(None, alias="status",
+                                                                 description="Only runs with this status"),
+                               mode: Optional[str] = Query(None, description="Only runs in this training mode")):
+    """Get telemetry of recent training runs: stage timings, peak RSS, throughput, model size and per-class metrics."""
+    try:
+        runs = TrainingHistory().runs(limit=limit, status=run_status, mode=mode)
+        return {"count": len(runs), "runs": runs}
+    except Exception as e:
+        logger.error(f"Training history error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get training history: {str(e)}")
+
+@app.get("/monitoring/drift")
+async def get_drift_status():
+    """Get PSI/KS drift of live prediction inputs against the training data, overall and per commodity category."""
+    if drift_monitor is None:
+        raise HTTPException(status_code=503, detail="Drift monitoring not available")
+    
+    try:
+        # Evaluating the current window may read the training data manifest
+        return await run_in_threadpool(drift_monitor.status)
+    except Exception as e:
+        logger.error(f"Drift monitoring error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get drift status: {str(e)}")
+
+@app.get("/monitoring/logging")
+async def get_logging_status():
+    """Get queue depth, throughput, drops and spill state of the write-behind prediction / analytics logging."""
+    if write_behind is None:
+        raise HTTPException(status_code=503, detail="Write-behind logging not enabled")
+    return write_behind.status()
+
 @app.get("/model_info")
 async def get_model_info():
     """Get information about the current model."""
@@ -559,10 +727,13 @@ async def get_model_info():
             return {"status": "Model not loaded"}
         
         # Get model information
+        training_data_rows = await run_in_threadpool(
+            lambda: open_training_data(training_data_path).row_count()
+        )
         model_info = {
             "model_type": str(type(model)),
             "model_loaded": True,
-            "training_data_rows": len(pd.read_csv(training_data_path)) if os.path.exists(training_data_path) else 0,
+            "training_data_rows": training_data_rows,
             "last_updated": datetime.fromtimestamp(
                 os.path.getmtime(model_path)
             ).isoformat() if os.path.exists(model_path) else None
@@ -574,6 +745,15 @@ async def get_model_info():
         logger.error(f"Model info error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get model info: {str(e)}")
 
+@app.get("/dataset/stats")
+async def get_dataset_stats():
+    """Get training dataset statistics (row counts, class balance, numeric ranges, last upload)."""
+    try:
+        return open_training_data(training_data_path).stats()
+    except Exception as e:
+        logger.error(f"Dataset stats error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get dataset stats: {str(e)}")
+
 @app.get("/commodities")
 async def get_commodities():
     """Get list of supported commodities by category."""
@@ -614,7 +794,16 @@ async def root():
                 "my_products": "/my-products"
             },
             "prediction": "/predict",
-            "training": "/upload_data",
+            "drift_monitoring": "/monitoring/drift",
+            "logging": "/monitoring/logging",
+            "similar_cases": "/predict/similar",
+            "training": {
+                "upload": "/upload_data",
+                "job_status": "/training/jobs/{id}",
+                "scheduler": "/training/scheduler",
+                "history": "/training/history",
+                "dataset_stats": "/dataset/stats"
+            },
             "analytics": {
                 "dashboard": "/analytics/dashboard",
                 "prediction_details": "/analytics/predictions/{id}"
@@ -685,8 +874,7 @@ async def create_product(
             )
             
             # Log prediction to database
-            predictions_collection = get_predictions_collection()
-            await predictions_collection.insert_one({
+            await log_record("predictions", {
                 "user_id": current_user.id,
                 "product_id": result.inserted_id,
                 "input_data": prediction_request.dict(),
@@ -704,8 +892,7 @@ async def create_product(
             logger.warning(f"Failed to generate initial prediction: {str(pred_error)}")
         
         # Log analytics
-        analytics_collection = get_analytics_collection()
-        await analytics_collection.insert_one({
+        await log_record("analytics", {
             "event_type": "product_created",
             "user_id": current_user.id,
             "details": {
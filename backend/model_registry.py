@@ -0,0 +1,71 @@
+"""
+Model registry for Surplus2Serve.
+Keeps a JSON record of every trained model version: how it was trained,
+how much of the training data it has seen and how it performed.
+"""
+
+import os
+import json
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional, List
+
+logger = logging.getLogger(__name__)
+
+MODEL_REGISTRY_PATH = os.getenv("MODEL_REGISTRY_PATH", "model_registry.json")
+
+class ModelRegistry:
+    """Append-only list of model versions stored in a JSON file."""
+
+    def __init__(self, registry_path: str = MODEL_REGISTRY_PATH):
+        self.registry_path = os.path.abspath(registry_path)
+
+    def entries(self, model_path: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Return all registered versions (oldest first), optionally for one model path."""
+        if not os.path.exists(self.registry_path):
+            return []
+        try:
+            with open(self.registry_path, "r") as f:
+                entries = json.load(f).get("models", [])
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read model registry: {str(e)}")
+            return []
+        if model_path is not None:
+            model_path = os.path.abspath(model_path)
+            entries = [entry for entry in entries if entry.get("model_path") == model_path]
+        return entries
+
+    def latest(self, model_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Return the most recently registered version."""
+        entries = self.entries(model_path)
+        return entries[-1] if entries else None
+
+    def last_best_params(self, model_family: str) -> Optional[Dict[str, Any]]:
+        """Return the most recent tuned configuration for a model family, if any."""
+        for entry in reversed(self.entries()):
+            if entry.get("model_family") == model_family and entry.get("best_params"):
+                return entry["best_params"]
+        return None
+
+    def register(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Add a model version; fills in version and created_at if missing."""
+        entry = dict(entry)
+        entry.setdefault("created_at", datetime.now().isoformat())
+        entry.setdefault("version", new_model_version())
+        if entry.get("model_path"):
+            entry["model_path"] = os.path.abspath(entry["model_path"])
+
+        entries = self.entries()
+        entries.append(entry)
+
+        tmp_path = f"{self.registry_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump({"models": entries}, f, indent=2, default=str)
+        os.replace(tmp_path, self.registry_path)
+
+        logger.info(f"Registered model version {entry['version']}")
+        return entry
+
+def new_model_version() -> str:
+    """Generate a sortable model version string."""
+    return datetime.now().strftime("v%Y%m%d%H%M%S%f")
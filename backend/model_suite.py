@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Commodity-specific model suite for Surplus2Serve.
+
+Trains the general model and one specialist per commodity category in
+parallel across a process pool. Features are engineered and preprocessed
+once, written to a .npy file and memory-mapped by every worker, so the
+feature matrix is shared instead of copied into each process. When only
+some categories received new data, only their specialists are retrained and
+the rest are carried over from the previous suite version.
+
+The result is described by a single versioned manifest (suite_manifest.json)
+which ModelSuite loads for serving.
+
+Usage:
+    python model_suite.py --data training_data.csv --suite-dir ../Model/suite [--categories Fruits Berries]
+"""
+
+import os
+import json
+import time
+import argparse
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score
+
+from utils import engineer_features, get_commodity_category, enhanced_commodities
+from model_registry import new_model_version
+from training import build_model_pipeline, holdout_mask, DEFAULT_MODEL_FAMILY
+from training_store import open_training_data
+
+logger = logging.getLogger(__name__)
+
+MODEL_SUITE_DIR = os.getenv("MODEL_SUITE_DIR", "")
+SUITE_MANIFEST = "suite_manifest.json"
+GENERAL_MEMBER = "general"
+# Categories with fewer rows than this are served by the general model
+MIN_SPECIALIST_ROWS = int(os.getenv("MIN_SPECIALIST_ROWS", "200"))
+
+def _fit_member(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Fit one suite member on its rows of the shared memory-mapped feature matrix."""
+    start = time.perf_counter()
+    X = np.load(task["features_path"], mmap_mode='r')
+    y = np.load(task["labels_path"], mmap_mode='r')
+    train_rows, test_rows = task["train_rows"], task["test_rows"]
+
+    classifier = task["classifier"]
+    classifier.fit(X[train_rows], y[train_rows])
+    y_pred = classifier.predict(X[test_rows]) if len(test_rows) else np.array([])
+
+    joblib.dump(classifier, task["output_path"])
+    return {
+        "member": task["member"],
+        "path": task["output_path"],
+        "train_rows": int(len(train_rows)),
+        "test_rows": int(len(test_rows)),
+        "accuracy": float(accuracy_score(y[test_rows], y_pred)) if len(test_rows) else None,
+        "fit_seconds": round(time.perf_counter() - start, 4),
+        "test_predictions": y_pred.tolist()
+    }
+
+def load_suite_manifest(suite_dir: str) -> Optional[Dict[str, Any]]:
+    """Return the current suite manifest, or None if no suite has been trained."""
+    manifest_path = os.path.join(suite_dir, SUITE_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+def train_model_suite(data: pd.DataFrame, suite_dir: str,
+                      categories: Optional[List[str]] = None,
+                      model_family: str = DEFAULT_MODEL_FAMILY,
+                      classifier_params: Optional[Dict[str, Any]] = None,
+                      max_workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Train the general model and per-category specialists and write a new suite manifest.
+
+    categories limits retraining to the specialists of those categories (plus the
+    general model); the other specialists and the fitted preprocessor are reused
+    from the previous suite. Pass None to rebuild the whole suite.
+    """
+    start = time.perf_counter()
+    os.makedirs(suite_dir, exist_ok=True)
+    previous = load_suite_manifest(suite_dir)
+    # A different model family needs a different preprocessor, so rebuild everything
+    partial = (categories is not None and previous is not None
+               and previous["model_family"] == model_family)
+
+    version = new_model_version()
+    version_dir = os.path.join(suite_dir, version)
+    os.makedirs(version_dir)
+
+    if 'Commodity_Category' not in data.columns:
+        data = data.assign(Commodity_Category=data['Commodity_name'].map(get_commodity_category))
+    X_engineered = engineer_features(data.drop(['Spoilage_Risk'], axis=1, errors='ignore'))
+    y = data['Spoilage_Risk'].to_numpy()
+    row_categories = data['Commodity_Category'].to_numpy()
+
+    template = build_model_pipeline(X_engineered, n_jobs=1, model_family=model_family,
+                                    classifier_params=classifier_params)
+
+    # Specialists share the preprocessor so they can be served from one transform
+    if partial:
+        preprocessor_path = previous["preprocessor"]
+        preprocessor = joblib.load(preprocessor_path)
+    else:
+        preprocessor = template.named_steps['preprocessor']
+        preprocessor.fit(X_engineered)
+        preprocessor_path = os.path.join(version_dir, "preprocessor.joblib")
+        joblib.dump(preprocessor, preprocessor_path)
+
+    features_path = os.path.join(version_dir, "features.npy")
+    labels_path = os.path.join(version_dir, "labels.npy")
+    np.save(features_path, np.ascontiguousarray(preprocessor.transform(X_engineered), dtype=np.float32))
+    np.save(labels_path, y)
+    del X_engineered
+
+    test_mask = holdout_mask(0, len(data))
+    all_rows = np.arange(len(data))
+
+    def make_task(member: str, rows: np.ndarray) -> Dict[str, Any]:
+        return {
+            "member": member,
+            "features_path": features_path,
+            "labels_path": labels_path,
+            "train_rows": rows[~test_mask[rows]],
+            "test_rows": rows[test_mask[rows]],
+            "classifier": clone(template.named_steps['classifier']),
+            "output_path": os.path.join(version_dir, f"{member.replace(' ', '_').lower()}.joblib")
+        }
+
+    tasks = [make_task(GENERAL_MEMBER, all_rows)]
+    members: Dict[str, Dict[str, Any]] = {}
+    known_categories = sorted(set(enhanced_commodities) | set(pd.unique(row_categories)) - {"Unknown"})
+    for category in known_categories:
+        rows = all_rows[row_categories == category]
+        if partial and category not in categories and category in previous["members"]:
+            members[category] = dict(previous["members"][category], retrained=False)
+            continue
+        if len(rows) < MIN_SPECIALIST_ROWS or len(np.unique(y[rows])) < 2:
+            members[category] = {"status": "insufficient_data", "rows": int(len(rows)),
+                                 "retrained": False}
+            continue
+        tasks.append(make_task(category, rows))
+
+    logger.info(f"Training {len(tasks)} suite member(s) across a process pool")
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as pool:
+        futures = [pool.submit(_fit_member, task) for task in tasks]
+        outcomes = [(task, future.exception()) for task, future in zip(tasks, futures)]
+
+    failed = {task["member"]: error for task, error in outcomes if error is not None}
+    if GENERAL_MEMBER in failed:
+        raise failed[GENERAL_MEMBER]
+    # A specialist that fails to fit keeps its previous model when that shares the
+    # preprocessor, otherwise its category is served by the general model
+    for category, error in failed.items():
+        logger.error(f"Suite member {category} failed to train: {error}")
+        if partial and previous["members"].get(category, {}).get("status") == "trained":
+            members[category] = dict(previous["members"][category], retrained=False, error=str(error))
+        else:
+            members[category] = {"status": "failed", "error": str(error), "retrained": False}
+
+    trained = [(task, future.result()) for task, future in zip(tasks, futures)
+               if task["member"] not in failed]
+    general_predictions = dict(zip(tasks[0]["test_rows"].tolist(), trained[0][1]["test_predictions"]))
+    for task, result in trained:
+        member = result.pop("member")
+        result.pop("test_predictions")
+        entry = dict(result, status="trained", retrained=True, version=version)
+        if member != GENERAL_MEMBER and len(task["test_rows"]):
+            # Compare each specialist with the general model on the same rows
+            general_pred = [general_predictions[row] for row in task["test_rows"].tolist()]
+            entry["general_accuracy"] = float(accuracy_score(y[task["test_rows"]], general_pred))
+        members[member] = entry
+
+    os.remove(features_path)
+    os.remove(labels_path)
+
+    manifest = {
+        "suite_version": version,
+        "created_at": datetime.now().isoformat(),
+        "previous_version": previous["suite_version"] if previous else None,
+        "model_family": model_family,
+        "classifier_params": classifier_params or {},
+        "rows": int(len(data)),
+        "preprocessor": preprocessor_path,
+        "retrained_categories": sorted(categories) if partial else "all",
+        "training_seconds": round(time.perf_counter() - start, 4),
+        "members": members
+    }
+
+    manifest_path = os.path.join(suite_dir, SUITE_MANIFEST)
+    tmp_path = f"{manifest_path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    logger.info(f"Model suite {version} written to {manifest_path}")
+
+    return manifest
+
+def upload_categories(data: pd.DataFrame) -> List[str]:
+    """Commodity categories present in an upload, i.e. the specialists it affects."""
+    if 'Commodity_Category' in data.columns:
+        categories = data['Commodity_Category']
+    else:
+        categories = data['Commodity_name'].map(get_commodity_category)
+    return sorted(str(c) for c in categories.dropna().unique() if c != "Unknown")
+
+class ModelSuite:
+    """
+    Serve a trained suite: rows are routed to their category specialist when
+    one exists, otherwise to the general model. Accepts the engineered
+    features produced by preprocess_input.
+    """
+
+    def __init__(self, suite_dir: str):
+        manifest = load_suite_manifest(suite_dir)
+        if manifest is None:
+            raise FileNotFoundError(f"No model suite manifest found in {suite_dir}")
+        self.manifest = manifest
+        self.version = manifest["suite_version"]
+        self.preprocessor = joblib.load(manifest["preprocessor"])
+        self.members = {
+            name: joblib.load(member["path"])
+            for name, member in manifest["members"].items()
+            if member.get("status") == "trained"
+        }
+        self.general = self.members[GENERAL_MEMBER]
+        self.classes_ = self.general.classes_
+
+    def predict_proba(self, X: pd.DataFrame) -> np.ndarray:
+        X_transformed = self.preprocessor.transform(X).astype(np.float32)
+        probabilities = np.zeros((len(X), len(self.classes_)))
+        categories = X['Commodity_Category'].to_numpy() if 'Commodity_Category' in X.columns \
+            else np.full(len(X), GENERAL_MEMBER)
+
+        for category in pd.unique(categories):
+            rows = np.flatnonzero(categories == category)
+            member = self.members.get(category, self.general)
+            member_proba = member.predict_proba(X_transformed[rows])
+            # Specialists may not have seen every class
+            columns = np.searchsorted(self.classes_, member.classes_)
+            probabilities[np.ix_(rows, columns)] = member_proba
+        return probabilities
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def load_model_suite(suite_dir: str = MODEL_SUITE_DIR) -> Optional[ModelSuite]:
+    """Load the model suite for serving, or None if suites are disabled or not trained yet."""
+    if not suite_dir or load_suite_manifest(suite_dir) is None:
+        return None
+    try:
+        suite = ModelSuite(suite_dir)
+        logger.info(f"Loaded model suite {suite.version} with {len(suite.members)} member(s)")
+        return suite
+    except Exception as e:
+        logger.error(f"Error loading model suite: {str(e)}")
+        return None
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Train the commodity-specific model suite")
+    parser.add_argument("--data", default="training_data.csv",
+                        help="Training data path, read through the training store")
+    parser.add_argument("--suite-dir", default=MODEL_SUITE_DIR or "../Model/suite")
+    parser.add_argument("--categories", nargs="*", default=None,
+                        help="Only retrain these category specialists")
+    parser.add_argument("--family", default=DEFAULT_MODEL_FAMILY)
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size")
+    args = parser.parse_args()
+
+    manifest = train_model_suite(open_training_data(args.data).read(), args.suite_dir,
+                                 categories=args.categories, model_family=args.family,
+                                 max_workers=args.workers)
+
+    print(f"\nSuite {manifest['suite_version']} ({manifest['training_seconds']:.1f}s)")
+    print(f"{'Member':<15} {'Status':<18} {'Rows':<7} {'Accuracy':<9} General")
+    for name, member in manifest["members"].items():
+        rows = member.get("train_rows", member.get("rows", 0)) + member.get("test_rows", 0)
+        accuracy = f"{member['accuracy']:.4f}" if member.get("accuracy") is not None else "-"
+        general = f"{member['general_accuracy']:.4f}" if member.get("general_accuracy") is not None else "-"
+        status = member.get("status", "") + ("" if member.get("retrained", True) else " (kept)")
+        print(f"{name:<15} {status:<18} {rows:<7} {accuracy:<9} {general}")
+
+if __name__ == "__main__":
+    main()
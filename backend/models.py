@@ -3,7 +3,10 @@ Pydantic models for request/response validation in the Surplus2Serve API.
 """
 
 from pydantic import BaseModel, Field, field_validator, ConfigDict
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+
+VALID_STORAGE_TYPES = ['cold_storage', 'room_temperature', 'open_air']
+VALID_PACKAGING_QUALITY = ['poor', 'average', 'good']
 
 class PredictionRequest(BaseModel):
     """Request model for spoilage risk prediction."""
@@ -88,17 +91,15 @@ class PredictionRequest(BaseModel):
     @field_validator('Storage_Type')
     @classmethod
     def validate_storage_type(cls, v):
-        valid_storage_types = ['cold_storage', 'room_temperature', 'open_air']
-        if v not in valid_storage_types:
-            raise ValueError(f'Storage type must be one of: {valid_storage_types}')
+        if v not in VALID_STORAGE_TYPES:
+            raise ValueError(f'Storage type must be one of: {VALID_STORAGE_TYPES}')
         return v
     
     @field_validator('Packaging_Quality')
     @classmethod
     def validate_packaging_quality(cls, v):
-        valid_packaging = ['poor', 'average', 'good']
-        if v not in valid_packaging:
-            raise ValueError(f'Packaging quality must be one of: {valid_packaging}')
+        if v not in VALID_PACKAGING_QUALITY:
+            raise ValueError(f'Packaging quality must be one of: {VALID_PACKAGING_QUALITY}')
         return v
 class PredictionResponse(BaseModel):
     """Response model for spoilage risk prediction."""
@@ -170,6 +171,18 @@ class PredictionResponse(BaseModel):
         examples=[7]
     )
     
+    OOD_Distance: Optional[float] = Field(
+        default=None,
+        description="Mean standardized distance to the nearest historical cases of the commodity",
+        examples=[0.42]
+    )
+    
+    Is_Out_Of_Distribution: Optional[bool] = Field(
+        default=None,
+        description="Whether the inputs are further from the training data than 99% of training rows",
+        examples=[False]
+    )
+    
 
 class HealthResponse(BaseModel):
     """Response model for health check."""
@@ -184,10 +197,40 @@ class UploadResponse(BaseModel):
     message: str = Field(..., description="Upload status message", examples=["Training data uploaded successfully"])
     rows_added: int = Field(..., description="Number of rows added", examples=[100])
     total_rows: int = Field(..., description="Total rows in training dataset", examples=[5000])
+    duplicates_existing: int = Field(default=0, description="Uploaded rows already in the training dataset", examples=[12])
+    duplicates_in_upload: int = Field(default=0, description="Rows repeated within the upload itself", examples=[3])
+    rows_quarantined: int = Field(default=0, description="Invalid rows set aside in quarantine mode", examples=[0])
+    quarantine_file: Optional[str] = Field(default=None, description="Quarantine file holding the invalid rows", examples=[None])
+    validation_errors: List[Dict[str, Any]] = Field(default_factory=list, description="Failed validation rules with counts and row numbers")
     retraining_started: bool = Field(..., description="Whether retraining was triggered", examples=[True])
+    training_job_id: Optional[str] = Field(default=None, description="Id of the queued retraining job", examples=["3f2c9a0e5b7d4e1f8a6b2c4d9e0f1a2b"])
     timestamp: str = Field(..., description="Upload timestamp", examples=["2024-07-07T10:30:00"])
     timestamp: str = Field(..., description="Upload timestamp", examples=["2024-07-07T10:30:00"])
 
+class TrainingJobResponse(BaseModel):
+    """Response model for a model retraining job."""
+    
+    model_config = ConfigDict(protected_namespaces=())
+    
+    id: str = Field(..., description="Training job id")
+    status: str = Field(..., description="Job status (queued, running, completed, skipped, failed)", examples=["running"])
+    progress: float = Field(..., description="Progress of the job (0.0 - 1.0)", examples=[0.3])
+    stage: Optional[str] = Field(default=None, description="Training stage currently running", examples=["fit"])
+    stage_timings: Dict[str, float] = Field(default_factory=dict, description="Seconds spent in each finished stage", examples=[{"load": 0.21, "feature_engineering": 0.35}])
+    peak_memory_mb: Optional[float] = Field(default=None, description="Peak resident memory of the training process in MB", examples=[412.5])
+    metrics: Dict[str, Any] = Field(default_factory=dict, description="Evaluation metrics of the trained model", examples=[{"accuracy": 0.9084}])
+    error: Optional[str] = Field(default=None, description="Failure or skip reason")
+    created_at: str = Field(..., description="Job creation timestamp", examples=["2024-07-07T10:30:00"])
+    started_at: Optional[str] = Field(default=None, description="Job start timestamp")
+    finished_at: Optional[str] = Field(default=None, description="Job completion timestamp")
+    not_before: Optional[str] = Field(default=None, description="Earliest start time after debouncing uploads")
+    params: Dict[str, Any] = Field(default_factory=dict, description="Job parameters, e.g. coalesced upload counts", examples=[{"pending_rows": 1200, "coalesced_uploads": 3}])
+    
+    @classmethod
+    def from_job(cls, job: Dict[str, Any]) -> "TrainingJobResponse":
+        """Build a response from a job record returned by TrainingJobQueue."""
+        return cls(**{k: v for k, v in job.items() if k in cls.model_fields and v is not None})
+
 class ErrorResponse(BaseModel):
     """Response model for errors."""
     error: str = Field(..., description="Error message")
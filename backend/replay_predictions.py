@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Replay logged predictions against a candidate model before promoting it.
+
+The predictions collection (main_mongodb.py) stores the input_data of every
+request together with the class, probabilities and model version that
+production returned. This tool:
+
+1. exports a time window of those records to a JSONL file, so a replay can
+   be repeated (and run without MongoDB access), and
+2. re-scores the exported inputs with a candidate: a model artifact or model
+   suite loaded in-process (same preprocessing and calls as /predict), or a
+   running API over HTTP.
+
+Requests are sent as fast as --concurrency workers allow (--speed 0), at the
+recorded pace (--speed 1) or accelerated (--speed 10 replays ten times
+faster). Paced replays are open-loop: requests start at their scheduled time
+whether or not earlier ones have finished, and how late they started is
+reported as schedule lag.
+
+The report covers latency percentiles, throughput, errors and disagreement
+with production: the confusion matrix of logged vs candidate classes, the
+disagreement rate per logged class and per production model version, and
+the mean absolute change in probabilities. Gate thresholds make the tool
+exit with status 1 when the candidate should not be promoted.
+
+Usage:
+    python replay_predictions.py export --since 2024-06-01 --until 2024-06-08 --output replay.jsonl
+    python replay_predictions.py replay --input replay.jsonl --model ../Model/candidate.pkl
+    python replay_predictions.py replay --input replay.jsonl --url http://localhost:8000 --token $TOKEN --speed 10
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+RISK_LABELS = {0: "Low Risk", 1: "Medium Risk", 2: "High Risk"}
+PROBABILITY_KEYS = ["Low_Risk", "Medium_Risk", "High_Risk"]
+# Fields of a prediction record kept in the export
+EXPORT_FIELDS = ["timestamp", "input_data", "spoilage_risk_category", "probabilities", "model_version"]
+# Default promotion gate: share of replayed requests whose class may change, and errors allowed
+DEFAULT_MAX_DISAGREEMENT = 0.05
+DEFAULT_MAX_ERROR_RATE = 0.0
+HTTP_TIMEOUT_SECONDS = 30
+
+def parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+def export_predictions(output_path: str, since: datetime, until: Optional[datetime] = None,
+                       model_version: Optional[str] = None, limit: int = 0) -> int:
+    """Write the logged predictions of a time window, oldest first, to a JSONL file."""
+    from pymongo import MongoClient, ASCENDING
+    from database import MONGODB_URL, DATABASE_NAME
+
+    query: Dict[str, Any] = {"timestamp": {"$gte": since}}
+    if until is not None:
+        query["timestamp"]["$lt"] = until
+    if model_version:
+        query["model_version"] = model_version
+
+    client = MongoClient(MONGODB_URL)
+    try:
+        cursor = client[DATABASE_NAME].predictions.find(query, {field: 1 for field in EXPORT_FIELDS}) \
+            .sort("timestamp", ASCENDING).limit(limit)
+        tmp_path = f"{output_path}.tmp-{os.getpid()}"
+        exported = 0
+        with open(tmp_path, "w") as f:
+            for record in cursor:
+                f.write(json.dumps({
+                    "timestamp": record["timestamp"].isoformat(),
+                    "input_data": record["input_data"],
+                    "spoilage_risk_category": record.get("spoilage_risk_category"),
+                    "probabilities": record.get("probabilities"),
+                    "model_version": record.get("model_version")
+                }) + "\n")
+                exported += 1
+        os.replace(tmp_path, output_path)
+    finally:
+        client.close()
+    logger.info(f"Exported {exported} predictions to {output_path}")
+    return exported
+
+def load_replay(path: str, limit: int = 0) -> List[Dict[str, Any]]:
+    """Exported records ordered by timestamp."""
+    records = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+                if limit and len(records) >= limit:
+                    break
+    records.sort(key=lambda record: record["timestamp"])
+    return records
+
+def input_frame(input_data: Dict[str, Any]) -> pd.DataFrame:
+    """The single-row frame /predict builds from a request."""
+    from models import PredictionRequest
+    from utils import get_commodity_category
+
+    request = PredictionRequest(**input_data)
+    return pd.DataFrame([{
+        'Temperature': request.Temperature,
+        'Humidity': request.Humidity,
+        'Storage_Type': request.Storage_Type,
+        'Days_Since_Harvest': request.Days_Since_Harvest,
+        'Transport_Duration': request.Transport_Duration or 8.0,
+        'Packaging_Quality': request.Packaging_Quality or "good",
+        'Month_num': request.Month_num or 7,
+        'Commodity_name': request.Commodity_name,
+        'Commodity_Category': request.Commodity_Category or get_commodity_category(request.Commodity_name),
+        'Location': request.Location or "Delhi",
+        'Ethylene_Level': request.Ethylene_Level or 0.0
+    }])
+
+def in_process_scorer(model) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Score inputs with a loaded model the way the /predict handler does."""
+    from utils import preprocess_input
+
+    def score(input_data: Dict[str, Any]) -> Dict[str, Any]:
+        processed = preprocess_input(input_frame(input_data), model)
+        proba = model.predict_proba(processed)[0]
+        predicted = model.predict(processed)[0]
+        return {"class": int(predicted), "probabilities": [float(p) for p in proba[:len(PROBABILITY_KEYS)]]}
+    return score
+
+def http_scorer(url: str, token: Optional[str] = None) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Score inputs by POSTing them to a running API; each worker thread keeps its own connection."""
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    path = parts.path.rstrip("/") + "/predict"
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    local = threading.local()
+
+    def score(input_data: Dict[str, Any]) -> Dict[str, Any]:
+        body = json.dumps({key: value for key, value in input_data.items() if value is not None})
+        for attempt in range(2):
+            if getattr(local, "connection", None) is None:
+                local.connection = connection_class(parts.netloc, timeout=HTTP_TIMEOUT_SECONDS)
+            try:
+                local.connection.request("POST", path, body=body, headers=headers)
+                response = local.connection.getresponse()
+                payload = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server closed a kept-alive connection; reconnect once
+                local.connection.close()
+                local.connection = None
+                if attempt:
+                    raise
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}: {payload[:200].decode(errors='replace')}")
+        result = json.loads(payload)
+        return {"class": int(result["Spoilage_Risk"]),
+                "probabilities": [float(result["Probabilities"][key]) for key in PROBABILITY_KEYS]}
+    return score
+
+def replay(records: List[Dict[str, Any]], score: Callable[[Dict[str, Any]], Dict[str, Any]],
+           speed: float = 0.0, concurrency: int = 1) -> List[Dict[str, Any]]:
+    """
+    Score every record, as fast as possible (speed 0) or paced at speed times
+    the recorded rate. Returns one outcome per record, in record order.
+    """
+    outcomes: List[Optional[Dict[str, Any]]] = [None] * len(records)
+    offsets = [0.0] * len(records)
+    if speed > 0 and records:
+        first = parse_time(records[0]["timestamp"])
+        offsets = [(parse_time(r["timestamp"]) - first).total_seconds() / speed for r in records]
+
+    def run(i: int, scheduled: float):
+        started = time.perf_counter()
+        outcome: Dict[str, Any] = {"lag_ms": (started - scheduled) * 1000 if speed > 0 else 0.0}
+        try:
+            outcome.update(score(records[i]["input_data"]))
+        except Exception as e:
+            outcome["error"] = str(e)
+        outcome["latency_ms"] = (time.perf_counter() - started) * 1000
+        outcomes[i] = outcome
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        for i in range(len(records)):
+            scheduled = start + offsets[i]
+            if speed > 0:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(run, i, scheduled)
+    return outcomes
+
+def _percentiles(values: List[float], prefix: str) -> Dict[str, Optional[float]]:
+    if not values:
+        return {f"{prefix}_{name}_ms": None for name in ("mean", "p50", "p95", "p99", "max")}
+    values = np.asarray(values)
+    return {
+        f"{prefix}_mean_ms": round(float(values.mean()), 3),
+        f"{prefix}_p50_ms": round(float(np.percentile(values, 50)), 3),
+        f"{prefix}_p95_ms": round(float(np.percentile(values, 95)), 3),
+        f"{prefix}_p99_ms": round(float(np.percentile(values, 99)), 3),
+        f"{prefix}_max_ms": round(float(values.max()), 3)
+    }
+
+def disagreement(records: List[Dict[str, Any]], outcomes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Class-level disagreement of the candidate with the classes production logged."""
+    pairs = [(record, outcome) for record, outcome in zip(records, outcomes)
+             if "error" not in outcome and record.get("spoilage_risk_category") is not None]
+    labels = list(RISK_LABELS)
+    confusion = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    versions: Dict[str, Dict[str, int]] = {}
+    probability_changes = []
+    for record, outcome in pairs:
+        logged, predicted = int(record["spoilage_risk_category"]), outcome["class"]
+        if logged in RISK_LABELS and predicted in RISK_LABELS:
+            confusion[logged, predicted] += 1
+        version = versions.setdefault(str(record.get("model_version")), {"compared": 0, "disagreed": 0})
+        version["compared"] += 1
+        version["disagreed"] += int(logged != predicted)
+        if record.get("probabilities"):
+            logged_proba = [float(record["probabilities"].get(key, 0.0)) for key in PROBABILITY_KEYS]
+            probability_changes.append(np.abs(np.subtract(outcome["probabilities"], logged_proba)).max())
+
+    compared = int(confusion.sum())
+    by_class = {}
+    for label in labels:
+        total = int(confusion[label].sum())
+        by_class[RISK_LABELS[label]] = {
+            "logged": total,
+            "disagreed": total - int(confusion[label, label]),
+            "rate": round(1 - confusion[label, label] / total, 4) if total else None
+        }
+    for version in versions.values():
+        version["rate"] = round(version["disagreed"] / version["compared"], 4)
+    return {
+        "compared": compared,
+        "disagreement_rate": round(1 - np.trace(confusion) / compared, 4) if compared else None,
+        "by_logged_class": by_class,
+        "by_model_version": versions,
+        # Rows: class production returned; columns: class the candidate returned
+        "confusion_matrix": {
+            "labels": [RISK_LABELS[label] for label in labels],
+            "counts": confusion.tolist()
+        },
+        "high_risk_downgraded": int(confusion[2, :2].sum()),
+        "mean_max_probability_change": round(float(np.mean(probability_changes)), 4)
+        if probability_changes else None
+    }
+
+def replay_report(records: List[Dict[str, Any]], outcomes: List[Dict[str, Any]], wall_seconds: float,
+                  max_disagreement: float = DEFAULT_MAX_DISAGREEMENT,
+                  max_error_rate: float = DEFAULT_MAX_ERROR_RATE,
+                  max_latency_p99_ms: Optional[float] = None) -> Dict[str, Any]:
+    """Latency, throughput and disagreement of a replay, and whether it passes the promotion gate."""
+    succeeded = [outcome for outcome in outcomes if "error" not in outcome]
+    errors = [outcome["error"] for outcome in outcomes if "error" in outcome]
+    report: Dict[str, Any] = {
+        "requests": len(outcomes),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(outcomes), 4) if outcomes else 0.0,
+        "error_examples": sorted(set(errors))[:5],
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(succeeded) / wall_seconds, 1) if wall_seconds > 0 else None,
+        "window": {"from": records[0]["timestamp"], "to": records[-1]["timestamp"]} if records else None
+    }
+    report.update(_percentiles([outcome["latency_ms"] for outcome in succeeded], "latency"))
+    report.update(_percentiles([outcome["lag_ms"] for outcome in outcomes], "schedule_lag"))
+    report["disagreement"] = disagreement(records, outcomes)
+
+    failures = []
+    if report["error_rate"] > max_error_rate:
+        failures.append(f"error rate {report['error_rate']} > {max_error_rate}")
+    rate = report["disagreement"]["disagreement_rate"]
+    if rate is not None and rate > max_disagreement:
+        failures.append(f"disagreement rate {rate} > {max_disagreement}")
+    if max_latency_p99_ms is not None and (report["latency_p99_ms"] or 0) > max_latency_p99_ms:
+        failures.append(f"p99 latency {report['latency_p99_ms']} ms > {max_latency_p99_ms} ms")
+    report["gate"] = {
+        "max_disagreement": max_disagreement,
+        "max_error_rate": max_error_rate,
+        "max_latency_p99_ms": max_latency_p99_ms,
+        "passed": not failures,
+        "failures": failures
+    }
+    return report
+
+def load_candidate(model_path: Optional[str], suite_dir: Optional[str]):
+    if suite_dir:
+        from model_suite import load_model_suite
+        suite = load_model_suite(suite_dir)
+        if suite is None:
+            raise ValueError(f"No model suite in {suite_dir}")
+        return suite
+    from artifact_compression import load_artifact
+    return load_artifact(model_path)
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Replay logged predictions against a candidate model")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Export a time window of logged predictions")
+    export_parser.add_argument("--since", type=parse_time, required=True, help="ISO timestamp (UTC)")
+    export_parser.add_argument("--until", type=parse_time, default=None, help="ISO timestamp (UTC), exclusive")
+    export_parser.add_argument("--model-version", default=None, help="Only predictions of this model version")
+    export_parser.add_argument("--limit", type=int, default=0)
+    export_parser.add_argument("--output", default="replay.jsonl")
+
+    replay_parser = commands.add_parser("replay", help="Re-score exported predictions with a candidate")
+    replay_parser.add_argument("--input", default="replay.jsonl", help="File written by export")
+    target = replay_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--model", help="Candidate model artifact, scored in-process")
+    target.add_argument("--suite-dir", help="Candidate model suite, scored in-process")
+    target.add_argument("--url", help="Base URL of a running API serving the candidate")
+    replay_parser.add_argument("--token", default=os.getenv("REPLAY_TOKEN"),
+                               help="Bearer token for APIs that require authentication")
+    replay_parser.add_argument("--speed", type=float, default=0.0,
+                               help="0 replays as fast as possible, 1 at the recorded pace, N N times faster")
+    replay_parser.add_argument("--concurrency", type=int, default=1)
+    replay_parser.add_argument("--limit", type=int, default=0)
+    replay_parser.add_argument("--max-disagreement", type=float, default=DEFAULT_MAX_DISAGREEMENT)
+    replay_parser.add_argument("--max-error-rate", type=float, default=DEFAULT_MAX_ERROR_RATE)
+    replay_parser.add_argument("--max-latency-p99-ms", type=float, default=None)
+    replay_parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_predictions(args.output, args.since, args.until, args.model_version, args.limit)
+        return
+
+    records = load_replay(args.input, args.limit)
+    if not records:
+        sys.exit(f"No records in {args.input}")
+    if args.url:
+        score, candidate = http_scorer(args.url, args.token), args.url
+    else:
+        model = load_candidate(args.model, args.suite_dir)
+        score, candidate = in_process_scorer(model), getattr(model, 'version', args.model or args.suite_dir)
+        # One warm-up call so lazy initialisation is not counted as latency
+        score(records[0]["input_data"])
+
+    logger.info(f"Replaying {len(records)} predictions against {candidate}")
+    start = time.perf_counter()
+    outcomes = replay(records, score, speed=args.speed, concurrency=args.concurrency)
+    report = replay_report(records, outcomes, time.perf_counter() - start, args.max_disagreement,
+                           args.max_error_rate, args.max_latency_p99_ms)
+    report["candidate"] = candidate
+    report["settings"] = {"speed": args.speed, "concurrency": args.concurrency, "input": os.path.abspath(args.input)}
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if not report["gate"]["passed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
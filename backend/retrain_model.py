@@ -4,10 +4,7 @@ Retrain the spoilage prediction model with current scikit-learn version
 This script will create a new model compatible with your current environment
 """
 
-import pandas as pd
-import numpy as np
 import joblib
-import os
 from pathlib import Path
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
@@ -21,24 +18,24 @@ warnings.filterwarnings('ignore')
 def load_training_data():
     """Load or create training data for the model."""
     
-    # Check if we have existing training data
-    data_paths = [
-        "../Model/large_enhanced_produce_spoilage_dataset.csv",
-        "../Model/Datasets/datasets_20000.csv",
-        "../Model/Datasets/enhanced_produce_spoilage_dataset.csv",
-        "training_data.csv"
-    ]
-    
-    for path in data_paths:
-        if os.path.exists(path):
-            print(f"Loading training data from: {path}")
-            try:
-                data = pd.read_csv(path)
-                if len(data) > 100:  # Ensure we have enough data
-                    return data
-            except Exception as e:
-                print(f"Failed to load {path}: {e}")
-                continue
+    # Union every available dataset (CSV, .xlsx) with a harmonized, compact schema
+    from dataset_loader import load_datasets
+    try:
+        data, report = load_datasets()
+        for source in report["sources"]:
+            if "error" in source:
+                print(f"Skipped {source['path']}: {source['error']}")
+            else:
+                print(f"Loaded {source['rows']} rows from: {source['path']}"
+                      f"{' (cached)' if source['cached'] else ''}")
+        print(f"Training data: {report['rows']} rows, {report['memory_mb']} MB, "
+              f"loaded in {report['load_seconds']:.2f}s")
+        if len(data) > 100:  # Ensure we have enough data
+            # Most sources have no ethylene readings; GradientBoosting cannot handle NaN
+            data['Ethylene_Level'] = data['Ethylene_Level'].fillna(0.0)
+            return data
+    except Exception as e:
+        print(f"Failed to load training data: {e}")
     
     # If no existing data, create synthetic training data
     print("No existing training data found. Creating synthetic dataset...")
@@ -47,71 +44,8 @@ def load_training_data():
 def create_synthetic_data(n_samples=5000):
     """Create synthetic training data for demonstration."""
     
-    np.random.seed(42)
-    
-    # Commodity categories and names
-    commodities = {
-        'Vegetables': ['Tomato', 'Potato', 'Onion', 'Spinach', 'Cauliflower', 'Cabbage'],
-        'Fruits': ['Mango', 'Banana', 'Apple', 'Orange', 'Grapes', 'Papaya'],
-        'Staple Grains': ['Rice', 'Wheat', 'Maize', 'Bajra'],
-        'Pulses': ['Chickpea', 'Red Lentil', 'Green Gram', 'Black Gram']
-    }
-    
-    storage_types = ['cold_storage', 'room_temperature', 'open_air_storage']
-    packaging_quality = ['poor', 'average', 'good']
-    
-    data = []
-    
-    for _ in range(n_samples):
-        # Random commodity selection
-        category = np.random.choice(list(commodities.keys()))
-        commodity = np.random.choice(commodities[category])
-        
-        # Generate features based on realistic ranges
-        temperature = np.random.normal(25, 8)  # 10-40°C range mostly
-        temperature = np.clip(temperature, 5, 45)
-        
-        humidity = np.random.normal(70, 15)  # 40-95% range mostly
-        humidity = np.clip(humidity, 30, 95)
-        
-        storage_type = np.random.choice(storage_types)
-        days_since_harvest = np.random.randint(1, 21)
-        transport_duration = np.random.exponential(12)  # Most shipments are short
-        transport_duration = np.clip(transport_duration, 1, 72)
-        
-        packaging = np.random.choice(packaging_quality)
-        month_num = np.random.randint(1, 13)
-        
-        # Calculate spoilage risk based on realistic rules
-        risk_score = calculate_synthetic_risk(
-            temperature, humidity, storage_type, days_since_harvest,
-            transport_duration, packaging, category
-        )
-        
-        # Convert to discrete classes
-        if risk_score < 0.3:
-            spoilage_risk = 0  # Low
-        elif risk_score < 0.7:
-            spoilage_risk = 1  # Medium
-        else:
-            spoilage_risk = 2  # High
-        
-        data.append({
-            'Temperature': temperature,
-            'Humidity': humidity,
-            'Storage_Type': storage_type,
-            'Days_Since_Harvest': days_since_harvest,
-            'Transport_Duration': transport_duration,
-            'Packaging_Quality': packaging,
-            'Month_num': month_num,
-            'Commodity_name': commodity,
-            'Commodity_Category': category,
-            'Location': 'Synthetic',
-            'Ethylene_Level': np.random.uniform(0, 10),
-            'Spoilage_Risk': spoilage_risk
-        })
-    
-    df = pd.DataFrame(data)
+    from synthetic_data import generate_synthetic_data
+    df = generate_synthetic_data(n_samples, seed=42)
     
     # Save synthetic data for future use
     df.to_csv('synthetic_training_data.csv', index=False)
@@ -119,46 +53,6 @@ def create_synthetic_data(n_samples=5000):
     
     return df
 
-def calculate_synthetic_risk(temp, humidity, storage, days, transport, packaging, category):
-    """Calculate synthetic spoilage risk based on rules."""
-    
-    # Temperature risk
-    if temp < 10:
-        temp_risk = 0.2
-    elif temp < 25:
-        temp_risk = 0.4
-    else:
-        temp_risk = 0.2 + (temp - 25) * 0.03
-    
-    # Humidity risk  
-    if humidity < 50:
-        humidity_risk = 0.3
-    elif humidity < 80:
-        humidity_risk = 0.2
-    else:
-        humidity_risk = 0.3 + (humidity - 80) * 0.02
-    
-    # Storage type risk
-    storage_risk = {'cold_storage': 0.1, 'room_temperature': 0.4, 'open_air_storage': 0.7}[storage]
-    
-    # Time-based risk
-    time_risk = min(days * 0.05 + transport * 0.01, 0.8)
-    
-    # Packaging risk
-    packaging_risk = {'good': 0.1, 'average': 0.3, 'poor': 0.6}[packaging]
-    
-    # Category risk
-    category_risk = {
-        'Fruits': 0.6, 'Vegetables': 0.5, 'Berries': 0.8,
-        'Staple Grains': 0.2, 'Pulses': 0.2, 'Oilseeds': 0.2
-    }.get(category, 0.4)
-    
-    # Combine risks
-    total_risk = (temp_risk * 0.25 + humidity_risk * 0.15 + storage_risk * 0.2 + 
-                  time_risk * 0.25 + packaging_risk * 0.1 + category_risk * 0.05)
-    
-    return min(total_risk, 1.0)
-
 def engineer_features(df):
     """Simple feature engineering for the model."""
     df_engineered = df.copy()
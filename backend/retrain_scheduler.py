@@ -0,0 +1,238 @@
+"""
+Retrain scheduler for Surplus2Serve.
+
+Decides when an upload should lead to a retraining job instead of retraining on
+every /upload_data call. Input drift detected by drift_monitor.py can queue a
+retrain as well. Triggers arriving within a debounce window are
+coalesced into a single queued job, and a job is only queued once enough new
+rows have accumulated or enough time has passed since the last run. The queue
+itself guarantees that at most one training run executes at a time.
+
+State is kept in the training job database so that every API process and the
+worker share the same view.
+"""
+
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from training_jobs import TrainingJobQueue, JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_SKIPPED
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for further uploads before a queued retrain may start
+RETRAIN_DEBOUNCE_SECONDS = float(os.getenv("RETRAIN_DEBOUNCE_SECONDS", "60"))
+# Upper bound on how long repeated uploads can postpone a queued retrain
+RETRAIN_MAX_DELAY_SECONDS = float(os.getenv("RETRAIN_MAX_DELAY_SECONDS", "600"))
+# Retrain as soon as this many new rows have accumulated...
+RETRAIN_MIN_NEW_ROWS = int(os.getenv("RETRAIN_MIN_NEW_ROWS", "500"))
+# ...or when any new rows are pending and this much time passed since the last run
+RETRAIN_MAX_INTERVAL_SECONDS = float(os.getenv("RETRAIN_MAX_INTERVAL_SECONDS", "3600"))
+# Minimum time since the last run before detected input drift queues another retrain
+RETRAIN_DRIFT_COOLDOWN_SECONDS = float(os.getenv("RETRAIN_DRIFT_COOLDOWN_SECONDS", "21600"))
+
+class RetrainScheduler:
+    """Coalesce upload triggers into debounced, threshold-gated retraining jobs."""
+
+    def __init__(self, queue: TrainingJobQueue,
+                 debounce_seconds: float = RETRAIN_DEBOUNCE_SECONDS,
+                 max_delay_seconds: float = RETRAIN_MAX_DELAY_SECONDS,
+                 min_new_rows: int = RETRAIN_MIN_NEW_ROWS,
+                 max_interval_seconds: float = RETRAIN_MAX_INTERVAL_SECONDS,
+                 drift_cooldown_seconds: float = RETRAIN_DRIFT_COOLDOWN_SECONDS):
+        self.queue = queue
+        self.debounce = timedelta(seconds=debounce_seconds)
+        self.max_delay = timedelta(seconds=max_delay_seconds)
+        self.min_new_rows = min_new_rows
+        self.max_interval = timedelta(seconds=max_interval_seconds)
+        self.drift_cooldown = timedelta(seconds=drift_cooldown_seconds)
+        self._init_state()
+
+    def _init_state(self):
+        with self.queue.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS retrain_scheduler_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    pending_rows INTEGER NOT NULL DEFAULT 0,
+                    pending_uploads INTEGER NOT NULL DEFAULT 0,
+                    first_trigger_at TEXT,
+                    last_trigger_at TEXT,
+                    training_data_path TEXT,
+                    model_path TEXT,
+                    pending_categories TEXT
+                )
+            """)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(retrain_scheduler_state)")}
+            if "pending_categories" not in columns:
+                conn.execute("ALTER TABLE retrain_scheduler_state ADD COLUMN pending_categories TEXT")
+            conn.execute("INSERT OR IGNORE INTO retrain_scheduler_state (id) VALUES (1)")
+
+    def notify_upload(self, rows_added: int, training_data_path: str, model_path: str,
+                      categories: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Record an upload and queue or coalesce a retrain if the thresholds allow.
+        categories are the commodity categories touched by the upload; they decide
+        which specialists of the model suite get retrained.
+        Returns the queued job covering this upload, or None if retraining is deferred.
+        """
+        if rows_added <= 0:
+            return None
+
+        now = datetime.now()
+        with self.queue.transaction() as conn:
+            state = conn.execute("SELECT pending_categories FROM retrain_scheduler_state WHERE id = 1").fetchone()
+            pending_categories = _merge_categories(state["pending_categories"], categories)
+            conn.execute(
+                "UPDATE retrain_scheduler_state SET pending_rows = pending_rows + ?, "
+                "pending_uploads = pending_uploads + 1, "
+                "first_trigger_at = COALESCE(first_trigger_at, ?), last_trigger_at = ?, "
+                "training_data_path = ?, model_path = ?, pending_categories = ? WHERE id = 1",
+                (rows_added, now.isoformat(), now.isoformat(),
+                 os.path.abspath(training_data_path), os.path.abspath(model_path),
+                 json.dumps(pending_categories))
+            )
+            return self._schedule(conn, now)
+
+    def notify_drift(self, training_data_path: str, model_path: str,
+                     drifted_features: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Queue a retrain because live inputs drifted away from the training data.
+        Pending uploads are folded into the job. Nothing is queued while a job is
+        queued or running, or within the drift cooldown after the last run.
+        Returns the queued job, or None.
+        """
+        now = datetime.now()
+        with self.queue.transaction() as conn:
+            busy = conn.execute(
+                "SELECT 1 FROM training_jobs WHERE status IN (?, ?) LIMIT 1", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchone()
+            if busy is not None:
+                return None
+            last_run = self._last_run_at(conn)
+            if last_run and now - datetime.fromisoformat(last_run) < self.drift_cooldown:
+                logger.info("Input drift detected, but the last retrain is within the drift cooldown")
+                return None
+
+            state = conn.execute("SELECT * FROM retrain_scheduler_state WHERE id = 1").fetchone()
+            job = self.queue.enqueue(
+                training_data_path, model_path,
+                params={
+                    "pending_rows": state["pending_rows"],
+                    "coalesced_uploads": state["pending_uploads"],
+                    "categories": json.loads(state["pending_categories"] or "[]"),
+                    "trigger": "drift",
+                    "drifted_features": drifted_features
+                },
+                not_before=now,
+                conn=conn
+            )
+            self._clear_pending(conn)
+        logger.warning(f"Queued training job {job['id']} for input drift in {drifted_features}")
+        return job
+
+    def tick(self) -> Optional[Dict[str, Any]]:
+        """
+        Re-evaluate pending uploads without a new trigger.
+        Called periodically by the training worker so that time-based thresholds
+        fire and rows uploaded during a running job get picked up afterwards.
+        """
+        now = datetime.now()
+        with self.queue.transaction() as conn:
+            return self._schedule(conn, now)
+
+    def status(self) -> Dict[str, Any]:
+        """Return the scheduler thresholds and the currently pending uploads."""
+        with self.queue.transaction() as conn:
+            state = dict(conn.execute("SELECT * FROM retrain_scheduler_state WHERE id = 1").fetchone())
+            state["last_run_at"] = self._last_run_at(conn)
+        state["pending_categories"] = json.loads(state["pending_categories"] or "[]")
+        state.update({
+            "debounce_seconds": self.debounce.total_seconds(),
+            "max_delay_seconds": self.max_delay.total_seconds(),
+            "min_new_rows": self.min_new_rows,
+            "max_interval_seconds": self.max_interval.total_seconds(),
+            "drift_cooldown_seconds": self.drift_cooldown.total_seconds()
+        })
+        return state
+
+    def _last_run_at(self, conn) -> Optional[str]:
+        row = conn.execute(
+            "SELECT MAX(finished_at) AS finished_at FROM training_jobs WHERE status IN (?, ?)",
+            (JOB_COMPLETED, JOB_SKIPPED)
+        ).fetchone()
+        return row["finished_at"] if row else None
+
+    def _schedule(self, conn, now: datetime) -> Optional[Dict[str, Any]]:
+        state = conn.execute("SELECT * FROM retrain_scheduler_state WHERE id = 1").fetchone()
+        if not state["pending_rows"]:
+            return None
+
+        first_trigger = datetime.fromisoformat(state["first_trigger_at"])
+        last_trigger = datetime.fromisoformat(state["last_trigger_at"])
+        not_before = min(last_trigger + self.debounce, first_trigger + self.max_delay)
+
+        # A queued job has not read the data yet, so it will include these rows
+        queued = conn.execute(
+            "SELECT * FROM training_jobs WHERE status = ? ORDER BY created_at LIMIT 1", (JOB_QUEUED,)
+        ).fetchone()
+        if queued is not None:
+            params = json.loads(queued["params"] or "{}")
+            params["pending_rows"] = params.get("pending_rows", 0) + state["pending_rows"]
+            params["coalesced_uploads"] = params.get("coalesced_uploads", 0) + state["pending_uploads"]
+            params["categories"] = _merge_categories(json.dumps(params.get("categories", [])),
+                                                     json.loads(state["pending_categories"] or "[]"))
+            # Uploads may extend the debounce window, but never past the job's maximum delay
+            deadline = datetime.fromisoformat(queued["created_at"]) + self.max_delay
+            not_before = max(min(not_before, deadline), now)
+            conn.execute(
+                "UPDATE training_jobs SET params = ?, not_before = ? WHERE id = ?",
+                (json.dumps(params), not_before.isoformat(), queued["id"])
+            )
+            self._clear_pending(conn)
+            logger.info(f"Coalesced {state['pending_uploads']} upload(s) into training job {queued['id']}")
+            return self.queue.row_to_job(
+                conn.execute("SELECT * FROM training_jobs WHERE id = ?", (queued["id"],)).fetchone()
+            )
+
+        # A running job may already have loaded its data; keep rows pending until it ends
+        running = conn.execute(
+            "SELECT 1 FROM training_jobs WHERE status = ? LIMIT 1", (JOB_RUNNING,)
+        ).fetchone()
+        if running is not None:
+            return None
+
+        last_run = self._last_run_at(conn)
+        since = datetime.fromisoformat(last_run) if last_run else first_trigger
+        enough_rows = state["pending_rows"] >= self.min_new_rows
+        interval_elapsed = now - since >= self.max_interval
+        if not (enough_rows or interval_elapsed):
+            return None
+
+        job = self.queue.enqueue(
+            state["training_data_path"], state["model_path"],
+            params={
+                "pending_rows": state["pending_rows"],
+                "coalesced_uploads": state["pending_uploads"],
+                "categories": json.loads(state["pending_categories"] or "[]"),
+                "trigger": "rows" if enough_rows else "interval"
+            },
+            not_before=max(not_before, now),
+            conn=conn
+        )
+        self._clear_pending(conn)
+        return job
+
+    @staticmethod
+    def _clear_pending(conn):
+        conn.execute(
+            "UPDATE retrain_scheduler_state SET pending_rows = 0, pending_uploads = 0, "
+            "first_trigger_at = NULL, last_trigger_at = NULL, pending_categories = NULL WHERE id = 1"
+        )
+
+def _merge_categories(stored: Optional[str], categories: Optional[List[str]]) -> List[str]:
+    """Union of a JSON-encoded category list and new categories, sorted."""
+    merged = set(json.loads(stored)) if stored else set()
+    merged.update(categories or [])
+    return sorted(merged)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Nearest historical cases for Surplus2Serve predictions.
+
+When a lot is flagged, suppliers want to see similar past lots and how they
+actually turned out. SimilarCasesIndex answers that from KD-trees over the
+standardized prediction inputs: temperature, humidity, days since harvest,
+transport duration, the month (as a point on the unit circle, so December
+is next to January) and the storage / packaging scores. There is one tree
+per commodity with at least MIN_PARTITION_ROWS labelled rows, and one over
+all rows for the remaining commodities.
+
+The same trees report how far a prediction's inputs are from the data the
+model was trained on: the mean distance to its OOD_NEIGHBORS nearest cases,
+compared with the OOD_PERCENTILE of that distance among the training rows.
+
+The index is built from the most recent SIMILAR_CASES_MAX_ROWS rows of the
+training data after every completed training run (see training.train_model),
+saved next to the model and loaded with it by the API. To build one for an
+existing model:
+    python similar_cases.py --data training_data.csv --model ../Model/best_spoilage_model_with_xgboost.pkl
+"""
+
+import os
+import math
+import time
+import json
+import argparse
+import logging
+from typing import Dict, Any, Optional
+
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.neighbors import KDTree
+
+logger = logging.getLogger(__name__)
+
+# Build the similar cases index with every trained model
+SIMILAR_CASES_INDEX = os.getenv("SIMILAR_CASES_INDEX", "true").lower() == "true"
+# Most recent training rows the index covers
+SIMILAR_CASES_MAX_ROWS = int(os.getenv("SIMILAR_CASES_MAX_ROWS", "200000"))
+# Commodities with fewer labelled rows are searched in the tree over all rows
+MIN_PARTITION_ROWS = 20
+# Neighbours averaged for the out-of-distribution distance, the training rows
+# sampled per tree to calibrate it, and the percentile above which inputs count as OOD
+OOD_NEIGHBORS = 5
+OOD_SAMPLE_ROWS = 2000
+OOD_PERCENTILE = 99
+MAX_NEIGHBORS = 50
+ALL_PARTITION = "__all__"
+
+INDEX_COLUMNS = ['Commodity_name', 'Temperature', 'Humidity', 'Days_Since_Harvest', 'Transport_Duration',
+                 'Month_num', 'Storage_Type', 'Packaging_Quality', 'Spoilage_Risk']
+INPUT_COLUMNS = ['Temperature', 'Humidity', 'Days_Since_Harvest', 'Transport_Duration', 'Month_num']
+STORAGE_SCORES = {'cold_storage': 3, 'room_temperature': 2, 'open_air': 1}
+PACKAGING_SCORES = {'good': 3, 'average': 2, 'poor': 1}
+RISK_LABELS = {0: "Low Risk", 1: "Medium Risk", 2: "High Risk"}
+
+def similar_cases_path(model_path: str) -> str:
+    """Where the index of a model is stored."""
+    return f"{os.path.splitext(model_path)[0]}_similar_cases.pkl"
+
+def feature_matrix(data: pd.DataFrame) -> np.ndarray:
+    """Unscaled similarity features of a frame of inputs."""
+    month = data['Month_num'].to_numpy(dtype=np.float64) * (2 * np.pi / 12)
+    return np.column_stack([
+        data['Temperature'].to_numpy(dtype=np.float64),
+        data['Humidity'].to_numpy(dtype=np.float64),
+        data['Days_Since_Harvest'].to_numpy(dtype=np.float64),
+        data['Transport_Duration'].to_numpy(dtype=np.float64),
+        np.sin(month),
+        np.cos(month),
+        data['Storage_Type'].astype(str).map(STORAGE_SCORES).fillna(1).to_numpy(dtype=np.float64),
+        data['Packaging_Quality'].astype(str).map(PACKAGING_SCORES).fillna(1).to_numpy(dtype=np.float64),
+    ])
+
+def feature_vector(row: Dict[str, Any]) -> np.ndarray:
+    """feature_matrix for a single input row, without pandas overhead."""
+    month = float(row['Month_num']) * (2 * math.pi / 12)
+    return np.array([[
+        float(row['Temperature']), float(row['Humidity']), float(row['Days_Since_Harvest']),
+        float(row['Transport_Duration']), math.sin(month), math.cos(month),
+        STORAGE_SCORES.get(str(row['Storage_Type']), 1), PACKAGING_SCORES.get(str(row['Packaging_Quality']), 1)
+    ]])
+
+class _Partition:
+    """A KD-tree over some of the indexed rows, with its calibrated OOD threshold."""
+
+    def __init__(self, X: np.ndarray, rows: np.ndarray, rng: np.random.Generator):
+        self.rows = rows.astype(np.int32)
+        self.tree = KDTree(X)
+        sample = X[rng.choice(len(X), min(len(X), OOD_SAMPLE_ROWS), replace=False)]
+        k = min(OOD_NEIGHBORS + 1, len(X))
+        # Each sampled row finds itself first
+        distances, _ = self.tree.query(sample, k=k)
+        self.ood_threshold = float(np.percentile(distances[:, 1:].mean(axis=1), OOD_PERCENTILE)) if k > 1 else 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self.rows)
+
+class SimilarCasesIndex:
+    """Labelled training rows searchable by input similarity, partitioned by commodity."""
+
+    def __init__(self, data: pd.DataFrame, seed: int = 42):
+        data = data.dropna(subset=INPUT_COLUMNS + ['Spoilage_Risk']).reset_index(drop=True)
+        if data.empty:
+            raise ValueError("No labelled rows to index")
+        X = feature_matrix(data)
+        self.mean = X.mean(axis=0)
+        self.scale = np.where(X.std(axis=0) > 0, X.std(axis=0), 1.0)
+        X = (X - self.mean) / self.scale
+
+        self.commodities = data['Commodity_name'].astype(str).to_numpy(dtype=object)
+        self.inputs = data[INPUT_COLUMNS].to_numpy(dtype=np.float32)
+        self.storage = data['Storage_Type'].astype(str).to_numpy(dtype=object)
+        self.packaging = data['Packaging_Quality'].astype(str).to_numpy(dtype=object)
+        self.labels = data['Spoilage_Risk'].to_numpy(dtype=np.int8)
+        self.built_at = pd.Timestamp.now().isoformat()
+
+        rng = np.random.default_rng(seed)
+        self.partitions: Dict[str, _Partition] = {ALL_PARTITION: _Partition(X, np.arange(len(X)), rng)}
+        names, codes = np.unique(self.commodities, return_inverse=True)
+        for code, name in enumerate(names):
+            rows = np.flatnonzero(codes == code)
+            if len(rows) >= MIN_PARTITION_ROWS:
+                self.partitions[name] = _Partition(X[rows], rows, rng)
+
+    @property
+    def rows(self) -> int:
+        return len(self.labels)
+
+    def _search(self, row: Dict[str, Any], k: int):
+        name = str(row.get('Commodity_name'))
+        scope = "commodity" if name in self.partitions else "all"
+        partition = self.partitions[name if scope == "commodity" else ALL_PARTITION]
+        x = (feature_vector(row) - self.mean) / self.scale
+        distances, positions = partition.tree.query(x, k=min(max(k, OOD_NEIGHBORS), partition.size))
+        return scope, partition, distances[0], partition.rows[positions[0]]
+
+    @staticmethod
+    def _ood(partition: _Partition, distances: np.ndarray, scope: str) -> Dict[str, Any]:
+        distance = float(distances[:OOD_NEIGHBORS].mean())
+        return {
+            "distance": round(distance, 4),
+            "threshold": round(partition.ood_threshold, 4),
+            "is_out_of_distribution": distance > partition.ood_threshold,
+            "reference": scope
+        }
+
+    def ood(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """How far an input row is from the training data of its commodity."""
+        scope, partition, distances, _ = self._search(row, OOD_NEIGHBORS)
+        return self._ood(partition, distances, scope)
+
+    def query(self, row: Dict[str, Any], k: int = 5) -> Dict[str, Any]:
+        """The k most similar labelled rows of the row's commodity, with their outcomes."""
+        scope, partition, distances, rows = self._search(row, k)
+        neighbors = []
+        for distance, i in zip(distances[:k], rows[:k]):
+            label = int(self.labels[i])
+            case = {"distance": round(float(distance), 4), "Commodity_name": self.commodities[i]}
+            case.update(zip(INPUT_COLUMNS, self.inputs[i].tolist()))
+            case.update({
+                "Storage_Type": self.storage[i],
+                "Packaging_Quality": self.packaging[i],
+                "Spoilage_Risk": label,
+                "Risk_Interpretation": RISK_LABELS.get(label, "Unknown")
+            })
+            neighbors.append(case)
+        outcomes = np.bincount(self.labels[rows[:k]], minlength=len(RISK_LABELS))
+        return {
+            "scope": scope,
+            "neighbors": neighbors,
+            "outcomes": {RISK_LABELS[label]: int(count) for label, count in enumerate(outcomes[:len(RISK_LABELS)])},
+            "out_of_distribution": self._ood(partition, distances, scope)
+        }
+
+def build_similar_cases(training_data_path: str, model_path: str,
+                        max_rows: int = SIMILAR_CASES_MAX_ROWS) -> Dict[str, Any]:
+    """Index the most recent training rows and save the index next to the model."""
+    from training_store import open_training_data
+
+    start = time.perf_counter()
+    training_data = open_training_data(training_data_path)
+    data = training_data.read(columns=INDEX_COLUMNS, start_row=max(training_data.row_count() - max_rows, 0))
+    index = SimilarCasesIndex(data)
+
+    path = similar_cases_path(model_path)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    joblib.dump(index, tmp_path)
+    os.replace(tmp_path, path)
+    logger.info(f"Indexed {index.rows} training rows in {len(index.partitions) - 1} commodity partitions")
+    return {"rows": index.rows, "partitions": len(index.partitions) - 1,
+            "seconds": round(time.perf_counter() - start, 4)}
+
+def load_similar_cases(model_path: str) -> Optional[SimilarCasesIndex]:
+    """The index saved with a model, or None if there is none."""
+    path = similar_cases_path(model_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        return joblib.load(path)
+    except Exception as e:
+        logger.error(f"Failed to load similar cases index: {str(e)}")
+        return None
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the similar cases index of a model")
+    parser.add_argument("--data", default="training_data.csv", help="Training data CSV")
+    parser.add_argument("--model", default="../Model/best_spoilage_model_with_xgboost.pkl",
+                        help="Model the index is stored next to")
+    parser.add_argument("--max-rows", type=int, default=SIMILAR_CASES_MAX_ROWS)
+    args = parser.parse_args()
+
+    # Build through the module so the pickled index does not refer to __main__
+    import similar_cases
+    print(json.dumps(similar_cases.build_similar_cases(args.data, args.model, args.max_rows), indent=2))
+
+if __name__ == "__main__":
+    main()
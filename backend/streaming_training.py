@@ -0,0 +1,255 @@
+"""
+Out-of-core training for Surplus2Serve.
+
+Trains on datasets larger than memory by reading the training data in chunks
+and engineering features chunk by chunk, so peak memory depends on the chunk
+size rather than the dataset size. Three passes are made over the data:
+
+1. fit the scaler incrementally and collect categorical levels and classes,
+2. fit the classifier: XGBoost from an external-memory DMatrix (pages cached
+   on disk) or, with model_family='sgd', an SGD classifier via partial_fit,
+3. evaluate on the deterministic holdout rows.
+
+The result is a regular preprocessing + classifier Pipeline, so the API loads
+and serves it like any other model.
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+from typing import Dict, Any, Callable, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import confusion_matrix
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler, OneHotEncoder
+
+from utils import engineer_features
+from training import holdout_mask_positions, CATEGORICAL_FEATURES, NUMERICAL_FEATURES
+from training_store import open_training_data
+
+logger = logging.getLogger(__name__)
+
+# Rows read and engineered at a time
+STREAMING_CHUNK_ROWS = int(os.getenv("TRAINING_STREAMING_CHUNK_ROWS", "50000"))
+# Full rebuilds switch to streaming when the stored training data is larger than this (MB)
+STREAMING_THRESHOLD_MB = float(os.getenv("TRAINING_STREAMING_THRESHOLD_MB", "1024"))
+# Model family used for streaming training: 'xgboost' (external memory) or 'sgd'
+STREAMING_MODEL_FAMILY = os.getenv("TRAINING_STREAMING_FAMILY", "xgboost")
+STREAMING_BOOST_ROUNDS = 300
+SGD_EPOCHS = 5
+
+def should_stream(training_data_path: str) -> bool:
+    """True if the training data is too large to load for a full rebuild."""
+    return open_training_data(training_data_path).size_bytes() > STREAMING_THRESHOLD_MB * 1024 * 1024
+
+def iter_engineered_chunks(training_data_path: str,
+                           chunk_rows: int = STREAMING_CHUNK_ROWS) -> Iterator[Tuple[np.ndarray, pd.DataFrame, pd.Series]]:
+    """Yield (row positions, engineered features, labels) for each chunk of the training data."""
+    for positions, chunk in open_training_data(training_data_path).iter_chunks(chunk_rows):
+        y = chunk.pop('Spoilage_Risk')
+        yield positions, engineer_features(chunk, copy=False), y
+
+def fit_streaming_preprocessor(training_data_path: str, chunk_rows: int = STREAMING_CHUNK_ROWS):
+    """
+    Fit the standard preprocessor (scaled numeric and one-hot categorical
+    features, whatever MODEL_FAMILY is) in one pass over the data.
+    Returns (fitted preprocessor, sorted class labels, number of rows).
+    """
+    scaler = StandardScaler()
+    levels: Dict[str, set] = {}
+    classes: set = set()
+    first_chunk = None
+    n_rows = 0
+
+    for _, X, y in iter_engineered_chunks(training_data_path, chunk_rows):
+        if first_chunk is None:
+            first_chunk = X.head(1000).copy()
+            categorical = [col for col in CATEGORICAL_FEATURES if col in X.columns]
+            numerical = [col for col in NUMERICAL_FEATURES if col in X.columns]
+            levels = {col: set() for col in categorical}
+        scaler.partial_fit(X[numerical])
+        for col in categorical:
+            levels[col].update(X[col].dropna().unique().tolist())
+        classes.update(y.unique().tolist())
+        n_rows += len(y)
+
+    if first_chunk is None:
+        raise ValueError(f"No rows in {training_data_path}")
+
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', StandardScaler(), numerical),
+            ('cat', OneHotEncoder(categories=[sorted(levels[col], key=str) for col in categorical],
+                                  handle_unknown='ignore', sparse_output=False), categorical)
+        ]
+    )
+    preprocessor.fit(first_chunk)
+    # Swap in the scaler fitted on the whole dataset for the one fitted on the first chunk
+    preprocessor.transformers_ = [(name, scaler if name == 'num' else transformer, columns)
+                                  for name, transformer, columns in preprocessor.transformers_]
+
+    return preprocessor, np.array(sorted(classes)), n_rows
+
+class StreamingBoosterClassifier(ClassifierMixin, BaseEstimator):
+    """
+    Sklearn-style wrapper around an XGBoost booster trained from external memory.
+    train_streaming passes in the booster and classes; fit trains a new booster
+    the same way from data already in memory.
+    """
+
+    def __init__(self, booster=None, classes=None):
+        self.booster = booster
+        self.classes = classes
+
+    def fit(self, X, y):
+        classes, labels = np.unique(np.asarray(y), return_inverse=True)
+        features = np.asarray(X, dtype=np.float32)
+        self.booster = _train_booster(lambda: iter([(features, labels)]), len(classes))
+        self.classes = classes.tolist()
+        return self
+
+    def __sklearn_is_fitted__(self):
+        return self.booster is not None
+
+    @property
+    def classes_(self):
+        return np.asarray(self.classes)
+
+    @property
+    def booster_(self):
+        return self.booster
+
+    def predict_proba(self, X):
+        return self.booster.inplace_predict(np.asarray(X, dtype=np.float32))
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def _train_rows(positions: np.ndarray, holdout: bool) -> np.ndarray:
+    mask = holdout_mask_positions(positions)
+    return mask if holdout else ~mask
+
+def _train_booster(make_chunks: Callable[[], Iterator[Tuple[np.ndarray, np.ndarray]]], n_classes: int,
+                   n_jobs: int = -1, classifier_params: Optional[Dict[str, Any]] = None):
+    """
+    Train a booster on the (features, encoded labels) chunks yielded by
+    make_chunks(), which is called again for every pass XGBoost makes.
+    """
+    import xgboost as xgb
+
+    cache_dir = tempfile.mkdtemp(prefix="s2s_xgb_cache_")
+
+    class ChunkIterator(xgb.DataIter):
+        """Feed training chunks to XGBoost, which pages them to disk."""
+
+        def __init__(self):
+            self._chunks = None
+            super().__init__(cache_prefix=os.path.join(cache_dir, "cache"))
+
+        def next(self, input_data) -> bool:
+            if self._chunks is None:
+                self._chunks = make_chunks()
+            for X, labels in self._chunks:
+                input_data(data=X, label=labels)
+                return True
+            return False
+
+        def reset(self):
+            self._chunks = None
+
+    params = {'max_depth': 6, 'learning_rate': 0.1}
+    params.update(classifier_params or {})
+    rounds = params.pop('n_estimators', STREAMING_BOOST_ROUNDS)
+    params.update({
+        'objective': 'multi:softprob',
+        'num_class': n_classes,
+        'tree_method': 'hist',
+        'nthread': n_jobs if n_jobs > 0 else os.cpu_count(),
+    })
+
+    try:
+        dtrain = xgb.DMatrix(ChunkIterator())
+        return xgb.train(params, dtrain, num_boost_round=rounds)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+def _fit_xgboost(training_data_path: str, preprocessor, classes: np.ndarray,
+                 chunk_rows: int, n_jobs: int, classifier_params: Optional[Dict[str, Any]]):
+    def training_chunks():
+        for positions, X, y in iter_engineered_chunks(training_data_path, chunk_rows):
+            rows = _train_rows(positions, holdout=False)
+            if rows.any():
+                yield (preprocessor.transform(X[rows]).astype(np.float32),
+                       np.searchsorted(classes, y[rows].to_numpy()))
+
+    booster = _train_booster(training_chunks, len(classes), n_jobs, classifier_params)
+    return StreamingBoosterClassifier(booster=booster, classes=classes.tolist())
+
+def _fit_sgd(training_data_path: str, preprocessor, classes: np.ndarray,
+             chunk_rows: int, classifier_params: Optional[Dict[str, Any]]):
+    params = {'loss': 'log_loss', 'alpha': 1e-4}
+    params.update(classifier_params or {})
+    classifier = SGDClassifier(random_state=42, **params)
+    for epoch in range(SGD_EPOCHS):
+        for positions, X, y in iter_engineered_chunks(training_data_path, chunk_rows):
+            rows = _train_rows(positions, holdout=False)
+            if rows.any():
+                classifier.partial_fit(preprocessor.transform(X[rows]), y[rows], classes=classes)
+    return classifier
+
+def train_streaming(training_data_path: str,
+                    model_family: str = STREAMING_MODEL_FAMILY,
+                    chunk_rows: int = STREAMING_CHUNK_ROWS,
+                    n_jobs: int = -1,
+                    classifier_params: Optional[Dict[str, Any]] = None,
+                    tracker=None) -> Dict[str, Any]:
+    """
+    Train a model without loading the dataset into memory.
+    Returns the fitted pipeline together with row counts, holdout accuracy and
+    the holdout confusion matrix.
+    """
+    def stage(name: str):
+        if tracker is not None:
+            tracker.finish()
+            tracker.start(name)
+
+    stage('load')
+    preprocessor, classes, n_rows = fit_streaming_preprocessor(training_data_path, chunk_rows)
+    logger.info(f"Streaming over {n_rows} rows in chunks of {chunk_rows}")
+
+    stage('fit')
+    if model_family == 'xgboost':
+        classifier = _fit_xgboost(training_data_path, preprocessor, classes, chunk_rows, n_jobs,
+                                  classifier_params)
+    elif model_family == 'sgd':
+        classifier = _fit_sgd(training_data_path, preprocessor, classes, chunk_rows, classifier_params)
+    else:
+        raise ValueError(f"Model family {model_family} does not support streaming training")
+    pipeline = Pipeline([('preprocessor', preprocessor), ('classifier', classifier)])
+
+    stage('evaluate')
+    labels = list(classes)
+    confusion = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    for positions, X, y in iter_engineered_chunks(training_data_path, chunk_rows):
+        rows = _train_rows(positions, holdout=True)
+        if rows.any():
+            confusion += confusion_matrix(y[rows].to_numpy(), pipeline.predict(X[rows]), labels=labels)
+    test_rows = int(confusion.sum())
+    if tracker is not None:
+        tracker.finish()
+
+    return {
+        "model": pipeline,
+        "rows": n_rows,
+        "train_rows": n_rows - test_rows,
+        "test_rows": test_rows,
+        "accuracy": float(np.trace(confusion)) / test_rows if test_rows else None,
+        "confusion": confusion,
+        "classes": labels
+    }
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Synthetic spoilage data generator for Surplus2Serve.
+
+Produces the same distribution as the original row-by-row generator in
+retrain_model.py, but fully vectorized and in chunks, so multi-million row
+datasets can be streamed to CSV or Parquet for benchmarking ingestion,
+retraining and batch scoring. Output is deterministic for a given seed and
+chunk size.
+
+Drift scenarios shift the distribution gradually from the first to the last
+row of the dataset, e.g. to test drift monitoring or retraining on changing data.
+
+Usage:
+    python synthetic_data.py --rows 10000000 --output synthetic_10m.csv --drift warming
+    python synthetic_data.py --rows 100000 --mix "Fruits=3,Vegetables=1" --output mix.parquet
+"""
+
+import os
+import time
+import argparse
+import logging
+from typing import Dict, Any, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMMODITIES = {
+    'Vegetables': ['Tomato', 'Potato', 'Onion', 'Spinach', 'Cauliflower', 'Cabbage'],
+    'Fruits': ['Mango', 'Banana', 'Apple', 'Orange', 'Grapes', 'Papaya'],
+    'Staple Grains': ['Rice', 'Wheat', 'Maize', 'Bajra'],
+    'Pulses': ['Chickpea', 'Red Lentil', 'Green Gram', 'Black Gram']
+}
+
+STORAGE_TYPES = ['cold_storage', 'room_temperature', 'open_air']
+PACKAGING_QUALITY = ['poor', 'average', 'good']
+
+STORAGE_RISK = {'cold_storage': 0.1, 'room_temperature': 0.4, 'open_air': 0.7}
+PACKAGING_RISK = {'good': 0.1, 'average': 0.3, 'poor': 0.6}
+CATEGORY_RISK = {
+    'Fruits': 0.6, 'Vegetables': 0.5, 'Berries': 0.8,
+    'Staple Grains': 0.2, 'Pulses': 0.2, 'Oilseeds': 0.2
+}
+DEFAULT_CATEGORY_RISK = 0.4
+
+# Class boundaries on the combined risk score: low < 0.3 <= medium < 0.7 <= high
+RISK_THRESHOLDS = (0.3, 0.7)
+
+# Each scenario maps drift progress (0 at the first row, 1 at the last) to changes
+DRIFT_SCENARIOS = {
+    'none': {},
+    # Mean temperature rises by 6 degrees over the dataset
+    'warming': {'temperature_shift': 6.0},
+    # Humidity rises by 12 points, as in an unusually wet season
+    'monsoon': {'humidity_shift': 12.0},
+    # Cold storage share drops from a third to 5%
+    'cold_chain_failure': {'cold_storage_share': 0.05},
+    # Same features, but the risk boundaries move down (more rows labelled riskier)
+    'label_shift': {'threshold_shift': -0.1},
+}
+
+def synthetic_risk(temperature: np.ndarray, humidity: np.ndarray, storage_risk: np.ndarray,
+                   days: np.ndarray, transport: np.ndarray, packaging_risk: np.ndarray,
+                   category_risk: np.ndarray) -> np.ndarray:
+    """Vectorized rule-based risk score in [0, 1]."""
+    temp_risk = np.where(temperature < 10, 0.2,
+                         np.where(temperature < 25, 0.4, 0.2 + (temperature - 25) * 0.03))
+    humidity_risk = np.where(humidity < 50, 0.3,
+                             np.where(humidity < 80, 0.2, 0.3 + (humidity - 80) * 0.02))
+    time_risk = np.minimum(days * 0.05 + transport * 0.01, 0.8)
+
+    total_risk = (temp_risk * 0.25 + humidity_risk * 0.15 + storage_risk * 0.2 +
+                  time_risk * 0.25 + packaging_risk * 0.1 + category_risk * 0.05)
+    return np.minimum(total_risk, 1.0)
+
+def parse_commodity_mix(mix: Optional[str]) -> Dict[str, float]:
+    """
+    Parse 'Fruits=3,Vegetables=1' into category weights.
+    'all' uses every category known to the API with equal weight.
+    """
+    if not mix:
+        return {category: 1.0 for category in DEFAULT_COMMODITIES}
+    if mix == 'all':
+        from utils import enhanced_commodities
+        return {category: 1.0 for category in enhanced_commodities}
+    weights = {}
+    for part in mix.split(','):
+        category, _, weight = part.partition('=')
+        weights[category.strip()] = float(weight or 1)
+    return weights
+
+def _commodity_table(commodity_mix: Dict[str, float]):
+    catalog = dict(DEFAULT_COMMODITIES)
+    if any(category not in catalog for category in commodity_mix):
+        from utils import enhanced_commodities
+        catalog.update(enhanced_commodities)
+
+    categories = [category for category in commodity_mix if category in catalog]
+    unknown = set(commodity_mix) - set(categories)
+    if unknown:
+        raise ValueError(f"Unknown commodity categories: {sorted(unknown)}")
+    weights = np.array([commodity_mix[category] for category in categories], dtype=float)
+    names = [name for category in categories for name in catalog[category]]
+    sizes = np.array([len(catalog[category]) for category in categories])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return categories, weights / weights.sum(), np.array(names, dtype=object), sizes, offsets
+
+def generate_chunks(n_rows: int, chunk_rows: int = 500_000, seed: int = 42,
+                    commodity_mix: Optional[Dict[str, float]] = None,
+                    drift: str = 'none') -> Iterator[pd.DataFrame]:
+    """Yield the synthetic dataset as DataFrames of at most chunk_rows rows."""
+    if drift not in DRIFT_SCENARIOS:
+        raise ValueError(f"Unknown drift scenario: {drift}")
+    scenario = DRIFT_SCENARIOS[drift]
+    categories, category_p, names, sizes, offsets = _commodity_table(
+        commodity_mix or parse_commodity_mix(None))
+    category_array = np.array(categories, dtype=object)
+    category_risk = np.array([CATEGORY_RISK.get(c, DEFAULT_CATEGORY_RISK) for c in categories])
+    storage_risk = np.array([STORAGE_RISK[s] for s in STORAGE_TYPES])
+    packaging_risk = np.array([PACKAGING_RISK[p] for p in PACKAGING_QUALITY])
+
+    for chunk_index, start in enumerate(range(0, n_rows, chunk_rows)):
+        n = min(chunk_rows, n_rows - start)
+        rng = np.random.default_rng([seed, chunk_index])
+        progress = (start + np.arange(n)) / max(n_rows - 1, 1)
+
+        category = rng.choice(len(categories), size=n, p=category_p)
+        commodity = offsets[category] + (rng.random(n) * sizes[category]).astype(np.int64)
+
+        temperature = np.clip(rng.normal(25, 8, n) + scenario.get('temperature_shift', 0) * progress, 5, 45)
+        humidity = np.clip(rng.normal(70, 15, n) + scenario.get('humidity_shift', 0) * progress, 30, 95)
+
+        if 'cold_storage_share' in scenario:
+            cold_share = 1 / 3 + (scenario['cold_storage_share'] - 1 / 3) * progress
+            other = rng.integers(1, len(STORAGE_TYPES), n)
+            storage = np.where(rng.random(n) < cold_share, 0, other)
+        else:
+            storage = rng.integers(0, len(STORAGE_TYPES), n)
+
+        days = rng.integers(1, 21, n)
+        transport = np.clip(rng.exponential(12, n), 1, 72)
+        packaging = rng.integers(0, len(PACKAGING_QUALITY), n)
+        month = rng.integers(1, 13, n)
+        ethylene = rng.uniform(0, 10, n)
+
+        risk = synthetic_risk(temperature, humidity, storage_risk[storage], days, transport,
+                              packaging_risk[packaging], category_risk[category])
+        shift = scenario.get('threshold_shift', 0) * progress
+        spoilage_risk = ((risk >= RISK_THRESHOLDS[0] + shift).astype(np.int8) +
+                         (risk >= RISK_THRESHOLDS[1] + shift).astype(np.int8))
+
+        yield pd.DataFrame({
+            'Temperature': temperature.round(1).astype(np.float32),
+            'Humidity': humidity.round(1).astype(np.float32),
+            'Storage_Type': pd.Categorical.from_codes(storage, STORAGE_TYPES),
+            'Days_Since_Harvest': days.astype(np.int8),
+            'Transport_Duration': transport.round(1).astype(np.float32),
+            'Packaging_Quality': pd.Categorical.from_codes(packaging, PACKAGING_QUALITY),
+            'Month_num': month.astype(np.int8),
+            'Commodity_name': names[commodity],
+            'Commodity_Category': category_array[category],
+            'Location': 'Synthetic',
+            'Ethylene_Level': ethylene.round(2).astype(np.float32),
+            'Spoilage_Risk': spoilage_risk
+        })
+
+def generate_synthetic_data(n_rows: int, seed: int = 42,
+                            commodity_mix: Optional[Dict[str, float]] = None,
+                            drift: str = 'none') -> pd.DataFrame:
+    """Generate a synthetic dataset in memory."""
+    return pd.concat(list(generate_chunks(n_rows, seed=seed, commodity_mix=commodity_mix, drift=drift)),
+                     ignore_index=True)
+
+def write_synthetic_dataset(output_path: str, n_rows: int, chunk_rows: int = 500_000,
+                            seed: int = 42, commodity_mix: Optional[Dict[str, float]] = None,
+                            drift: str = 'none') -> Dict[str, Any]:
+    """
+    Stream a synthetic dataset to CSV or Parquet (chosen by file extension)
+    without holding more than one chunk in memory.
+    """
+    start = time.perf_counter()
+    parquet = output_path.endswith('.parquet')
+    writer = None
+    tmp_path = f"{output_path}.tmp-{os.getpid()}"
+
+    try:
+        for chunk_index, chunk in enumerate(generate_chunks(n_rows, chunk_rows, seed, commodity_mix, drift)):
+            if parquet:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(chunk.astype({'Storage_Type': str, 'Packaging_Quality': str}),
+                                             preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table)
+            else:
+                chunk.to_csv(tmp_path, mode='w' if chunk_index == 0 else 'a',
+                             header=chunk_index == 0, index=False)
+        if writer is not None:
+            writer.close()
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "output_path": output_path,
+        "rows": n_rows,
+        "seed": seed,
+        "drift": drift,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(n_rows / elapsed, 1) if elapsed else None,
+        "size_mb": round(os.path.getsize(output_path) / 1024 / 1024, 2)
+    }
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Generate synthetic spoilage data")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--output", default="synthetic_training_data.csv",
+                        help="Output file (.csv or .parquet)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-rows", type=int, default=500_000)
+    parser.add_argument("--mix", default=None,
+                        help="Category weights, e.g. 'Fruits=3,Vegetables=1', or 'all'")
+    parser.add_argument("--drift", default="none", choices=sorted(DRIFT_SCENARIOS))
+    args = parser.parse_args()
+
+    result = write_synthetic_dataset(args.output, args.rows, args.chunk_rows, args.seed,
+                                     parse_commodity_mix(args.mix), args.drift)
+    print(f"Wrote {result['rows']} rows to {result['output_path']} ({result['size_mb']} MB) in "
+          f"{result['seconds']:.1f}s ({result['rows_per_second']:.0f} rows/s)")
+
+if __name__ == "__main__":
+    main()
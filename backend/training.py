@@ -0,0 +1,819 @@
+"""
+Model training pipeline for the Surplus2Serve spoilage prediction API.
+Runs retraining as a sequence of timed stages so that callers (the background
+worker, CLI scripts) can report progress, stage timings and peak memory.
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional, Callable
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, confusion_matrix
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
+from sklearn.preprocessing import StandardScaler, OneHotEncoder, OrdinalEncoder, FunctionTransformer
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+
+from utils import engineer_features
+from model_registry import ModelRegistry, MODEL_REGISTRY_PATH, new_model_version
+from training_set import TrainingReservoir
+from training_store import open_training_data
+from training_history import TrainingHistory, TRAINING_HISTORY_PATH, per_class_metrics
+from artifact_compression import (MODEL_COMPACTION, FOREST_CLASSES, compact_pipeline,
+                                  dump_artifact, load_artifact)
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of rows required before a retrain is attempted
+MIN_TRAINING_ROWS = 100
+
+# Model family used for full rebuilds: 'random_forest', 'hist_gradient_boosting' or 'xgboost'
+DEFAULT_MODEL_FAMILY = os.getenv("MODEL_FAMILY", "random_forest")
+
+# Wall-clock budget for the optional hyperparameter search before a full rebuild (0 = off)
+TUNE_BUDGET_SECONDS = float(os.getenv("TRAINING_TUNE_BUDGET_SECONDS", "0"))
+
+# Default training mode: 'full', 'incremental' or 'auto'
+TRAINING_MODE = os.getenv("TRAINING_MODE", "auto")
+# In 'auto' mode, rebuild from scratch after this many incremental updates
+INCREMENTAL_FULL_REBUILD_EVERY = int(os.getenv("INCREMENTAL_FULL_REBUILD_EVERY", "5"))
+# Fewer new rows than this are not worth an incremental update
+INCREMENTAL_MIN_NEW_ROWS = int(os.getenv("INCREMENTAL_MIN_NEW_ROWS", "50"))
+# Percentage of rows held out for evaluation
+HOLDOUT_PERCENT = 20
+# Trees / boosting rounds added per update scale with the share of new data
+INCREMENTAL_BASE_ESTIMATORS = 150
+INCREMENTAL_MIN_ESTIMATORS = 10
+
+CATEGORICAL_FEATURES = [
+    'Storage_Type', 'Packaging_Quality', 'Commodity_name', 'Commodity_Category',
+    'Temp_Category', 'Humidity_Category', 'Harvest_Freshness', 'Transport_Category', 'Season'
+]
+
+NUMERICAL_FEATURES = [
+    'Temperature', 'Humidity', 'Days_Since_Harvest', 'Transport_Duration', 'Month_num',
+    'Temp_Squared', 'Heat_Index', 'VPD', 'Storage_Quality_Score', 'Total_Exposure_Time',
+    'Commodity_Perishability', 'Degradation_Rate', 'Environmental_Stress',
+    'Temp_Humidity_Interaction', 'Days_Transport_Interaction',
+    'Temp_Extreme', 'Humidity_Extreme', 'Is_Monsoon', 'Is_Winter', 'Is_Summer',
+    'Is_Highly_Perishable', 'Temp_Humidity_Risk', 'Poor_Conditions', 'High_Exposure_Risk'
+]
+
+# Stages reported to progress callbacks, with the overall progress reached
+# once each stage has finished.
+TRAINING_STAGES = {
+    'load': 0.15,
+    'feature_engineering': 0.30,
+    'tune': 0.55,
+    'prune': 0.65,
+    'fit': 0.80,
+    'distill': 0.85,
+    'compact': 0.87,
+    'evaluate': 0.90,
+    'serialize': 1.0,
+}
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+def get_peak_memory_mb() -> Optional[float]:
+    """Return the peak resident memory of the current process in MB, if available."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+        if sys.platform == 'darwin':
+            return peak / (1024 * 1024)
+        return peak / 1024
+    except ImportError:
+        pass
+
+    try:
+        import psutil  # type: ignore
+        memory_info = psutil.Process().memory_info()
+        return getattr(memory_info, 'peak_wset', memory_info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+class StageTracker:
+    """Record wall-clock timings for training stages and forward progress updates."""
+
+    def __init__(self, progress_callback: Optional[ProgressCallback] = None):
+        self.progress_callback = progress_callback
+        self.stage_timings: Dict[str, float] = {}
+        self.progress = 0.0
+        self._stage = None
+        self._stage_started = None
+
+    def start(self, stage: str):
+        self._stage = stage
+        self._stage_started = time.perf_counter()
+        self._report()
+
+    def finish(self):
+        if self._stage is None:
+            return
+        elapsed = time.perf_counter() - self._stage_started
+        self.stage_timings[self._stage] = round(elapsed, 4)
+        self.progress = TRAINING_STAGES.get(self._stage, self.progress)
+        self._report()
+        self._stage = None
+
+    def _report(self):
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback({
+                'stage': self._stage,
+                'progress': self.progress,
+                'stage_timings': dict(self.stage_timings),
+                'peak_memory_mb': get_peak_memory_mb()
+            })
+        except Exception as e:
+            logger.warning(f"Progress callback failed: {str(e)}")
+
+MODEL_FAMILY_BY_CLASS = {
+    'RandomForestClassifier': 'random_forest',
+    'CompactForestClassifier': 'random_forest',
+    'HistGradientBoostingClassifier': 'hist_gradient_boosting',
+    'XGBEarlyStoppingClassifier': 'xgboost',
+    'StreamingBoosterClassifier': 'xgboost_external_memory',
+    'SGDClassifier': 'sgd',
+}
+
+# Families that consume ordinal-encoded categoricals natively instead of one-hot columns
+NATIVE_CATEGORICAL_FAMILIES = {'hist_gradient_boosting_native'}
+
+def model_family_of(classifier) -> str:
+    """Model family name of a fitted or unfitted classifier."""
+    if isinstance(classifier, HistGradientBoostingClassifier) and classifier.categorical_features is not None:
+        return 'hist_gradient_boosting_native'
+    return MODEL_FAMILY_BY_CLASS.get(type(classifier).__name__, type(classifier).__name__)
+
+def make_classifier(model_family: str = DEFAULT_MODEL_FAMILY,
+                    classifier_params: Optional[Dict[str, Any]] = None,
+                    n_jobs: int = -1):
+    """Create an unfitted classifier of the given model family."""
+    params = dict(classifier_params or {})
+
+    if model_family == 'random_forest':
+        defaults = {'n_estimators': 150, 'max_depth': 15, 'min_samples_split': 5}
+        defaults.update(params)
+        return RandomForestClassifier(random_state=42, n_jobs=n_jobs, **defaults)
+
+    if model_family in ('hist_gradient_boosting', 'hist_gradient_boosting_native'):
+        defaults = {'max_iter': 300, 'learning_rate': 0.1, 'early_stopping': True,
+                    'validation_fraction': 0.1, 'n_iter_no_change': 10}
+        defaults.update(params)
+        return HistGradientBoostingClassifier(random_state=42, **defaults)
+
+    if model_family == 'xgboost':
+        defaults = {'n_estimators': 400, 'learning_rate': 0.1, 'max_depth': 6}
+        defaults.update(params)
+        return XGBEarlyStoppingClassifier(n_jobs=n_jobs, random_state=42, **defaults)
+
+    raise ValueError(f"Unknown model family: {model_family}")
+
+class XGBEarlyStoppingClassifier(ClassifierMixin, BaseEstimator):
+    """
+    XGBoost classifier that holds out part of its training data for early stopping,
+    like HistGradientBoostingClassifier does, so it can be used inside pipelines
+    and cross-validation without passing an eval_set.
+    """
+
+    def __init__(self, n_estimators=400, learning_rate=0.1, max_depth=6, subsample=1.0,
+                 colsample_bytree=1.0, min_child_weight=1.0, reg_lambda=1.0,
+                 validation_fraction=0.1, early_stopping_rounds=20, n_jobs=-1, random_state=42):
+        self.n_estimators = n_estimators
+        self.learning_rate = learning_rate
+        self.max_depth = max_depth
+        self.subsample = subsample
+        self.colsample_bytree = colsample_bytree
+        self.min_child_weight = min_child_weight
+        self.reg_lambda = reg_lambda
+        self.validation_fraction = validation_fraction
+        self.early_stopping_rounds = early_stopping_rounds
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        from xgboost import XGBClassifier  # optional dependency
+        from sklearn.model_selection import train_test_split
+
+        # XGBoost expects labels 0..n-1, which a subset of the classes (e.g. a
+        # suite specialist that never sees class 0) does not satisfy
+        self.classes_, y_encoded = np.unique(y, return_inverse=True)
+        X_fit, X_val, y_fit, y_val = train_test_split(
+            X, y_encoded, test_size=self.validation_fraction, random_state=self.random_state,
+            stratify=y_encoded
+        )
+        self.model_ = XGBClassifier(
+            n_estimators=self.n_estimators, learning_rate=self.learning_rate,
+            max_depth=self.max_depth, subsample=self.subsample,
+            colsample_bytree=self.colsample_bytree, min_child_weight=self.min_child_weight,
+            reg_lambda=self.reg_lambda, tree_method='hist',
+            eval_metric='mlogloss' if len(self.classes_) > 2 else 'logloss',
+            early_stopping_rounds=self.early_stopping_rounds,
+            n_jobs=self.n_jobs, random_state=self.random_state
+        )
+        self.model_.fit(X_fit, y_fit, eval_set=[(X_val, y_val)], verbose=False)
+        return self
+
+    def predict(self, X):
+        return self.classes_[self.model_.predict(X)]
+
+    def predict_proba(self, X):
+        return self.model_.predict_proba(X)
+
+def build_model_pipeline(X_engineered: pd.DataFrame, n_jobs: int = -1,
+                         model_family: str = DEFAULT_MODEL_FAMILY,
+                         classifier_params: Optional[Dict[str, Any]] = None,
+                         memory=None) -> Pipeline:
+    """
+    Create the preprocessing + classifier pipeline used for retraining.
+    memory is passed to Pipeline so fitted preprocessors can be cached on disk.
+    """
+    categorical_features = [col for col in CATEGORICAL_FEATURES if col in X_engineered.columns]
+    numerical_features = [col for col in NUMERICAL_FEATURES if col in X_engineered.columns]
+
+    if model_family in NATIVE_CATEGORICAL_FAMILIES:
+        # Categoricals become compact integer codes (unknown/missing -> NaN) followed by
+        # the raw numeric features; trees need no scaling
+        preprocessor = Pipeline([
+            ('encode', ColumnTransformer(
+                transformers=[
+                    ('cat', OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=np.nan,
+                                           dtype=np.float32), categorical_features),
+                    ('num', 'passthrough', numerical_features)
+                ]
+            )),
+            ('float32', FunctionTransformer(to_float32))
+        ])
+        params = dict(classifier_params or {})
+        params['categorical_features'] = list(range(len(categorical_features)))
+        return Pipeline([
+            ('preprocessor', preprocessor),
+            ('classifier', make_classifier(model_family, params, n_jobs))
+        ], memory=memory)
+
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', StandardScaler(), numerical_features),
+            ('cat', OneHotEncoder(handle_unknown='ignore', sparse_output=False), categorical_features)
+        ]
+    )
+
+    return Pipeline([
+        ('preprocessor', preprocessor),
+        ('classifier', make_classifier(model_family, classifier_params, n_jobs))
+    ], memory=memory)
+
+def to_float32(X) -> np.ndarray:
+    """Cast a feature matrix to float32 (halves memory versus float64)."""
+    return np.asarray(X, dtype=np.float32)
+
+def save_model_atomically(model, model_path: str):
+    """
+    Persist a model without ever exposing a half-written file at model_path.
+    The previous model is kept as a .backup copy. The model is written with
+    MODEL_COMPRESSION (see artifact_compression.py).
+    """
+    model_dir = os.path.dirname(os.path.abspath(model_path))
+    os.makedirs(model_dir, exist_ok=True)
+
+    tmp_path = f"{model_path}.tmp-{os.getpid()}"
+    dump_artifact(model, tmp_path)
+
+    if os.path.exists(model_path):
+        # Hard-link the previous model as the backup rather than copying it
+        backup_tmp_path = f"{model_path}.backup.tmp-{os.getpid()}"
+        try:
+            os.link(model_path, backup_tmp_path)
+            os.replace(backup_tmp_path, f"{model_path}.backup")
+        except OSError:
+            shutil.copy2(model_path, f"{model_path}.backup")
+
+    os.replace(tmp_path, model_path)
+
+def holdout_mask(start: int, n_rows: int) -> np.ndarray:
+    """
+    Deterministically assign rows to the evaluation holdout by their position in
+    the training data, so full and incremental runs never train on each other's
+    test rows and their accuracies can be compared.
+    """
+    return holdout_mask_positions(np.arange(start, start + n_rows))
+
+def holdout_mask_positions(positions: np.ndarray) -> np.ndarray:
+    """holdout_mask for an explicit array of row positions (e.g. unordered chunks)."""
+    positions = np.asarray(positions, dtype=np.uint64)
+    hashed = (positions * np.uint64(2654435761)) % np.uint64(2 ** 32)
+    return (hashed % np.uint64(100)) < np.uint64(HOLDOUT_PERCENT)
+
+def _new_model_entry(model_path: str, mode: str, rows_total: int, rows_trained: int,
+                     metrics: Dict[str, Any], model_pipeline, **extra) -> Dict[str, Any]:
+    classifier = model_pipeline.named_steps['classifier']
+    entry = {
+        "version": new_model_version(),
+        "model_path": model_path,
+        "mode": mode,
+        "model_family": model_family_of(classifier),
+        "rows_total": rows_total,
+        "rows_trained": rows_trained,
+        "data_offset": rows_total,
+        "metrics": metrics,
+        "feature_set": getattr(model_pipeline, 'feature_set', None)
+    }
+    entry.update(extra)
+    return entry
+
+def resolve_training_mode(mode: str, previous: Optional[Dict[str, Any]], model_path: str) -> str:
+    """
+    Decide between a full rebuild and an incremental update.
+    'auto' updates incrementally until INCREMENTAL_FULL_REBUILD_EVERY updates
+    have been applied since the last full rebuild.
+    """
+    if mode not in ('auto', 'full', 'incremental', 'streaming'):
+        raise ValueError(f"Unknown training mode: {mode}")
+    if mode in ('full', 'streaming'):
+        return mode
+    if previous is None or not os.path.exists(model_path):
+        return 'full'
+    if mode == 'auto' and previous.get("incremental_updates", 0) >= INCREMENTAL_FULL_REBUILD_EVERY:
+        return 'full'
+    return 'incremental'
+
+def continue_training(classifier, X_new, y_new, rows_total: int) -> bool:
+    """
+    Add capacity fitted on new rows to an already trained classifier.
+
+    RandomForest gets extra trees via warm_start (a compact forest appends
+    trees fitted on the new rows) and XGBoost continues boosting from the
+    existing model. The amount of new capacity is proportional to the share
+    of new data. Returns False when the classifier family does not support
+    incremental updates. That includes HistGradientBoosting (and so the
+    distilled student): a warm-start fit rebins the features from the new rows
+    only, so the existing trees would split on the wrong bins. The XGBoost
+    wrapper also returns False when the new rows contain a class it was not
+    trained on.
+    """
+    share = len(X_new) / max(rows_total, 1)
+    family = type(classifier).__name__
+
+    if family in ('RandomForestClassifier', 'ExtraTreesClassifier'):
+        new_trees = max(INCREMENTAL_MIN_ESTIMATORS, int(round(INCREMENTAL_BASE_ESTIMATORS * share)))
+        classifier.set_params(warm_start=True, n_estimators=classifier.n_estimators + new_trees)
+        classifier.fit(X_new, y_new)
+        return True
+
+    if family == 'CompactForestClassifier':
+        new_trees = max(INCREMENTAL_MIN_ESTIMATORS, int(round(INCREMENTAL_BASE_ESTIMATORS * share)))
+        classifier.grow(X_new, y_new, new_trees)
+        return True
+
+    if family in ('XGBClassifier', 'XGBEarlyStoppingClassifier'):
+        xgb_model = getattr(classifier, 'model_', classifier)
+        if xgb_model is not classifier:
+            # The wrapper fits on encoded labels; a class it has never seen needs a rebuild
+            if not np.isin(y_new, classifier.classes_).all():
+                return False
+            y_new = np.searchsorted(classifier.classes_, y_new)
+        booster = xgb_model.get_booster()
+        new_rounds = max(INCREMENTAL_MIN_ESTIMATORS, int(round(booster.num_boosted_rounds() * share)))
+        xgb_model.set_params(n_estimators=new_rounds, early_stopping_rounds=None)
+        xgb_model.fit(X_new, y_new, xgb_model=booster, verbose=False)
+        return True
+
+    return False
+
+def _compact_model(model_pipeline, X_train: pd.DataFrame, X_test: pd.DataFrame, y_test: pd.Series,
+                   tracker: StageTracker):
+    """
+    Replace a random forest with its compact serving form when MODEL_COMPACTION
+    is set (see artifact_compression.py). Returns (pipeline, report or None).
+    """
+    if not MODEL_COMPACTION or not isinstance(model_pipeline.steps[-1][1], FOREST_CLASSES):
+        return model_pipeline, None
+    tracker.start('compact')
+    accuracy_before = accuracy_score(y_test, model_pipeline.predict(X_test))
+    model_pipeline, report = compact_pipeline(model_pipeline, X_train)
+    report["accuracy_before"] = float(accuracy_before)
+    report["accuracy_after"] = float(accuracy_score(y_test, model_pipeline.predict(X_test)))
+    tracker.finish()
+    return model_pipeline, report
+
+def _train_incremental(training_data_path: str, model_path: str, previous: Dict[str, Any],
+                       tracker: StageTracker, registry: ModelRegistry,
+                       log_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Update the current model with rows appended since it was trained.
+    Returns None if an incremental update is not possible and a full rebuild is needed.
+    """
+    offset = previous.get("data_offset", 0)
+
+    tracker.start('load')
+    # Only rows appended after the previous run are parsed into memory
+    new_data = open_training_data(training_data_path).read(start_row=offset)
+    rows_total = offset + len(new_data)
+    tracker.finish()
+
+    if len(new_data) < INCREMENTAL_MIN_NEW_ROWS:
+        logger.info(f"Only {len(new_data)} new rows since the last run; rebuilding fully")
+        return None
+
+    model_pipeline = load_artifact(model_path, mmap=False)
+    classifier = model_pipeline.named_steps['classifier']
+    y_new = new_data['Spoilage_Risk']
+    if set(y_new.unique()) != set(classifier.classes_):
+        logger.info("New rows do not cover every risk class; rebuilding fully")
+        return None
+
+    tracker.start('feature_engineering')
+    X_engineered = engineer_features(new_data.drop(['Spoilage_Risk'], axis=1, errors='ignore'),
+                                     features=getattr(model_pipeline, 'feature_set', None))
+    test_mask = holdout_mask(offset, len(new_data))
+    X_train, X_test = X_engineered[~test_mask], X_engineered[test_mask]
+    y_train, y_test = y_new[~test_mask], y_new[test_mask]
+    # The fitted preprocessor is reused so the feature space stays unchanged
+    X_train_transformed = model_pipeline[:-1].transform(X_train)
+    tracker.finish()
+
+    tracker.start('fit')
+    if not continue_training(classifier, X_train_transformed, y_train, rows_total):
+        tracker.finish()
+        logger.info(f"{type(classifier).__name__} does not support incremental updates; rebuilding fully")
+        return None
+    tracker.finish()
+
+    model_pipeline, compaction = _compact_model(model_pipeline, X_train, X_test, y_test, tracker)
+
+    tracker.start('evaluate')
+    y_pred = model_pipeline.predict(X_test)
+    accuracy = accuracy_score(y_test, y_pred)
+    logger.info(f"Model updated incrementally with accuracy on new rows: {accuracy:.4f}")
+    tracker.finish()
+
+    metrics = {
+        "accuracy": float(accuracy),
+        "train_rows": len(X_train),
+        "test_rows": len(X_test),
+        "evaluated_on": "new_rows",
+        "per_class": per_class_metrics(confusion_matrix(y_test, y_pred, labels=classifier.classes_),
+                                       list(classifier.classes_))
+    }
+    entry = _new_model_entry(
+        model_path, 'incremental', rows_total, len(new_data), metrics, model_pipeline,
+        parent_version=previous.get("version"),
+        incremental_updates=previous.get("incremental_updates", 0) + 1
+    )
+    if compaction is not None:
+        entry["compaction"] = compaction
+
+    tracker.start('serialize')
+    model_pipeline.version = entry["version"]
+    save_model_atomically(model_pipeline, model_path)
+    registry.register(entry)
+    tracker.finish()
+
+    with open(log_path, "a") as f:
+        f.write(f"{datetime.now().isoformat()}: Incrementally updated with {len(new_data)} new samples "
+                f"({rows_total} total), accuracy: {accuracy:.4f}\n")
+
+    return {
+        "status": "completed",
+        "mode": "incremental",
+        "model_version": entry["version"],
+        "model_family": entry["model_family"],
+        "rows": rows_total,
+        "metrics": metrics,
+        "stage_timings": tracker.stage_timings,
+        "peak_memory_mb": get_peak_memory_mb()
+    }
+
+def _train_full(training_data_path: str, model_path: str, previous: Optional[Dict[str, Any]],
+                tracker: StageTracker, registry: ModelRegistry,
+                n_jobs: int, log_path: str, model_family: str,
+                tune_budget_seconds: float) -> Dict[str, Any]:
+    """
+    Rebuild the model from scratch on the full training dataset.
+    Uses the last tuned configuration of the model family, or runs a
+    time-budgeted search first when tune_budget_seconds is set.
+    """
+    tracker.start('load')
+    reservoir = TrainingReservoir.for_training_data(training_data_path)
+    if reservoir is not None:
+        # Train on the bounded sample and evaluate on its held-out set
+        with reservoir.locked():
+            reservoir.refresh()
+            data, eval_data = reservoir.load()
+            rows_total = reservoir.state()["source_rows"]
+    else:
+        data, eval_data = open_training_data(training_data_path).read(), None
+        rows_total = len(data)
+    tracker.finish()
+
+    if len(data) < MIN_TRAINING_ROWS:
+        logger.warning(f"Insufficient data for retraining: {len(data)} rows")
+        return {
+            "status": "skipped",
+            "mode": "full",
+            "reason": f"Insufficient data for retraining: {len(data)} rows",
+            "rows": len(data),
+            "stage_timings": tracker.stage_timings,
+            "peak_memory_mb": get_peak_memory_mb()
+        }
+
+    tracker.start('feature_engineering')
+    if eval_data is not None and len(eval_data):
+        combined = pd.concat([data, eval_data], ignore_index=True)
+        test_mask = np.arange(len(combined)) >= len(data)
+        evaluated_on = "eval_set"
+    else:
+        combined = data
+        test_mask = holdout_mask(0, len(data))
+        evaluated_on = "all_rows"
+    X = combined.drop(['Spoilage_Risk'], axis=1, errors='ignore')
+    y = combined['Spoilage_Risk']
+    X_engineered = engineer_features(X)
+    tracker.finish()
+
+    X_train, X_test = X_engineered[~test_mask], X_engineered[test_mask]
+    y_train, y_test = y[~test_mask], y[test_mask]
+
+    extra: Dict[str, Any] = {"incremental_updates": 0}
+    classifier_params = registry.last_best_params(model_family)
+    if tune_budget_seconds > 0:
+        tracker.start('tune')
+        from tune_model import successive_halving_search
+        search = successive_halving_search(
+            X_train, y_train, model_family=model_family, budget_seconds=tune_budget_seconds,
+            n_jobs=n_jobs, warm_start=classifier_params
+        )
+        classifier_params = search["best_params"]
+        extra["best_params"] = classifier_params
+        extra["tuning"] = {key: search[key] for key in
+                           ("best_cv_accuracy", "elapsed_seconds", "candidates_evaluated", "budget_exhausted")}
+        tracker.finish()
+
+    from feature_pruning import FEATURE_PRUNING
+    feature_set = None
+    X_test_all = X_test
+    if FEATURE_PRUNING:
+        # Train and serve on the smallest feature set that keeps validation accuracy
+        tracker.start('prune')
+        from feature_pruning import prune_features
+        feature_set, extra["feature_pruning"] = prune_features(
+            X[~test_mask], y_train, model_family=model_family,
+            classifier_params=classifier_params, n_jobs=n_jobs
+        )
+        X_engineered = X_engineered[feature_set]
+        X_train, X_test = X_engineered[~test_mask], X_engineered[test_mask]
+        tracker.finish()
+
+    from distillation import DISTILLATION_TEACHER
+    tracker.start('fit')
+    if DISTILLATION_TEACHER:
+        # Serve a compact student trained on the ensemble's soft probabilities
+        from distillation import build_teacher_pipeline, distill_student
+        teacher = build_teacher_pipeline(X_engineered, DISTILLATION_TEACHER, n_jobs=n_jobs)
+        teacher.fit(X_train, y_train)
+        tracker.finish()
+        tracker.start('distill')
+        model_pipeline, extra["distillation"] = distill_student(teacher, X[~test_mask], X[test_mask],
+                                                                y_test, n_jobs=n_jobs, features=feature_set)
+        extra["distillation"]["teacher"] = DISTILLATION_TEACHER
+    else:
+        model_pipeline = build_model_pipeline(X_engineered, n_jobs=n_jobs, model_family=model_family,
+                                              classifier_params=classifier_params)
+        model_pipeline.fit(X_train, y_train)
+        extra["classifier_params"] = classifier_params or {}
+    if feature_set is not None:
+        model_pipeline.feature_set = feature_set
+    tracker.finish()
+
+    model_pipeline, compaction = _compact_model(model_pipeline, X_train, X_test, y_test, tracker)
+    if compaction is not None:
+        extra["compaction"] = compaction
+
+    tracker.start('evaluate')
+    y_pred = model_pipeline.predict(X_test)
+    accuracy = accuracy_score(y_test, y_pred)
+    logger.info(f"Model retrained with accuracy: {accuracy:.4f}")
+
+    if previous is not None and previous.get("mode") == 'incremental' and os.path.exists(model_path):
+        # Measure how far the incrementally updated model drifted from a full rebuild
+        try:
+            incremental_model = load_artifact(model_path)
+            incremental_accuracy = accuracy_score(y_test, incremental_model.predict(X_test_all))
+            extra["incremental_drift"] = {
+                "incremental_version": previous.get("version"),
+                "incremental_updates": previous.get("incremental_updates", 0),
+                "incremental_accuracy": float(incremental_accuracy),
+                "full_accuracy": float(accuracy),
+                "accuracy_gap": float(accuracy - incremental_accuracy)
+            }
+            logger.info(f"Incremental model accuracy {incremental_accuracy:.4f} vs full rebuild {accuracy:.4f}")
+        except Exception as e:
+            logger.warning(f"Could not evaluate previous incremental model: {str(e)}")
+    tracker.finish()
+
+    classes = list(model_pipeline.classes_)
+    metrics = {
+        "accuracy": float(accuracy),
+        "train_rows": len(X_train),
+        "test_rows": len(X_test),
+        "evaluated_on": evaluated_on,
+        "per_class": per_class_metrics(confusion_matrix(y_test, y_pred, labels=classes), classes)
+    }
+    if "incremental_drift" in extra:
+        metrics["incremental_accuracy_gap"] = extra["incremental_drift"]["accuracy_gap"]
+    if "distillation" in extra:
+        metrics["teacher_agreement"] = extra["distillation"]["agreement"]
+        metrics["teacher_accuracy"] = extra["distillation"]["teacher_accuracy"]
+    entry = _new_model_entry(
+        model_path, 'full', rows_total, len(data), metrics, model_pipeline,
+        parent_version=previous.get("version") if previous else None,
+        **extra
+    )
+
+    tracker.start('serialize')
+    model_pipeline.version = entry["version"]
+    save_model_atomically(model_pipeline, model_path)
+    registry.register(entry)
+    logger.info(f"New model saved to {model_path}")
+    tracker.finish()
+
+    with open(log_path, "a") as f:
+        f.write(f"{datetime.now().isoformat()}: Retrained with {len(data)} samples, "
+                f"accuracy: {accuracy:.4f}\n")
+
+    return {
+        "status": "completed",
+        "mode": "full",
+        "model_version": entry["version"],
+        "model_family": entry["model_family"],
+        "rows": len(data),
+        "metrics": metrics,
+        "stage_timings": tracker.stage_timings,
+        "peak_memory_mb": get_peak_memory_mb()
+    }
+
+def _train_streaming(training_data_path: str, model_path: str, previous: Optional[Dict[str, Any]],
+                     tracker: StageTracker, registry: ModelRegistry,
+                     n_jobs: int, log_path: str) -> Dict[str, Any]:
+    """Rebuild the model out of core, reading the training data in chunks."""
+    from streaming_training import train_streaming, STREAMING_MODEL_FAMILY
+
+    trained = train_streaming(training_data_path, model_family=STREAMING_MODEL_FAMILY,
+                              n_jobs=n_jobs, tracker=tracker)
+    model_pipeline = trained["model"]
+    metrics = {
+        "accuracy": float(trained["accuracy"]) if trained["accuracy"] is not None else None,
+        "train_rows": trained["train_rows"],
+        "test_rows": trained["test_rows"],
+        "evaluated_on": "all_rows",
+        "per_class": per_class_metrics(trained["confusion"], trained["classes"])
+    }
+    entry = _new_model_entry(
+        model_path, 'streaming', trained["rows"], trained["rows"], metrics, model_pipeline,
+        parent_version=previous.get("version") if previous else None,
+        incremental_updates=0
+    )
+
+    tracker.start('serialize')
+    model_pipeline.version = entry["version"]
+    save_model_atomically(model_pipeline, model_path)
+    registry.register(entry)
+    tracker.finish()
+
+    with open(log_path, "a") as f:
+        f.write(f"{datetime.now().isoformat()}: Retrained (streaming) with {trained['rows']} samples, "
+                f"accuracy: {metrics['accuracy']}\n")
+
+    return {
+        "status": "completed",
+        "mode": "streaming",
+        "model_version": entry["version"],
+        "model_family": entry["model_family"],
+        "rows": trained["rows"],
+        "metrics": metrics,
+        "stage_timings": tracker.stage_timings,
+        "peak_memory_mb": get_peak_memory_mb()
+    }
+
+def train_model(training_data_path: str, model_path: str,
+                progress_callback: Optional[ProgressCallback] = None,
+                n_jobs: int = -1,
+                mode: str = TRAINING_MODE,
+                model_family: str = DEFAULT_MODEL_FAMILY,
+                tune_budget_seconds: float = TUNE_BUDGET_SECONDS,
+                registry_path: str = MODEL_REGISTRY_PATH,
+                log_path: str = "retraining_log.txt",
+                history_path: str = TRAINING_HISTORY_PATH) -> Dict[str, Any]:
+    """
+    Retrain the spoilage model on the training dataset and save it to model_path.
+
+    mode is 'full' (refit from scratch), 'incremental' (extend the current model
+    with rows appended since it was trained) or 'auto' (incremental, with a
+    periodic full rebuild). Incremental runs fall back to a full rebuild when
+    an update is not possible. Full rebuilds train model_family and, if
+    tune_budget_seconds is positive, search its hyperparameters first. With
+    DISTILLATION_TEACHER set they instead fit that ensemble and serve a
+    compact student distilled from it (see distillation.py).
+    'streaming' trains out of core (see streaming_training.py); full rebuilds
+    switch to it automatically for very large datasets when the reservoir is off.
+    Completed runs also rebuild the model's similar cases index (see similar_cases.py).
+
+    Returns a result dictionary with the run status, evaluation metrics,
+    per-stage timings, throughput, model size and the peak memory used by the
+    process. Every run is also recorded in the training history.
+    """
+    started_at = datetime.now()
+    start = time.perf_counter()
+    try:
+        result = _run_training(training_data_path, model_path, progress_callback, n_jobs, mode,
+                               model_family, tune_budget_seconds, registry_path, log_path)
+    except Exception as e:
+        TrainingHistory(history_path).record({
+            "run_id": new_model_version(),
+            "status": "failed",
+            "error": str(e),
+            "requested_mode": mode,
+            "model_family": model_family,
+            "model_path": os.path.abspath(model_path),
+            "started_at": started_at.isoformat(),
+            "duration_seconds": round(time.perf_counter() - start, 4),
+            "peak_memory_mb": get_peak_memory_mb()
+        })
+        raise
+
+    if result.get("status") == "completed":
+        from similar_cases import SIMILAR_CASES_INDEX, build_similar_cases
+        if SIMILAR_CASES_INDEX:
+            # The API loads the similar cases index together with the model
+            try:
+                result["similar_cases"] = build_similar_cases(training_data_path, model_path)
+                result["stage_timings"]["similar_cases"] = result["similar_cases"]["seconds"]
+            except Exception as e:
+                logger.error(f"Failed to build similar cases index: {str(e)}")
+
+    result.update(run_telemetry(result, model_path, time.perf_counter() - start))
+    run = TrainingHistory(history_path).record(dict(
+        result,
+        run_id=result.get("model_version") or new_model_version(),
+        requested_mode=mode,
+        model_family=result.get("model_family", model_family),
+        model_path=os.path.abspath(model_path),
+        started_at=started_at.isoformat(),
+        finished_at=datetime.now().isoformat()
+    ))
+    result["regression"] = run.get("regression", False)
+    return result
+
+def run_telemetry(result: Dict[str, Any], model_path: str, seconds: float) -> Dict[str, Any]:
+    """Duration, throughput and model size of a finished run."""
+    metrics = result.get("metrics") or {}
+    rows = (metrics.get("train_rows") or 0) + (metrics.get("test_rows") or 0) or result.get("rows") or 0
+    fit_seconds = result.get("stage_timings", {}).get("fit")
+    telemetry = {
+        "duration_seconds": round(seconds, 4),
+        "rows_processed": int(rows),
+        "rows_per_second": round(rows / seconds, 1) if seconds > 0 else None,
+        "fit_rows_per_second": round(metrics["train_rows"] / fit_seconds, 1)
+        if fit_seconds and metrics.get("train_rows") else None,
+        "seconds_per_1k_rows": round(seconds * 1000 / rows, 4) if rows else None,
+        "model_size_bytes": None
+    }
+    if result.get("status") == "completed" and os.path.exists(model_path):
+        telemetry["model_size_bytes"] = os.path.getsize(model_path)
+    return telemetry
+
+def _run_training(training_data_path: str, model_path: str,
+                  progress_callback: Optional[ProgressCallback], n_jobs: int, mode: str,
+                  model_family: str, tune_budget_seconds: float, registry_path: str,
+                  log_path: str) -> Dict[str, Any]:
+    tracker = StageTracker(progress_callback)
+    registry = ModelRegistry(registry_path)
+    previous = registry.latest(model_path)
+
+    resolved_mode = resolve_training_mode(mode, previous, model_path)
+    if resolved_mode == 'incremental':
+        result = _train_incremental(training_data_path, model_path, previous,
+                                    tracker, registry, log_path)
+        if result is not None:
+            return result
+        tracker = StageTracker(progress_callback)
+
+    from streaming_training import should_stream
+    if resolved_mode == 'streaming' or (TrainingReservoir.for_training_data(training_data_path) is None
+                                        and should_stream(training_data_path)):
+        return _train_streaming(training_data_path, model_path, previous, tracker, registry,
+                                n_jobs, log_path)
+
+    return _train_full(training_data_path, model_path, previous, tracker, registry, n_jobs, log_path,
+                       model_family, tune_budget_seconds)
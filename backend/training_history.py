@@ -0,0 +1,90 @@
+"""
+Training run history for Surplus2Serve.
+
+Every training run (completed, skipped or failed) appends one JSON line to
+TRAINING_HISTORY_PATH with structured telemetry: per-stage timings, peak RSS,
+throughput, model size on disk and per-class evaluation metrics. The history
+is served newest first by GET /training/history.
+
+To make retrain-time regressions visible as the data grows, each completed
+run is compared with the median seconds per 1000 rows of the previous runs in
+the same mode and flagged when it is REGRESSION_FACTOR times slower.
+"""
+
+import os
+import json
+import logging
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TRAINING_HISTORY_PATH = os.getenv("TRAINING_HISTORY_PATH", "training_history.jsonl")
+# A run this many times slower per row than its baseline is flagged as a regression
+REGRESSION_FACTOR = 1.5
+# Previous runs of the same mode the baseline is the median of
+REGRESSION_WINDOW = 10
+
+def per_class_metrics(confusion: np.ndarray, labels: List[Any]) -> Dict[str, Dict[str, float]]:
+    """Precision, recall, F1 and support per class from a confusion matrix (rows: true class)."""
+    confusion = np.asarray(confusion, dtype=np.float64)
+    true_positives = np.diag(confusion)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+        recall = np.where(support > 0, true_positives / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {
+        str(label): {
+            "precision": round(float(precision[i]), 4),
+            "recall": round(float(recall[i]), 4),
+            "f1": round(float(f1[i]), 4),
+            "support": int(support[i])
+        }
+        for i, label in enumerate(labels)
+    }
+
+class TrainingHistory:
+    """Append-only JSON Lines log of training runs."""
+
+    def __init__(self, path: str = TRAINING_HISTORY_PATH):
+        self.path = os.path.abspath(path)
+
+    def runs(self, limit: Optional[int] = None, status: Optional[str] = None,
+             mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Recorded runs, newest first."""
+        if not os.path.exists(self.path):
+            return []
+        runs = []
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    runs.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping unreadable training history line")
+        runs.reverse()
+        if status is not None:
+            runs = [run for run in runs if run.get("status") == status]
+        if mode is not None:
+            runs = [run for run in runs if run.get("mode") == mode]
+        return runs[:limit] if limit is not None else runs
+
+    def record(self, run: Dict[str, Any]) -> Dict[str, Any]:
+        """Append a run, annotated with its regression check when it completed."""
+        run = dict(run)
+        if run.get("status") == "completed" and run.get("seconds_per_1k_rows") is not None:
+            previous = [r["seconds_per_1k_rows"] for r in self.runs(status="completed", mode=run.get("mode"))
+                        if r.get("seconds_per_1k_rows")][:REGRESSION_WINDOW]
+            baseline = float(np.median(previous)) if previous else None
+            run["baseline_seconds_per_1k_rows"] = round(baseline, 4) if baseline is not None else None
+            run["regression"] = bool(baseline and run["seconds_per_1k_rows"] > REGRESSION_FACTOR * baseline)
+            if run["regression"]:
+                logger.warning(f"Training run took {run['seconds_per_1k_rows']}s per 1k rows, "
+                               f"baseline {run['baseline_seconds_per_1k_rows']}s")
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(run, default=str) + "\n")
+        return run
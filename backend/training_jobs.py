@@ -0,0 +1,300 @@
+"""
+Persistent SQLite-backed queue of model training jobs.
+The API enqueues jobs and reads their status; training_worker.py claims and runs them.
+Because the queue lives on disk, queued and running jobs survive API restarts.
+"""
+
+import os
+import json
+import uuid
+import sqlite3
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Optional, List
+
+logger = logging.getLogger(__name__)
+
+TRAINING_JOBS_DB = os.getenv("TRAINING_JOBS_DB", "training_jobs.db")
+# A job whose worker died this many times while running it is failed instead of retried
+TRAINING_JOB_MAX_ATTEMPTS = int(os.getenv("TRAINING_JOB_MAX_ATTEMPTS", "3"))
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_SKIPPED = "skipped"
+JOB_FAILED = "failed"
+
+ACTIVE_JOB_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+_JSON_COLUMNS = ("stage_timings", "metrics", "params")
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+def _pid_alive(pid: int) -> bool:
+    """Whether a process with this pid exists; always True where that cannot be checked."""
+    if os.name != "posix":
+        # os.kill would terminate the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class TrainingJobQueue:
+    """Durable job queue for model retraining, stored in a local SQLite database."""
+
+    def __init__(self, db_path: str = TRAINING_JOBS_DB):
+        self.db_path = os.path.abspath(db_path)
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """Open a write transaction that serializes against every other process using the queue."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS training_jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    heartbeat_at TEXT,
+                    training_data_path TEXT NOT NULL,
+                    model_path TEXT NOT NULL,
+                    params TEXT,
+                    progress REAL DEFAULT 0,
+                    stage TEXT,
+                    stage_timings TEXT,
+                    peak_memory_mb REAL,
+                    metrics TEXT,
+                    error TEXT,
+                    worker_pid INTEGER,
+                    attempts INTEGER DEFAULT 0,
+                    not_before TEXT
+                )
+            """)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(training_jobs)")}
+            if "not_before" not in columns:
+                conn.execute("ALTER TABLE training_jobs ADD COLUMN not_before TEXT")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_training_jobs_status "
+                "ON training_jobs (status, created_at)"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS training_workers (
+                    pid INTEGER PRIMARY KEY,
+                    started_at TEXT NOT NULL,
+                    heartbeat_at TEXT NOT NULL
+                )
+            """)
+
+    @staticmethod
+    def row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        for column in _JSON_COLUMNS:
+            if job.get(column):
+                job[column] = json.loads(job[column])
+        return job
+
+    def enqueue(self, training_data_path: str, model_path: str,
+                params: Optional[Dict[str, Any]] = None,
+                not_before: Optional[datetime] = None,
+                conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
+        """
+        Add a new training job to the queue and return it.
+        The job will not be claimed before not_before, if given. Pass conn to
+        enqueue inside an open transaction().
+        """
+        job_id = uuid.uuid4().hex
+        args = (job_id, JOB_QUEUED, _now(), os.path.abspath(training_data_path),
+                os.path.abspath(model_path), json.dumps(params or {}),
+                not_before.isoformat() if not_before else None)
+        insert = ("INSERT INTO training_jobs (id, status, created_at, training_data_path, "
+                  "model_path, params, not_before) VALUES (?, ?, ?, ?, ?, ?, ?)")
+        if conn is not None:
+            conn.execute(insert, args)
+            row = conn.execute("SELECT * FROM training_jobs WHERE id = ?", (job_id,)).fetchone()
+            logger.info(f"Queued training job {job_id}")
+            return self.row_to_job(row)
+
+        with self._connect() as own_conn:
+            own_conn.execute(insert, args)
+        logger.info(f"Queued training job {job_id}")
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job by id, or None if it does not exist."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM training_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self.row_to_job(row) if row else None
+
+    def list_jobs(self, limit: int = 20, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Return the most recent jobs, newest first."""
+        query = "SELECT * FROM training_jobs"
+        args: list = []
+        if status:
+            query += " WHERE status = ?"
+            args.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        with self._connect() as conn:
+            rows = conn.execute(query, args).fetchall()
+        return [self.row_to_job(row) for row in rows]
+
+    def claim_next(self, worker_pid: int) -> Optional[Dict[str, Any]]:
+        """
+        Atomically move the oldest queued job to running and return it.
+        Returns None when the queue is empty or a job is already running,
+        so at most one training run happens at a time.
+        """
+        with self.transaction() as conn:
+            now = _now()
+            running = conn.execute(
+                "SELECT 1 FROM training_jobs WHERE status = ? LIMIT 1", (JOB_RUNNING,)
+            ).fetchone()
+            row = None if running else conn.execute(
+                "SELECT * FROM training_jobs WHERE status = ? "
+                "AND (not_before IS NULL OR not_before <= ?) ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE training_jobs SET status = ?, started_at = ?, heartbeat_at = ?, "
+                    "worker_pid = ?, attempts = attempts + 1, progress = 0, stage = NULL "
+                    "WHERE id = ?",
+                    (JOB_RUNNING, now, now, worker_pid, row["id"])
+                )
+        return self.get(row["id"]) if row is not None else None
+
+    def update_progress(self, job_id: str, progress: float, stage: Optional[str] = None,
+                        stage_timings: Optional[Dict[str, float]] = None,
+                        peak_memory_mb: Optional[float] = None):
+        """Record progress for a running job; also acts as the job heartbeat."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE training_jobs SET progress = ?, stage = COALESCE(?, stage), "
+                "stage_timings = COALESCE(?, stage_timings), "
+                "peak_memory_mb = COALESCE(?, peak_memory_mb), heartbeat_at = ? WHERE id = ?",
+                (progress, stage, json.dumps(stage_timings) if stage_timings is not None else None,
+                 peak_memory_mb, _now(), job_id)
+            )
+
+    def finish(self, job_id: str, result: Dict[str, Any]):
+        """Mark a job finished using the result dictionary returned by training.train_model."""
+        status = JOB_COMPLETED if result.get("status") == "completed" else JOB_SKIPPED
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE training_jobs SET status = ?, finished_at = ?, progress = 1, stage = NULL, "
+                "stage_timings = ?, peak_memory_mb = ?, metrics = ?, error = ? WHERE id = ?",
+                (status, _now(), json.dumps(result.get("stage_timings", {})),
+                 result.get("peak_memory_mb"), json.dumps(result.get("metrics", {})),
+                 result.get("reason"), job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        """Mark a job as failed."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE training_jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                (JOB_FAILED, _now(), error, job_id)
+            )
+
+    def requeue_orphaned(self, worker_pid: Optional[int] = None,
+                         max_age_seconds: float = 30.0) -> int:
+        """
+        Put running jobs whose worker is gone back in the queue.
+        Called by idle workers periodically, so a job interrupted by a crash or restart is
+        retried, up to TRAINING_JOB_MAX_ATTEMPTS times; after that it is marked failed, so a
+        job that crashes the worker cannot take it down forever. A worker counts as gone when
+        its heartbeat is older than max_age_seconds or its process no longer exists. Pass the
+        calling worker's pid: it has no job running, so jobs recorded under that pid (reused
+        after a restart) are orphaned too. Returns the number of jobs re-queued.
+        """
+        with self.transaction() as conn:
+            live_pids = set(self._live_worker_pids(conn, max_age_seconds)) - {worker_pid}
+            rows = conn.execute(
+                "SELECT id, worker_pid, attempts FROM training_jobs WHERE status = ?", (JOB_RUNNING,)
+            ).fetchall()
+            orphaned = [row for row in rows if row["worker_pid"] not in live_pids]
+            requeued = [row["id"] for row in orphaned if (row["attempts"] or 0) < TRAINING_JOB_MAX_ATTEMPTS]
+            exhausted = [row for row in orphaned if (row["attempts"] or 0) >= TRAINING_JOB_MAX_ATTEMPTS]
+            for job_id in requeued:
+                conn.execute(
+                    "UPDATE training_jobs SET status = ?, stage = NULL, progress = 0, "
+                    "worker_pid = NULL WHERE id = ?",
+                    (JOB_QUEUED, job_id)
+                )
+            for row in exhausted:
+                conn.execute(
+                    "UPDATE training_jobs SET status = ?, finished_at = ?, stage = NULL, "
+                    "worker_pid = NULL, error = ? WHERE id = ?",
+                    (JOB_FAILED, _now(), f"Worker exited during all {row['attempts']} attempts", row["id"])
+                )
+        if requeued:
+            logger.warning(f"Re-queued {len(requeued)} orphaned training job(s)")
+        if exhausted:
+            logger.error(f"Failed {len(exhausted)} orphaned training job(s) after "
+                         f"{TRAINING_JOB_MAX_ATTEMPTS} attempts")
+        return len(requeued)
+
+    # Worker registry -------------------------------------------------------
+
+    def register_worker(self, pid: int):
+        now = _now()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO training_workers (pid, started_at, heartbeat_at) "
+                "VALUES (?, ?, ?)",
+                (pid, now, now)
+            )
+
+    def worker_heartbeat(self, pid: int):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE training_workers SET heartbeat_at = ? WHERE pid = ?", (_now(), pid)
+            )
+
+    def unregister_worker(self, pid: int):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM training_workers WHERE pid = ?", (pid,))
+
+    def live_worker_pids(self, max_age_seconds: float = 30.0) -> List[int]:
+        """Return the pids of running workers that sent a heartbeat recently."""
+        with self._connect() as conn:
+            return self._live_worker_pids(conn, max_age_seconds)
+
+    @staticmethod
+    def _live_worker_pids(conn: sqlite3.Connection, max_age_seconds: float) -> List[int]:
+        rows = conn.execute("SELECT pid, heartbeat_at FROM training_workers").fetchall()
+        now = datetime.now()
+        return [
+            row["pid"] for row in rows
+            if (now - datetime.fromisoformat(row["heartbeat_at"])).total_seconds() <= max_age_seconds
+            and _pid_alive(row["pid"])
+        ]
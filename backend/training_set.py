@@ -0,0 +1,199 @@
+"""
+Bounded training set for Surplus2Serve.
+
+Keeps a stratified reservoir of at most TRAINING_RESERVOIR_SIZE rows next to
+the full training CSV, plus a separately held-out evaluation set. Training
+jobs bring both up to date with the rows stored since the previous job before
+loading them (see refresh), so uploads do no reservoir I/O and a full retrain
+reads a bounded, representative sample instead of the whole history.
+
+Sampling is weighted towards recent uploads: a row's weight doubles every
+TRAINING_RESERVOIR_HALF_LIFE_DAYS, using the Efraimidis-Spirakis scheme
+(keep the rows with the largest log-weight + Gumbel noise). Capacity is split
+across Spoilage_Risk x Commodity_name strata so rare commodities and classes
+are not crowded out by common ones.
+
+Refreshes and loads hold the reservoir's lock file (see locked()).
+"""
+
+import os
+import json
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Maximum rows kept for training (0 disables the reservoir and trains on everything)
+TRAINING_RESERVOIR_SIZE = int(os.getenv("TRAINING_RESERVOIR_SIZE", "200000"))
+# Maximum rows kept in the held-out evaluation set
+TRAINING_EVAL_SIZE = int(os.getenv("TRAINING_EVAL_SIZE", "20000"))
+# Percentage of incoming rows routed to the evaluation set
+TRAINING_EVAL_PERCENT = 10
+# Sampling weight doubles for rows uploaded this many days later
+TRAINING_RESERVOIR_HALF_LIFE_DAYS = float(os.getenv("TRAINING_RESERVOIR_HALF_LIFE_DAYS", "30"))
+
+SCORE_COLUMN = "_reservoir_score"
+STRATA_COLUMNS = ["Spoilage_Risk", "Commodity_name"]
+SEED_CHUNK_ROWS = 100_000
+
+def stratum_quotas(sizes: pd.Series, capacity: int) -> pd.Series:
+    """
+    Split capacity across strata as evenly as possible: small strata keep all
+    their rows and the slots they leave unused go to the larger ones.
+    """
+    if sizes.sum() <= capacity:
+        return sizes
+    quotas = {}
+    remaining = capacity
+    ordered = sizes.sort_values()
+    for position, (stratum, size) in enumerate(ordered.items()):
+        quota = min(int(size), remaining // (len(ordered) - position))
+        quotas[stratum] = quota
+        remaining -= quota
+    return pd.Series(quotas)
+
+class TrainingReservoir:
+    """Stratified, recency-weighted training sample plus held-out evaluation set."""
+
+    def __init__(self, training_data_path: str,
+                 capacity: int = TRAINING_RESERVOIR_SIZE,
+                 eval_capacity: int = TRAINING_EVAL_SIZE,
+                 half_life_days: float = TRAINING_RESERVOIR_HALF_LIFE_DAYS):
+        base, _ = os.path.splitext(os.path.abspath(training_data_path))
+        self.training_data_path = os.path.abspath(training_data_path)
+        self.reservoir_path = f"{base}_reservoir.csv"
+        self.eval_path = f"{base}_eval.csv"
+        self.state_path = f"{base}_reservoir.json"
+        self.lock_path = f"{base}_reservoir.lock"
+        self.capacity = capacity
+        self.eval_capacity = eval_capacity
+        self.decay = np.log(2) / half_life_days
+
+    @classmethod
+    def for_training_data(cls, training_data_path: str) -> Optional["TrainingReservoir"]:
+        """Reservoir for a training CSV, or None if the reservoir is disabled."""
+        if TRAINING_RESERVOIR_SIZE <= 0:
+            return None
+        return cls(training_data_path)
+
+    def state(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, "r") as f:
+            return json.load(f)
+
+    @contextmanager
+    def locked(self):
+        """Hold the reservoir's lock, serializing seeding, updates and consistent loads."""
+        from training_store import file_lock
+        with file_lock(self.lock_path):
+            yield
+
+    def is_seeded(self) -> bool:
+        return self.state() is not None
+
+    def seed(self, data: Optional[pd.DataFrame] = None):
+        """
+        Build the reservoir from existing training data, reading the stored
+        data in chunks when no frame is given.
+        """
+        for path in (self.reservoir_path, self.eval_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+        rows = 0
+        if data is not None:
+            self._add(data)
+            rows = len(data)
+        else:
+            from training_store import open_training_data
+            for _, chunk in open_training_data(self.training_data_path).iter_chunks(SEED_CHUNK_ROWS):
+                self._add(chunk)
+                rows += len(chunk)
+
+        self._write_state(rows)
+        logger.info(f"Seeded training reservoir from {rows} rows")
+
+    def refresh(self):
+        """
+        Seed the reservoir on first use, then offer it the rows stored since
+        the last refresh. Stored rows are append-only, so the rows past the
+        source_rows recorded in the state are exactly the new ones.
+        """
+        from training_store import open_training_data
+
+        state = self.state()
+        training_data = open_training_data(self.training_data_path)
+        if state is None or training_data.row_count() < state["source_rows"]:
+            # Not seeded yet, or the training data was replaced
+            self.seed()
+            return
+        new_rows = training_data.read(start_row=state["source_rows"])
+        if len(new_rows):
+            self.update(new_rows, source_rows=state["source_rows"] + len(new_rows))
+            logger.info(f"Offered {len(new_rows)} new rows to the training reservoir")
+
+    def update(self, new_rows: pd.DataFrame, source_rows: int):
+        """
+        Offer newly uploaded rows to the reservoir and evaluation set.
+        source_rows is the size of the full training CSV after the upload.
+        """
+        self._add(new_rows)
+        self._write_state(source_rows)
+
+    def load(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Return (training sample, evaluation set)."""
+        return self._read(self.reservoir_path), self._read(self.eval_path)
+
+    def _add(self, rows: pd.DataFrame):
+        if rows.empty:
+            return
+        now_days = datetime.now().timestamp() / 86400
+        uniform = np.random.default_rng().uniform(np.finfo(float).tiny, 1.0, len(rows))
+        rows = rows.assign(**{SCORE_COLUMN: self.decay * now_days - np.log(-np.log(uniform))})
+
+        # Deterministic split on row content, so a re-uploaded row always lands on the same side
+        hashes = pd.util.hash_pandas_object(rows.drop(columns=[SCORE_COLUMN]), index=False).to_numpy()
+        is_eval = hashes % 100 < TRAINING_EVAL_PERCENT
+
+        self._merge(self.reservoir_path, rows[~is_eval], self.capacity)
+        self._merge(self.eval_path, rows[is_eval], self.eval_capacity)
+
+    def _merge(self, path: str, rows: pd.DataFrame, capacity: int):
+        if rows.empty:
+            return
+        current = pd.read_csv(path) if os.path.exists(path) else None
+        combined = pd.concat([current, rows], ignore_index=True) if current is not None else rows
+
+        if len(combined) > capacity:
+            strata = combined[STRATA_COLUMNS].astype(str).agg("|".join, axis=1)
+            quotas = stratum_quotas(strata.value_counts(), capacity)
+            rank = combined[SCORE_COLUMN].groupby(strata).rank(ascending=False, method="first")
+            combined = combined[rank <= strata.map(quotas)]
+
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        combined.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def _read(self, path: str) -> pd.DataFrame:
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        return pd.read_csv(path).drop(columns=[SCORE_COLUMN])
+
+    def _write_state(self, source_rows: int):
+        state = {
+            "source_rows": int(source_rows),
+            "capacity": self.capacity,
+            "eval_capacity": self.eval_capacity,
+            "half_life_days": np.log(2) / self.decay,
+            "updated_at": datetime.now().isoformat()
+        }
+        tmp_path = f"{self.state_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
@@ -0,0 +1,677 @@
+"""
+Training data storage for Surplus2Serve.
+
+The default backend is an append-only Parquet segment store: every upload is
+written as immutable segment files, partitioned by upload date and commodity
+category (hive layout: upload_date=YYYY-MM-DD/category=Fruits/seg-*.parquet).
+Uploads cost O(upload) instead of rewriting the whole dataset, readers only
+scan the columns and partitions they ask for, and a background compaction
+(run by the training worker) merges small segments.
+
+Uploads are deduplicated against all stored rows through a persistent index
+of 64-bit row hashes (dedup_index.py), so the check costs O(upload) rather
+than a scan of the history. Exact duplicates within an upload are dropped and
+reported as well.
+
+Every row gets a monotonically increasing _ingest_seq when it is stored.
+Sequence numbers are contiguous, so they double as the row positions the
+training code uses for incremental offsets and the deterministic holdout.
+
+Both backends keep a dataset manifest (dataset_manifest.py) up to date on
+every append, so row counts and dataset statistics never require a scan.
+
+Concurrent uploads cannot corrupt the store and readers never see a partial
+append. store_state.json lists the committed segments and is replaced
+atomically; every reader works from one such snapshot. Each append or
+compaction is a transaction in an append-only write-ahead log (wal.log): a
+begin record naming the new segment files, the fsync'd segments, then an
+fsync'd commit marker, after which the snapshot is published and the log is
+checkpointed. The next writer rolls transactions left behind by a crashed
+writer forward (committed) or deletes their files (uncommitted). Within a
+process all appends go through one writer thread (TrainingDataWriter) that
+uploads enqueue into; writers in different processes queue on the store's
+file lock. Segments replaced by compaction are deleted only after a grace
+period, so long-running readers of an older snapshot can finish.
+
+Set TRAINING_STORE_DIR to an empty string to keep the legacy single CSV
+(CsvTrainingData); both backends share the same interface.
+"""
+
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, date
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+from dataset_loader import harmonize_schema, CATEGORY_COLUMNS, SCHEMA_COLUMNS, PYARROW_AVAILABLE
+from dedup_index import RowHashIndex
+from dataset_manifest import DatasetManifest, public_stats
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Root of the segment store; empty keeps training data in the legacy CSV
+TRAINING_STORE_DIR = os.getenv("TRAINING_STORE_DIR", os.path.join(BACKEND_DIR, "training_store"))
+# Partitions with at least this many segments are merged by compaction
+COMPACT_MIN_SEGMENTS = int(os.getenv("TRAINING_STORE_COMPACT_MIN_SEGMENTS", "8"))
+
+SEQ_COLUMN = "_ingest_seq"
+STATE_FILE = "store_state.json"
+LOCK_FILE = ".lock"
+INDEX_DIR = "dedup_index"
+MANIFEST_FILE = "dataset_manifest.json"
+WAL_FILE = "wal.log"
+IMPORT_CHUNK_ROWS = 100_000
+# Segments replaced by compaction stay on disk this long for readers of older snapshots
+RETIRED_GRACE_SECONDS = int(os.getenv("TRAINING_STORE_RETIRED_GRACE_SECONDS", "3600"))
+# Queued appends the writer thread applies per acquisition of the file lock
+WRITER_BATCH_SIZE = 32
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+def _lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    # Lock the first byte; LK_LOCK gives up after about 10 seconds, so keep trying
+    lock_file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Exclusive lock on path: flock, or a msvcrt byte-range lock on Windows.
+    Both belong to the open file, so this serializes threads of one process
+    as well as separate processes.
+    """
+    with open(path, "a+") as lock_file:
+        _lock(lock_file)
+        try:
+            yield
+        finally:
+            _unlock(lock_file)
+
+def _fsync(path: str):
+    if os.name == "nt" and os.path.isdir(path):
+        return  # directories cannot be opened for fsync on Windows
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def open_training_data(training_data_path: str):
+    """
+    Return the training data backend for the API's training_data_path: the
+    segment store when TRAINING_STORE_DIR is set (importing the legacy CSV on
+    first use), otherwise the CSV itself. The store needs pyarrow.
+    """
+    if TRAINING_STORE_DIR and PYARROW_AVAILABLE:
+        return TrainingDataStore(TRAINING_STORE_DIR, legacy_csv_path=training_data_path)
+    return CsvTrainingData(training_data_path)
+
+class CsvTrainingData:
+    """
+    Training data kept in a single CSV that is rewritten on every upload.
+    Appends hold a lock file and replace the CSV atomically, so readers always
+    see a complete file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        base, _ = os.path.splitext(os.path.abspath(path))
+        self._manifest_store = DatasetManifest(f"{base}_manifest.json")
+
+    def _source_version(self) -> Dict[str, int]:
+        if not os.path.exists(self.path):
+            return {"source_size": 0, "source_mtime_ns": 0}
+        stat = os.stat(self.path)
+        return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+    def _current_manifest(self) -> Dict[str, Any]:
+        """The manifest, rebuilt first if the CSV changed behind its back."""
+        manifest = self._manifest_store.load()
+        version = self._source_version()
+        if manifest is None or any(manifest.get(key) != value for key, value in version.items()):
+            chunks = (chunk for _, chunk in self.iter_chunks(IMPORT_CHUNK_ROWS)) if version["source_size"] else []
+            manifest = self._manifest_store.rebuild(chunks, extra=version)
+        return manifest
+
+    def stats(self) -> Dict[str, Any]:
+        return public_stats(self._current_manifest())
+
+    def manifest(self) -> Dict[str, Any]:
+        """The full manifest, including the histograms drift monitoring compares against."""
+        return self._current_manifest()
+
+    def row_count(self) -> int:
+        return int(self._current_manifest()["rows"])
+
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def read(self, columns: Optional[List[str]] = None, start_row: int = 0) -> pd.DataFrame:
+        """Rows from position start_row on, in storage order."""
+        return pd.read_csv(self.path, usecols=columns, skiprows=range(1, start_row + 1))
+
+    def iter_chunks(self, chunk_rows: int,
+                    columns: Optional[List[str]] = None) -> Iterator[Tuple[np.ndarray, pd.DataFrame]]:
+        """Yield (row positions, frame) chunks."""
+        offset = 0
+        for chunk in pd.read_csv(self.path, usecols=columns, chunksize=chunk_rows):
+            yield np.arange(offset, offset + len(chunk)), chunk
+            offset += len(chunk)
+
+    def append(self, new_data: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, int]]:
+        """
+        Add an upload, dropping duplicates.
+        Returns (rows actually added, deduplication report).
+        """
+        with file_lock(f"{self.path}.lock"):
+            self._current_manifest()
+            if os.path.exists(self.path):
+                existing_data = pd.read_csv(self.path)
+                combined_data = pd.concat([existing_data, new_data], ignore_index=True)
+            else:
+                existing_data = new_data.iloc[0:0]
+                combined_data = new_data.reset_index(drop=True)
+            combined_data = combined_data.drop_duplicates()
+            tmp_path = f"{self.path}.tmp-{os.getpid()}"
+            combined_data.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, self.path)
+            added = combined_data[combined_data.index >= len(existing_data)]
+
+            duplicates_in_upload = int(new_data.duplicated().sum())
+            report = dedup_report(len(new_data), 0, duplicates_in_upload,
+                                  len(new_data) - duplicates_in_upload - len(added), len(added))
+            self._manifest_store.update(added, upload=report, extra=self._source_version())
+            return added, report
+
+class TrainingDataStore:
+    """Append-only Parquet segments partitioned by upload date and commodity category."""
+
+    def __init__(self, root: str = TRAINING_STORE_DIR, legacy_csv_path: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.legacy_csv_path = legacy_csv_path
+        os.makedirs(self.root, exist_ok=True)
+        state = self._state()
+        if state is None:
+            self._import_legacy_csv()
+        elif "segments" not in state:
+            with self._lock():
+                self._migrate_state_locked()
+
+    # -- state and locking -------------------------------------------------
+
+    def _state(self) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.root, STATE_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The committed state a reader works from: next_seq and the live segments."""
+        return self._state() or {"next_seq": 0, "segments": []}
+
+    def _write_state(self, state: Dict[str, Any]):
+        path = os.path.join(self.root, STATE_FILE)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @contextmanager
+    def _lock(self):
+        """Serialize writers (API processes, compaction) on an exclusive file lock."""
+        with file_lock(os.path.join(self.root, LOCK_FILE)):
+            yield
+
+    def _import_legacy_csv(self):
+        with self._lock():
+            if self._state() is not None:
+                return
+            self._write_state({"next_seq": 0, "segments": [], "retired": [], "last_txn": 0,
+                               "created_at": datetime.now().isoformat()})
+            if self.legacy_csv_path and os.path.exists(self.legacy_csv_path):
+                rows = 0
+                for chunk in pd.read_csv(self.legacy_csv_path, chunksize=IMPORT_CHUNK_ROWS):
+                    if len(chunk):
+                        rows += len(self._append_locked(chunk, record_upload=False)[0])
+                logger.info(f"Imported {rows} rows from {self.legacy_csv_path} into the training store")
+
+    def _migrate_state_locked(self):
+        """Build the segment list of a store written before segments were tracked in its state."""
+        state = self._state()
+        if "segments" in state:
+            return
+        segments = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not (name.startswith("seg-") and name.endswith(".parquet")):
+                    continue
+                path = os.path.join(dirpath, name)
+                # Segments starting past next_seq were never committed
+                if int(name.split("-")[1]) >= state["next_seq"]:
+                    os.remove(path)
+                else:
+                    segments.append(os.path.relpath(path, self.root))
+        state.update(segments=sorted(segments), retired=[], last_txn=0)
+        self._write_state(state)
+
+    # -- write-ahead log -----------------------------------------------------
+
+    @property
+    def _wal_path(self) -> str:
+        return os.path.join(self.root, WAL_FILE)
+
+    def _wal_write(self, record: Dict[str, Any]):
+        with open(self._wal_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _wal_records(self) -> List[Dict[str, Any]]:
+        records = []
+        with open(self._wal_path, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break  # torn tail of a write interrupted by a crash
+        return records
+
+    def _wal_checkpoint(self):
+        """Empty the log once the state file reflects every committed transaction."""
+        with open(self._wal_path, "w") as f:
+            os.fsync(f.fileno())
+
+    def _begin(self, state: Dict[str, Any], kind: str, segments: List[str],
+               removed: Optional[List[str]] = None) -> Dict[str, Any]:
+        begin = {"txn": state.get("last_txn", 0) + 1, "op": "begin", "kind": kind,
+                 "segments": segments, "removed": removed or []}
+        self._wal_write(begin)
+        return begin
+
+    def _commit(self, begin: Dict[str, Any], next_seq: int):
+        self._wal_write({"txn": begin["txn"], "op": "commit", "next_seq": next_seq})
+
+    @staticmethod
+    def _apply(state: Dict[str, Any], begin: Dict[str, Any], next_seq: int):
+        """Apply a committed transaction to the state (in place)."""
+        removed = set(begin["removed"])
+        state["segments"] = [path for path in state["segments"] if path not in removed] + begin["segments"]
+        state.setdefault("retired", []).extend({"path": path, "retired_at": time.time()}
+                                               for path in begin["removed"])
+        state["next_seq"] = next_seq
+        state["last_txn"] = begin["txn"]
+        state["updated_at"] = datetime.now().isoformat()
+
+    def _recover_locked(self):
+        """
+        Finish the transactions of a writer that died mid-way: committed ones
+        are applied to the state, the segment files of uncommitted ones removed.
+        """
+        if not os.path.exists(self._wal_path) or not os.path.getsize(self._wal_path):
+            return
+        records = self._wal_records()
+        commits = {record["txn"]: record for record in records if record["op"] == "commit"}
+        state = self._state()
+        rolled_forward = rolled_back = 0
+        for begin in (record for record in records if record["op"] == "begin"):
+            if begin["txn"] <= state.get("last_txn", 0):
+                continue
+            if begin["txn"] in commits:
+                self._apply(state, begin, commits[begin["txn"]]["next_seq"])
+                rolled_forward += 1
+            else:
+                for relpath in begin["segments"]:
+                    path = os.path.join(self.root, relpath)
+                    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+                    for leftover in (path, tmp_path):
+                        if os.path.exists(leftover):
+                            os.remove(leftover)
+                rolled_back += 1
+        self._write_state(state)
+        self._wal_checkpoint()
+        if rolled_forward or rolled_back:
+            logger.warning(f"Recovered training store: {rolled_forward} committed transaction(s) applied, "
+                           f"{rolled_back} incomplete transaction(s) rolled back")
+
+    # -- reading -------------------------------------------------------------
+
+    def _segment_files(self, snapshot: Optional[Dict[str, Any]] = None) -> List[str]:
+        snapshot = snapshot or self.snapshot()
+        return [os.path.join(self.root, path) for path in snapshot["segments"]]
+
+    def _dataset(self, files: List[str]):
+        import pyarrow.dataset as ds
+        return ds.dataset(files, format="parquet",
+                          partitioning=ds.partitioning(flavor="hive"), partition_base_dir=self.root)
+
+    @staticmethod
+    def _filter(categories: Optional[List[str]] = None, since: Optional[str] = None,
+                until: Optional[str] = None, start_row: int = 0):
+        import pyarrow.dataset as ds
+        conditions = []
+        if categories is not None:
+            conditions.append(ds.field("category").isin(list(categories)))
+        if since is not None:
+            conditions.append(ds.field("upload_date") >= since)
+        if until is not None:
+            conditions.append(ds.field("upload_date") <= until)
+        if start_row:
+            conditions.append(ds.field(SEQ_COLUMN) >= start_row)
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    @staticmethod
+    def _to_frame(table, columns: Optional[List[str]]) -> pd.DataFrame:
+        df = table.to_pandas()
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+        return df if columns is None else df[columns]
+
+    def _current_manifest(self) -> Dict[str, Any]:
+        """The manifest, rebuilt first if it does not cover every stored row."""
+        manifest = DatasetManifest(os.path.join(self.root, MANIFEST_FILE)).load()
+        if manifest is None or manifest.get("covered_seq") != self._state()["next_seq"]:
+            with self._lock():
+                manifest = self._current_manifest_locked()
+        return manifest
+
+    def _current_manifest_locked(self) -> Dict[str, Any]:
+        manifest_store = DatasetManifest(os.path.join(self.root, MANIFEST_FILE))
+        manifest = manifest_store.load()
+        next_seq = self._state()["next_seq"]
+        if manifest is None or manifest.get("covered_seq") != next_seq:
+            manifest = manifest_store.rebuild((chunk for _, chunk in self.iter_chunks(IMPORT_CHUNK_ROWS)),
+                                              extra={"covered_seq": next_seq})
+        return manifest
+
+    def stats(self) -> Dict[str, Any]:
+        """Dataset statistics from the manifest."""
+        return public_stats(self._current_manifest())
+
+    def manifest(self) -> Dict[str, Any]:
+        """The full manifest, including the histograms drift monitoring compares against."""
+        return self._current_manifest()
+
+    def row_count(self, categories: Optional[List[str]] = None) -> int:
+        if categories is None:
+            return int(self._state()["next_seq"])
+        counts = self._current_manifest()["category_counts"]
+        return sum(counts.get(category, 0) for category in categories)
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(path) for path in self._segment_files())
+
+    def read(self, columns: Optional[List[str]] = None, start_row: int = 0,
+             categories: Optional[List[str]] = None, since: Optional[str] = None,
+             until: Optional[str] = None) -> pd.DataFrame:
+        """
+        Rows with _ingest_seq >= start_row in ingestion order, optionally limited
+        to some commodity categories and an upload date range (YYYY-MM-DD).
+        Only the requested columns are read from disk.
+        """
+        wanted = list(columns or SCHEMA_COLUMNS)
+        files = self._segment_files()
+        if not files:
+            return pd.DataFrame(columns=wanted)
+        table = self._dataset(files).to_table(columns=wanted + [SEQ_COLUMN],
+                                              filter=self._filter(categories, since, until, start_row))
+        df = self._to_frame(table, None).sort_values(SEQ_COLUMN, kind="stable")
+        return df[wanted].reset_index(drop=True)
+
+    def iter_chunks(self, chunk_rows: int, columns: Optional[List[str]] = None,
+                    categories: Optional[List[str]] = None) -> Iterator[Tuple[np.ndarray, pd.DataFrame]]:
+        """Yield (row positions, frame) batches without materializing the dataset."""
+        files = self._segment_files()
+        if not files:
+            return
+        wanted = list(columns or SCHEMA_COLUMNS)
+        scanner = self._dataset(files).scanner(columns=wanted + [SEQ_COLUMN], filter=self._filter(categories),
+                                          batch_size=chunk_rows)
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                df = self._to_frame(batch, None)
+                yield df[SEQ_COLUMN].to_numpy(), df[wanted].reset_index(drop=True)
+
+    # -- writing -------------------------------------------------------------
+
+    def append(self, new_data: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, int]]:
+        """
+        Store an upload as new segments. The append is queued to this process's
+        writer thread; the call returns once it is committed.
+        Returns (rows actually added, deduplication report).
+        """
+        return _writer_for(self).submit(new_data)
+
+    def _append_locked(self, new_data: pd.DataFrame,
+                       record_upload: bool = True) -> Tuple[pd.DataFrame, Dict[str, int]]:
+        self._recover_locked()
+        rows = harmonize_schema(new_data.copy())
+        invalid_rows = len(new_data) - len(rows)
+
+        hashes = row_hashes(rows)
+        in_upload = pd.Series(hashes).duplicated().to_numpy()
+        index = self._index()
+        existing = index.contains(hashes) & ~in_upload
+        keep = ~(in_upload | existing)
+        rows, hashes = rows[keep].reset_index(drop=True), hashes[keep]
+        report = dedup_report(len(new_data), invalid_rows, int(in_upload.sum()),
+                              int(existing.sum()), len(rows))
+        if in_upload.any():
+            logger.info(f"Upload contains {report['duplicates_in_upload']} duplicate rows")
+        self._current_manifest_locked()
+        manifest = DatasetManifest(os.path.join(self.root, MANIFEST_FILE))
+        upload = report if record_upload else None
+        if rows.empty:
+            if upload is not None:
+                manifest.update(rows, upload=upload, extra={"covered_seq": self._state()["next_seq"]})
+            return rows, report
+
+        state = self._state()
+        first_seq = state["next_seq"]
+        next_seq = first_seq + len(rows)
+        rows[SEQ_COLUMN] = np.arange(first_seq, next_seq, dtype=np.int64)
+        upload_date = date.today().isoformat()
+        parts = [(self._segment_path(upload_date, str(category), int(part[SEQ_COLUMN].iloc[0])), part)
+                 for category, part in rows.groupby('Commodity_Category', observed=True, sort=False)]
+
+        begin = self._begin(state, "append", [relpath for relpath, _ in parts])
+        for relpath, part in parts:
+            self._write_segment(part, relpath)
+        self._commit(begin, next_seq)
+
+        index.add(hashes, covered_seq=next_seq)
+        manifest.update(rows, upload=upload, extra={"covered_seq": next_seq})
+        self._apply(state, begin, next_seq)
+        self._write_state(state)
+        self._wal_checkpoint()
+        return rows.drop(columns=[SEQ_COLUMN]), report
+
+    def _index(self) -> RowHashIndex:
+        """
+        The row hash index, rebuilt from the segments if it does not match the
+        store (first use, or a writer died between the two updates).
+        """
+        index = RowHashIndex(os.path.join(self.root, INDEX_DIR))
+        next_seq = self._state()["next_seq"]
+        if index.covered_seq != next_seq:
+            index.rebuild((row_hashes(chunk) for _, chunk in self.iter_chunks(IMPORT_CHUNK_ROWS)),
+                          covered_seq=next_seq)
+        return index
+
+    def _partition_dir(self, upload_date: str, category: str) -> str:
+        return os.path.join(self.root, f"upload_date={upload_date}", f"category={quote(category, safe='')}")
+
+    def _segment_path(self, upload_date: str, category: str, first_seq: int) -> str:
+        """New segment file, relative to the store root."""
+        name = f"seg-{first_seq:012d}-{uuid.uuid4().hex[:8]}.parquet"
+        return os.path.relpath(os.path.join(self._partition_dir(upload_date, category), name), self.root)
+
+    def _write_segment(self, rows: pd.DataFrame, relpath: str):
+        path = os.path.join(self.root, relpath)
+        partition_dir = os.path.dirname(path)
+        os.makedirs(partition_dir, exist_ok=True)
+        tmp_path = os.path.join(partition_dir, f".{os.path.basename(path)}.tmp")
+        # Plain strings keep the Parquet schema identical across segments
+        rows.astype({col: str for col in CATEGORY_COLUMNS}).to_parquet(tmp_path, index=False)
+        _fsync(tmp_path)
+        os.replace(tmp_path, path)
+        _fsync(partition_dir)
+
+    # -- compaction ----------------------------------------------------------
+
+    def compact(self, min_segments: int = COMPACT_MIN_SEGMENTS) -> Dict[str, Any]:
+        """
+        Merge the segments of every partition that has at least min_segments of
+        them into one segment. Safe to run while the API is ingesting; readers
+        switch to the merged segment with their next snapshot.
+        """
+        start = time.perf_counter()
+        merged_partitions = merged_segments = 0
+        with self._lock():
+            self._recover_locked()
+            state = self._state()
+            self._purge_retired(state)
+            partitions: Dict[str, List[str]] = {}
+            for relpath in state["segments"]:
+                partitions.setdefault(os.path.dirname(relpath), []).append(relpath)
+
+            for partition_dir, segments in partitions.items():
+                if len(segments) < min_segments:
+                    continue
+                rows = pd.concat([pd.read_parquet(os.path.join(self.root, relpath)) for relpath in segments],
+                                 ignore_index=True)
+                rows = rows.sort_values(SEQ_COLUMN, kind="stable")
+                upload_date = partition_dir.split("upload_date=")[1].split(os.sep)[0]
+                category = rows['Commodity_Category'].iloc[0]
+                merged = self._segment_path(upload_date, category, int(rows[SEQ_COLUMN].iloc[0]))
+                begin = self._begin(state, "compact", [merged], removed=segments)
+                self._write_segment(rows, merged)
+                self._commit(begin, state["next_seq"])
+                self._apply(state, begin, state["next_seq"])
+                merged_partitions += 1
+                merged_segments += len(segments)
+
+            self._write_state(state)
+            self._wal_checkpoint()
+
+        if merged_partitions:
+            logger.info(f"Compacted {merged_segments} segments in {merged_partitions} partition(s)")
+        return {
+            "partitions_compacted": merged_partitions,
+            "segments_merged": merged_segments,
+            "seconds": round(time.perf_counter() - start, 4)
+        }
+
+    def _purge_retired(self, state: Dict[str, Any]):
+        """Delete replaced segments whose grace period has passed (in place)."""
+        cutoff = time.time() - RETIRED_GRACE_SECONDS
+        kept = []
+        for retired in state.get("retired", []):
+            if retired["retired_at"] > cutoff:
+                kept.append(retired)
+                continue
+            path = os.path.join(self.root, retired["path"])
+            if os.path.exists(path):
+                os.remove(path)
+        state["retired"] = kept
+
+class TrainingDataWriter:
+    """
+    The single writer of a store within this process. Uploads enqueue their
+    appends and wait for the result; one thread applies them in arrival order,
+    taking the store's file lock once per batch of queued appends.
+    """
+
+    def __init__(self, store: TrainingDataStore):
+        self.store = store
+        self._queue: "queue.Queue[Tuple[pd.DataFrame, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="training-store-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, new_data: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, int]]:
+        """Queue an append and block until it is committed."""
+        future: Future = Future()
+        self._queue.put((new_data, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITER_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.store._lock():
+                    for new_data, future in batch:
+                        try:
+                            future.set_result(self.store._append_locked(new_data))
+                        except Exception as e:
+                            future.set_exception(e)
+            except Exception as e:
+                logger.error(f"Training store writer failed: {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+_writers: Dict[str, TrainingDataWriter] = {}
+_writers_lock = threading.Lock()
+
+def _writer_for(store: TrainingDataStore) -> TrainingDataWriter:
+    with _writers_lock:
+        if store.root not in _writers:
+            _writers[store.root] = TrainingDataWriter(store)
+        return _writers[store.root]
+
+def dedup_report(rows_received: int, invalid_rows: int, duplicates_in_upload: int,
+                 duplicates_existing: int, rows_added: int) -> Dict[str, int]:
+    return {
+        "rows_received": int(rows_received),
+        "invalid_rows": int(invalid_rows),
+        "duplicates_in_upload": int(duplicates_in_upload),
+        "duplicates_existing": int(duplicates_existing),
+        "rows_added": int(rows_added)
+    }
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """64-bit content hash of each row over the harmonized schema columns."""
+    values = df[SCHEMA_COLUMNS].astype({col: str for col in CATEGORY_COLUMNS})
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Out-of-process training worker for Surplus2Serve.
+
+Polls the SQLite job queue (training_jobs.py) and runs each retraining job in a
+separate child process, so model fitting never competes with the API process
+for the GIL. While idle it also compacts the training data store. CPU usage
+can be capped with --cpus / TRAINING_WORKER_CPUS and the worker can be
+de-prioritised with --nice / TRAINING_WORKER_NICE.
+
+Usage:
+    python training_worker.py [--cpus 2] [--nice 10] [--once]
+"""
+
+import os
+import sys
+import time
+import argparse
+import logging
+import subprocess
+import multiprocessing
+import traceback
+from typing import Dict, Any, Optional
+
+from training_jobs import TrainingJobQueue, TRAINING_JOBS_DB, JOB_QUEUED, JOB_RUNNING
+from retrain_scheduler import RetrainScheduler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SECONDS = float(os.getenv("TRAINING_WORKER_POLL_INTERVAL", "2"))
+HEARTBEAT_MAX_AGE_SECONDS = 30.0
+# Seconds between checks of an idle worker for jobs whose worker died
+ORPHAN_CHECK_INTERVAL_SECONDS = float(os.getenv("TRAINING_ORPHAN_CHECK_INTERVAL", "30"))
+# Seconds between compactions of the training data store (0 disables them)
+COMPACT_INTERVAL_SECONDS = float(os.getenv("TRAINING_STORE_COMPACT_INTERVAL", "600"))
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def apply_resource_limits(cpus: Optional[int], nice: int):
+    """
+    Lower the worker's scheduling priority and cap the CPUs used for training.
+    Child processes inherit both settings.
+    """
+    if nice and hasattr(os, "nice"):
+        try:
+            os.nice(nice)
+        except OSError as e:
+            logger.warning(f"Could not set niceness: {str(e)}")
+
+    if cpus:
+        # Limit native thread pools (BLAS/OpenMP) as well as joblib workers
+        for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ[var] = str(cpus)
+        if hasattr(os, "sched_setaffinity"):
+            try:
+                available = sorted(os.sched_getaffinity(0))
+                os.sched_setaffinity(0, available[:cpus])
+            except OSError as e:
+                logger.warning(f"Could not set CPU affinity: {str(e)}")
+
+def run_job(job: Dict[str, Any], db_path: str, n_jobs: int):
+    """Run one training job; executed in a child process."""
+    queue = TrainingJobQueue(db_path)
+    job_id = job["id"]
+
+    def report(update: Dict[str, Any]):
+        queue.update_progress(
+            job_id,
+            progress=update["progress"],
+            stage=update.get("stage"),
+            stage_timings=update.get("stage_timings"),
+            peak_memory_mb=update.get("peak_memory_mb")
+        )
+
+    try:
+        os.chdir(BACKEND_DIR)
+        from training import train_model, TRAINING_MODE, DEFAULT_MODEL_FAMILY, TUNE_BUDGET_SECONDS
+        params = job.get("params") or {}
+        result = train_model(
+            job["training_data_path"],
+            job["model_path"],
+            progress_callback=report,
+            n_jobs=n_jobs,
+            mode=params.get("mode", TRAINING_MODE),
+            model_family=params.get("model_family", DEFAULT_MODEL_FAMILY),
+            tune_budget_seconds=params.get("tune_budget_seconds", TUNE_BUDGET_SECONDS)
+        )
+
+        from model_suite import train_model_suite, MODEL_SUITE_DIR
+        if MODEL_SUITE_DIR and result.get("status") == "completed":
+            from training_store import open_training_data
+            report({"progress": 1.0, "stage": "model_suite"})
+            # Only the specialists of categories touched by the coalesced uploads are refit
+            try:
+                suite = train_model_suite(
+                    open_training_data(job["training_data_path"]).read(), MODEL_SUITE_DIR,
+                    categories=params.get("categories") or None,
+                    model_family=params.get("model_family", DEFAULT_MODEL_FAMILY),
+                    max_workers=n_jobs if n_jobs > 0 else None
+                )
+                result["suite_version"] = suite["suite_version"]
+                result["suite_retrained_categories"] = suite["retrained_categories"]
+            except Exception as e:
+                # The main model is already saved; the previous suite keeps serving
+                logger.error(f"Model suite training for job {job_id} failed: {str(e)}")
+                logger.error(traceback.format_exc())
+                result["suite_error"] = str(e)
+
+        queue.finish(job_id, result)
+        logger.info(f"Training job {job_id} finished: {result.get('status')}")
+    except Exception as e:
+        logger.error(f"Training job {job_id} failed: {str(e)}")
+        logger.error(traceback.format_exc())
+        queue.fail(job_id, str(e))
+
+def compact_training_store():
+    """Merge small segments of the training data store, if it is enabled."""
+    from training_store import TrainingDataStore, TRAINING_STORE_DIR
+    if not TRAINING_STORE_DIR or not os.path.isdir(TRAINING_STORE_DIR):
+        return
+    try:
+        TrainingDataStore(TRAINING_STORE_DIR).compact()
+    except Exception as e:
+        logger.warning(f"Training store compaction failed: {str(e)}")
+
+def work(queue: TrainingJobQueue, n_jobs: int, once: bool = False):
+    """Main worker loop: claim queued jobs and supervise their child processes."""
+    pid = os.getpid()
+    queue.register_worker(pid)
+    queue.requeue_orphaned(worker_pid=pid, max_age_seconds=HEARTBEAT_MAX_AGE_SECONDS)
+    scheduler = RetrainScheduler(queue)
+    ctx = multiprocessing.get_context("spawn")
+    last_compaction = last_orphan_check = time.monotonic()
+
+    try:
+        while True:
+            queue.worker_heartbeat(pid)
+            scheduler.tick()
+            job = queue.claim_next(pid)
+
+            if job is None:
+                if once and not queue.list_jobs(limit=1, status=JOB_QUEUED):
+                    return
+                if time.monotonic() - last_orphan_check >= ORPHAN_CHECK_INTERVAL_SECONDS:
+                    # A worker that crashed after startup leaves its job running forever
+                    queue.requeue_orphaned(worker_pid=pid, max_age_seconds=HEARTBEAT_MAX_AGE_SECONDS)
+                    last_orphan_check = time.monotonic()
+                if COMPACT_INTERVAL_SECONDS and time.monotonic() - last_compaction >= COMPACT_INTERVAL_SECONDS:
+                    compact_training_store()
+                    last_compaction = time.monotonic()
+                time.sleep(POLL_INTERVAL_SECONDS)
+                continue
+
+            logger.info(f"Starting training job {job['id']}")
+            child = ctx.Process(target=run_job, args=(job, queue.db_path, n_jobs))
+            child.start()
+            while child.is_alive():
+                queue.worker_heartbeat(pid)
+                child.join(POLL_INTERVAL_SECONDS)
+
+            current = queue.get(job["id"])
+            if current and current["status"] == JOB_RUNNING:
+                # The child died without recording a result (e.g. killed for memory)
+                queue.fail(job["id"], f"Training process exited with code {child.exitcode}")
+
+            if once:
+                return
+    finally:
+        queue.unregister_worker(pid)
+
+def ensure_worker_running(db_path: str = TRAINING_JOBS_DB) -> bool:
+    """
+    Start a detached training worker if none is alive.
+    Used by the API on startup; disable with TRAINING_WORKER_AUTOSTART=false.
+    Returns True if a new worker was spawned.
+    """
+    if os.getenv("TRAINING_WORKER_AUTOSTART", "true").lower() not in ("1", "true", "yes"):
+        return False
+
+    queue = TrainingJobQueue(db_path)
+    if queue.live_worker_pids(HEARTBEAT_MAX_AGE_SECONDS):
+        return False
+
+    kwargs: Dict[str, Any] = {"cwd": BACKEND_DIR}
+    if os.name == "posix":
+        kwargs["start_new_session"] = True
+    else:
+        kwargs["creationflags"] = getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0)
+
+    subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "training_worker.py"),
+         "--db", os.path.abspath(db_path)],
+        **kwargs
+    )
+    logger.info("Started training worker process")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Surplus2Serve model training worker")
+    parser.add_argument("--db", default=TRAINING_JOBS_DB, help="Path to the training job database")
+    parser.add_argument("--cpus", type=int, default=int(os.getenv("TRAINING_WORKER_CPUS", "0")),
+                        help="Maximum CPUs used for training (0 = all)")
+    parser.add_argument("--nice", type=int, default=int(os.getenv("TRAINING_WORKER_NICE", "10")),
+                        help="Niceness increment applied to the worker (POSIX only)")
+    parser.add_argument("--once", action="store_true",
+                        help="Run the next queued job, waiting until it is due, then exit; "
+                             "exit at once if no job is queued")
+    args = parser.parse_args()
+
+    apply_resource_limits(args.cpus, args.nice)
+    n_jobs = args.cpus if args.cpus else -1
+
+    logger.info(f"Training worker started (pid={os.getpid()}, cpus={args.cpus or 'all'}, nice={args.nice})")
+    work(TrainingJobQueue(args.db), n_jobs=n_jobs, once=args.once)
+
+if __name__ == "__main__":
+    main()
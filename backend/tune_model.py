@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Time-budgeted hyperparameter search for the Surplus2Serve spoilage model.
+
+Runs successive halving over randomly sampled configurations under a
+wall-clock budget: every rung evaluates the surviving candidates on a larger
+sample of the data and keeps the best 1/eta of them. Cross-validation folds
+run in parallel, fitted preprocessors are cached with Pipeline(memory=...),
+boosted families use early stopping, and the search is warm-started from the
+last best configuration recorded in the model registry.
+
+Usage:
+    python tune_model.py --budget 300 --family hist_gradient_boosting
+"""
+
+import json
+import time
+import shutil
+import argparse
+import logging
+import tempfile
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+from joblib import Memory, Parallel, delayed
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import ParameterSampler, StratifiedKFold
+
+from utils import engineer_features
+from model_registry import ModelRegistry, MODEL_REGISTRY_PATH
+from training import (
+    build_model_pipeline, holdout_mask, save_model_atomically, DEFAULT_MODEL_FAMILY
+)
+from training_store import open_training_data
+
+logger = logging.getLogger(__name__)
+
+SEARCH_SPACES = {
+    'random_forest': {
+        'n_estimators': [50, 100, 150, 250],
+        'max_depth': [8, 12, 15, 20, None],
+        'min_samples_split': [2, 5, 10],
+        'min_samples_leaf': [1, 2, 4],
+        'max_features': ['sqrt', 0.3, 0.5],
+    },
+    'hist_gradient_boosting': {
+        'learning_rate': [0.03, 0.05, 0.1, 0.2],
+        'max_iter': [200, 400, 800],
+        'max_leaf_nodes': [15, 31, 63],
+        'min_samples_leaf': [10, 20, 40],
+        'l2_regularization': [0.0, 0.1, 1.0],
+    },
+    'hist_gradient_boosting_native': {
+        'learning_rate': [0.03, 0.05, 0.1, 0.2],
+        'max_iter': [200, 400, 800],
+        'max_leaf_nodes': [15, 31, 63],
+        'min_samples_leaf': [10, 20, 40],
+        'l2_regularization': [0.0, 0.1, 1.0],
+    },
+    'xgboost': {
+        'learning_rate': [0.03, 0.05, 0.1, 0.2],
+        'n_estimators': [200, 400, 800],
+        'max_depth': [4, 6, 8],
+        'subsample': [0.7, 0.85, 1.0],
+        'colsample_bytree': [0.6, 0.8, 1.0],
+        'min_child_weight': [1.0, 3.0, 5.0],
+    },
+}
+
+# Rows used for the single-row latency measurement of each candidate
+LATENCY_SAMPLE_ROWS = 50
+
+def _measure_latency_ms(pipeline, X: pd.DataFrame) -> float:
+    """Median latency of single-row predict_proba calls in milliseconds."""
+    timings = []
+    for i in range(min(LATENCY_SAMPLE_ROWS, len(X))):
+        row = X.iloc[i:i + 1]
+        start = time.perf_counter()
+        pipeline.predict_proba(row)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+def _evaluate_fold(model_family: str, params: Dict[str, Any], X: pd.DataFrame, y: pd.Series,
+                   train_idx: np.ndarray, val_idx: np.ndarray, cache_dir: str,
+                   measure_latency: bool) -> Dict[str, Any]:
+    pipeline = build_model_pipeline(X, n_jobs=1, model_family=model_family,
+                                    classifier_params=params,
+                                    memory=Memory(cache_dir, verbose=0))
+    start = time.perf_counter()
+    pipeline.fit(X.iloc[train_idx], y.iloc[train_idx])
+    fit_seconds = time.perf_counter() - start
+    accuracy = accuracy_score(y.iloc[val_idx], pipeline.predict(X.iloc[val_idx]))
+    return {
+        "accuracy": accuracy,
+        "fit_seconds": fit_seconds,
+        "latency_ms": _measure_latency_ms(pipeline, X.iloc[val_idx]) if measure_latency else None
+    }
+
+def _sample_candidates(model_family: str, n_candidates: int,
+                       warm_start: Optional[Dict[str, Any]], random_state: int) -> List[Dict[str, Any]]:
+    space = SEARCH_SPACES[model_family]
+    candidates = [dict(params) for params in ParameterSampler(space, n_iter=n_candidates,
+                                                              random_state=random_state)]
+    if warm_start:
+        # The previous best configuration always competes in the first rung
+        candidates = [dict(warm_start)] + [c for c in candidates if c != warm_start][:n_candidates - 1]
+    return candidates
+
+def successive_halving_search(X: pd.DataFrame, y: pd.Series,
+                              model_family: str = DEFAULT_MODEL_FAMILY,
+                              budget_seconds: float = 300,
+                              n_candidates: int = 27,
+                              eta: int = 3,
+                              cv: int = 3,
+                              n_jobs: int = -1,
+                              warm_start: Optional[Dict[str, Any]] = None,
+                              random_state: int = 42) -> Dict[str, Any]:
+    """
+    Run successive halving under a wall-clock budget.
+
+    Returns the best parameters and a leaderboard with, for every candidate,
+    the rung it reached, its cross-validated accuracy on that rung, mean fit
+    time and single-row prediction latency.
+    """
+    if model_family not in SEARCH_SPACES:
+        raise ValueError(f"Unknown model family: {model_family}")
+
+    started = time.monotonic()
+    deadline = started + budget_seconds
+    candidates = _sample_candidates(model_family, n_candidates, warm_start, random_state)
+    n_rungs = max(1, int(np.floor(np.log(len(candidates)) / np.log(eta))) + 1)
+    min_rows = max(cv * 50, int(len(X) / eta ** (n_rungs - 1)))
+
+    rng = np.random.RandomState(random_state)
+    order = rng.permutation(len(X))
+    results: Dict[int, Dict[str, Any]] = {}
+    survivors = list(range(len(candidates)))
+    cache_dir = tempfile.mkdtemp(prefix="s2s_tuning_cache_")
+    budget_exhausted = False
+
+    try:
+        with Parallel(n_jobs=n_jobs) as parallel:
+            for rung in range(n_rungs):
+                n_rows = len(X) if rung == n_rungs - 1 else min(len(X), min_rows * eta ** rung)
+                rows = np.sort(order[:n_rows])
+                X_rung, y_rung = X.iloc[rows], y.iloc[rows]
+                folds = list(StratifiedKFold(n_splits=cv, shuffle=True,
+                                             random_state=random_state).split(X_rung, y_rung))
+                logger.info(f"Rung {rung}: {len(survivors)} candidate(s) on {n_rows} rows")
+
+                rung_scores = {}
+                for idx in survivors:
+                    if time.monotonic() >= deadline:
+                        budget_exhausted = True
+                        break
+                    fold_results = parallel(
+                        delayed(_evaluate_fold)(model_family, candidates[idx], X_rung, y_rung,
+                                                train_idx, val_idx, cache_dir, fold == 0)
+                        for fold, (train_idx, val_idx) in enumerate(folds)
+                    )
+                    score = float(np.mean([r["accuracy"] for r in fold_results]))
+                    rung_scores[idx] = score
+                    results[idx] = {
+                        "params": candidates[idx],
+                        "rung": rung,
+                        "rows": n_rows,
+                        "cv_accuracy": score,
+                        "fit_seconds": float(np.mean([r["fit_seconds"] for r in fold_results])),
+                        "latency_ms": fold_results[0]["latency_ms"],
+                        "warm_start": bool(warm_start) and candidates[idx] == warm_start
+                    }
+
+                if budget_exhausted or not rung_scores:
+                    break
+                ranked = sorted(rung_scores, key=rung_scores.get, reverse=True)
+                survivors = ranked[:max(1, len(ranked) // eta)]
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if not results:
+        raise RuntimeError("Search budget exhausted before any candidate was evaluated")
+
+    leaderboard = sorted(results.values(), key=lambda r: (r["rung"], r["cv_accuracy"]), reverse=True)
+    for position, entry in enumerate(leaderboard, start=1):
+        entry["rank"] = position
+
+    return {
+        "model_family": model_family,
+        "best_params": leaderboard[0]["params"],
+        "best_cv_accuracy": leaderboard[0]["cv_accuracy"],
+        "budget_seconds": budget_seconds,
+        "elapsed_seconds": time.monotonic() - started,
+        "budget_exhausted": budget_exhausted,
+        "candidates_evaluated": len(results),
+        "leaderboard": leaderboard
+    }
+
+def tune_and_train(data: pd.DataFrame, model_path: Optional[str] = None,
+                   model_family: str = DEFAULT_MODEL_FAMILY,
+                   budget_seconds: float = 300,
+                   n_jobs: int = -1,
+                   registry_path: str = MODEL_REGISTRY_PATH,
+                   leaderboard_path: Optional[str] = "tuning_leaderboard.json") -> Dict[str, Any]:
+    """
+    Search hyperparameters on the training split, refit the best configuration
+    and evaluate it on the holdout. Saves the model and registers the tuned
+    configuration when model_path is given.
+    """
+    registry = ModelRegistry(registry_path)
+    X = engineer_features(data.drop(['Spoilage_Risk'], axis=1, errors='ignore'))
+    y = data['Spoilage_Risk']
+    test_mask = holdout_mask(0, len(data))
+    X_train, X_test = X[~test_mask], X[test_mask]
+    y_train, y_test = y[~test_mask], y[test_mask]
+
+    search = successive_halving_search(
+        X_train, y_train, model_family=model_family, budget_seconds=budget_seconds,
+        n_jobs=n_jobs, warm_start=registry.last_best_params(model_family)
+    )
+
+    best_pipeline = build_model_pipeline(X_train, n_jobs=n_jobs, model_family=model_family,
+                                         classifier_params=search["best_params"])
+    best_pipeline.fit(X_train, y_train)
+    holdout_accuracy = accuracy_score(y_test, best_pipeline.predict(X_test))
+    search["holdout_accuracy"] = float(holdout_accuracy)
+    search["holdout_latency_ms"] = _measure_latency_ms(best_pipeline, X_test)
+    logger.info(f"Best {model_family} configuration: {search['best_params']} "
+                f"(holdout accuracy {holdout_accuracy:.4f})")
+
+    if leaderboard_path:
+        with open(leaderboard_path, "w") as f:
+            json.dump(search, f, indent=2, default=str)
+
+    if model_path:
+        entry = registry.register({
+            "model_path": model_path,
+            "mode": "tuned",
+            "model_family": model_family,
+            "rows_total": len(data),
+            "rows_trained": len(X_train),
+            "data_offset": len(data),
+            "best_params": search["best_params"],
+            "metrics": {
+                "accuracy": float(holdout_accuracy),
+                "cv_accuracy": search["best_cv_accuracy"],
+                "latency_ms": search["holdout_latency_ms"],
+                "train_rows": len(X_train),
+                "test_rows": len(X_test),
+                "evaluated_on": "all_rows"
+            },
+            "incremental_updates": 0
+        })
+        best_pipeline.version = entry["version"]
+        save_model_atomically(best_pipeline, model_path)
+        search["model_version"] = entry["version"]
+
+    search["model"] = best_pipeline
+    return search
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Time-budgeted hyperparameter search")
+    parser.add_argument("--data", default="training_data.csv",
+                        help="Training data path, read through the training store")
+    parser.add_argument("--family", default=DEFAULT_MODEL_FAMILY, choices=sorted(SEARCH_SPACES))
+    parser.add_argument("--budget", type=float, default=300, help="Wall-clock budget in seconds")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Parallel CV folds")
+    parser.add_argument("--output", default=None, help="Save the best model to this path")
+    parser.add_argument("--leaderboard", default="tuning_leaderboard.json",
+                        help="Where to write the latency-vs-accuracy leaderboard")
+    args = parser.parse_args()
+
+    data = open_training_data(args.data).read()
+    search = tune_and_train(data, model_path=args.output, model_family=args.family,
+                            budget_seconds=args.budget, n_jobs=args.n_jobs,
+                            leaderboard_path=args.leaderboard)
+
+    print(f"\n{'Rank':<5} {'Rung':<5} {'Rows':<7} {'CV acc':<8} {'Latency ms':<11} Params")
+    for entry in search["leaderboard"][:10]:
+        latency = f"{entry['latency_ms']:.2f}" if entry["latency_ms"] is not None else "-"
+        print(f"{entry['rank']:<5} {entry['rung']:<5} {entry['rows']:<7} "
+              f"{entry['cv_accuracy']:<8.4f} {latency:<11} {entry['params']}")
+    print(f"\nBest holdout accuracy: {search['holdout_accuracy']:.4f} "
+          f"({search['candidates_evaluated']} candidates in {search['elapsed_seconds']:.0f}s)")
+    if args.leaderboard:
+        print(f"Leaderboard written to {args.leaderboard}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Streaming ingestion of training data uploads for Surplus2Serve.
+
+Uploaded CSVs are parsed in chunks of UPLOAD_CHUNK_ROWS rows straight from
+the spooled upload file (Starlette keeps uploads above 1 MB on disk), so
+memory use is bounded by the chunk size, not by the upload size. gzip
+(.csv.gz) and zstd (.csv.zst, needs the optional zstandard package) uploads
+are decompressed on the fly.
+
+By default the whole upload is validated first, and only stored, in a second
+pass over the file, if every chunk passes; the first chunk with invalid rows
+rejects the upload and nothing is stored. In quarantine mode each chunk is
+validated and stored in one pass: the valid rows are appended to the training
+data and the invalid ones are written to a quarantine CSV together with the
+rules they failed (see upload_validation.py).
+
+ingest_upload blocks; the API runs it in a worker thread so the event loop
+stays responsive.
+"""
+
+import os
+import gzip
+import shutil
+import logging
+import tempfile
+from typing import Dict, Any, BinaryIO, Iterator
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Rows parsed, validated and stored at a time
+UPLOAD_CHUNK_ROWS = int(os.getenv("UPLOAD_CHUNK_ROWS", "50000"))
+
+UPLOAD_SUFFIXES = ('.csv', '.csv.gz', '.csv.gzip', '.csv.zst', '.csv.zstd')
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+REPORT_COUNTS = ['rows_received', 'invalid_rows', 'duplicates_in_upload', 'duplicates_existing', 'rows_added']
+
+class UploadFormatError(ValueError):
+    """The upload could not be decompressed or parsed as CSV."""
+
+class UploadValidationError(ValueError):
+    """
+    A chunk of the upload failed validation; nothing was stored.
+    report holds the rows read so far and the validation report.
+    """
+
+    def __init__(self, message: str, report: Dict[str, Any]):
+        super().__init__(message)
+        self.report = report
+
+def is_supported_upload(filename: str) -> bool:
+    return bool(filename) and filename.lower().endswith(UPLOAD_SUFFIXES)
+
+def _compression(fileobj: BinaryIO, filename: str) -> str:
+    name = filename.lower()
+    if name.endswith(('.gz', '.gzip')):
+        return 'gzip'
+    if name.endswith(('.zst', '.zstd')):
+        return 'zstd'
+    # Compressed uploads with a plain .csv name are recognised by their magic bytes
+    if fileobj.seekable():
+        head = fileobj.read(4)
+        fileobj.seek(0)
+        if head.startswith(GZIP_MAGIC):
+            return 'gzip'
+        if head.startswith(ZSTD_MAGIC):
+            return 'zstd'
+    return 'none'
+
+def open_upload(fileobj: BinaryIO, filename: str) -> BinaryIO:
+    """Wrap the upload in a decompressing stream if needed."""
+    compression = _compression(fileobj, filename)
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise UploadFormatError("zstd uploads need the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+    return fileobj
+
+def iter_upload_chunks(fileobj: BinaryIO, filename: str,
+                       chunk_rows: int = UPLOAD_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yield the upload as DataFrames of at most chunk_rows rows."""
+    stream = open_upload(fileobj, filename)
+    try:
+        for chunk in pd.read_csv(stream, chunksize=chunk_rows, encoding='utf-8'):
+            yield chunk
+    except (UnicodeDecodeError, pd.errors.ParserError, pd.errors.EmptyDataError, OSError, EOFError) as e:
+        raise UploadFormatError(f"Invalid CSV format: {str(e)}")
+
+def _rewindable(fileobj: BinaryIO) -> BinaryIO:
+    """The upload itself if it can be read twice, otherwise a temporary copy."""
+    if fileobj.seekable():
+        return fileobj
+    copy = tempfile.TemporaryFile()
+    shutil.copyfileobj(fileobj, copy)
+    copy.seek(0)
+    return copy
+
+def ingest_upload(fileobj: BinaryIO, filename: str, training_data_path: str,
+                  chunk_rows: int = UPLOAD_CHUNK_ROWS, quarantine: bool = False) -> Dict[str, Any]:
+    """
+    Validate and store an upload chunk by chunk.
+    Returns the summed deduplication report, the validation report, the
+    commodity categories seen and, in quarantine mode, the quarantine file.
+    """
+    from utils import save_training_data
+    from model_suite import upload_categories
+    from upload_validation import validate_rows, merge_reports, quarantine_rows, quarantine_path
+
+    report: Dict[str, Any] = {key: 0 for key in REPORT_COUNTS}
+    state = {"categories": set(), "chunks": 0, "rows_read": 0, "rows_quarantined": 0,
+             "validation": None, "quarantine_file": None}
+
+    # First pass in the default mode: reject the upload before anything is stored
+    if not quarantine:
+        fileobj = _rewindable(fileobj)
+        start = fileobj.tell()
+        for chunk in iter_upload_chunks(fileobj, filename, chunk_rows):
+            row_offset = state["rows_read"]
+            state["rows_read"] += len(chunk)
+            _, chunk_validation, _ = validate_rows(chunk, row_offset)
+            state["validation"] = merge_reports(state["validation"], chunk_validation)
+            if not chunk_validation["is_valid"]:
+                message = chunk_validation["error"]
+                if row_offset:
+                    message = f"Rows {row_offset + 1}-{state['rows_read']}: {message}"
+                raise UploadValidationError(message, _finish(report, state))
+        if not state["rows_read"]:
+            raise UploadFormatError("Upload contains no data rows")
+        fileobj.seek(start)
+
+    # Second pass (or the only one, in quarantine mode): store the rows
+    rows_read = 0
+    for chunk in iter_upload_chunks(fileobj, filename, chunk_rows):
+        row_offset = rows_read
+        rows_read += len(chunk)
+        if quarantine:
+            valid, chunk_validation, reasons = validate_rows(chunk, row_offset)
+            state["validation"] = merge_reports(state["validation"], chunk_validation)
+            if not chunk_validation["is_valid"]:
+                # Without the required columns nothing can be stored
+                if chunk_validation["errors"][0]["rule"] == "schema.missing_columns":
+                    state["rows_read"] = rows_read
+                    raise UploadValidationError(chunk_validation["error"], _finish(report, state))
+                if state["quarantine_file"] is None:
+                    state["quarantine_file"] = quarantine_path(filename)
+                quarantine_rows(chunk, valid, reasons, row_offset, state["quarantine_file"])
+                state["rows_quarantined"] += int((~valid).sum())
+                chunk = chunk[valid]
+
+        if len(chunk):
+            chunk_report = save_training_data(chunk, training_data_path)
+            for key in REPORT_COUNTS:
+                report[key] += chunk_report[key]
+            state["categories"].update(upload_categories(chunk))
+        state["chunks"] += 1
+    state["rows_read"] = rows_read
+
+    if not state["rows_read"]:
+        raise UploadFormatError("Upload contains no data rows")
+    if state["rows_quarantined"]:
+        logger.warning(f"Quarantined {state['rows_quarantined']} invalid uploaded rows in {state['quarantine_file']}")
+    logger.info(f"Ingested {state['rows_read']} uploaded rows in {state['chunks']} chunk(s)")
+    return _finish(report, state)
+
+def _finish(report: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(report,
+                rows_received=state["rows_read"],
+                rows_quarantined=state["rows_quarantined"],
+                quarantine_file=state["quarantine_file"],
+                validation=state["validation"],
+                categories=sorted(state["categories"]),
+                chunks=state["chunks"])
@@ -0,0 +1,216 @@
+"""
+Declarative validation of training data uploads for Surplus2Serve.
+
+UPLOAD_SCHEMA describes every upload column once: whether it is required,
+its kind (number, integer or choice) and its allowed values. Numeric ranges
+and the storage / packaging choices come from PredictionRequest, so uploads
+are held to the same limits as prediction requests.
+
+All rules are evaluated with vectorized masks (string columns are checked
+per distinct value, then broadcast), so validation runs at millions of rows
+per second. Instead of stopping at the first problem, validate_rows returns
+an aggregated report with the count and the first row numbers for every rule
+that failed.
+"""
+
+import os
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from models import PredictionRequest, VALID_STORAGE_TYPES, VALID_PACKAGING_QUALITY
+from dataset_loader import STORAGE_TYPE_ALIASES
+from utils import enhanced_commodities
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Where rows rejected in quarantine mode are kept for inspection
+UPLOAD_QUARANTINE_DIR = os.getenv("UPLOAD_QUARANTINE_DIR", os.path.join(BACKEND_DIR, "quarantine"))
+# Row numbers listed per failed rule in a report
+MAX_REPORTED_ROWS = 100
+
+def _bounds(field: str) -> Dict[str, float]:
+    """ge/le limits declared on a PredictionRequest field."""
+    bounds = {}
+    for constraint in PredictionRequest.model_fields[field].metadata:
+        if hasattr(constraint, 'ge'):
+            bounds['min'] = constraint.ge
+        if hasattr(constraint, 'le'):
+            bounds['max'] = constraint.le
+    return bounds
+
+COMMODITY_NAMES = sorted({name for names in enhanced_commodities.values() for name in names})
+
+UPLOAD_SCHEMA: Dict[str, Dict[str, Any]] = {
+    'Temperature': {'required': True, 'kind': 'number', **_bounds('Temperature')},
+    'Humidity': {'required': True, 'kind': 'number', **_bounds('Humidity')},
+    'Storage_Type': {'required': True, 'kind': 'choice', 'choices': VALID_STORAGE_TYPES,
+                     'aliases': STORAGE_TYPE_ALIASES},
+    'Days_Since_Harvest': {'required': True, 'kind': 'integer', **_bounds('Days_Since_Harvest')},
+    'Transport_Duration': {'required': True, 'kind': 'number', **_bounds('Transport_Duration')},
+    'Packaging_Quality': {'required': True, 'kind': 'choice', 'choices': VALID_PACKAGING_QUALITY},
+    'Month_num': {'required': True, 'kind': 'integer', **_bounds('Month_num')},
+    'Commodity_name': {'required': True, 'kind': 'commodity'},
+    'Commodity_Category': {'required': False, 'kind': 'choice', 'choices': list(enhanced_commodities),
+                           'case_sensitive': True},
+    'Ethylene_Level': {'required': False, 'kind': 'number', **_bounds('Ethylene_Level')},
+    'Spoilage_Risk': {'required': True, 'kind': 'integer', 'min': 0, 'max': 2},
+}
+
+REQUIRED_UPLOAD_COLUMNS = [col for col, spec in UPLOAD_SCHEMA.items() if spec['required']]
+
+def _normalize(values: pd.Series, spec: Dict[str, Any]) -> pd.Series:
+    values = values.astype(str).str.strip()
+    if not spec.get('case_sensitive'):
+        values = values.str.lower()
+    return values.replace(spec.get('aliases', {}))
+
+def _choice_mask(factorized: Tuple[np.ndarray, Any], spec: Dict[str, Any]) -> np.ndarray:
+    """True where a non-null value is not an allowed choice, checked once per distinct value."""
+    codes, uniques = factorized
+    if not len(uniques):
+        return np.zeros(len(codes), dtype=bool)
+    unique_invalid = ~_normalize(pd.Series(uniques), spec).isin(spec['choices']).to_numpy()
+    return np.where(codes >= 0, unique_invalid[np.maximum(codes, 0)], False)
+
+def _rules(data: pd.DataFrame) -> List[Tuple[str, str, str, np.ndarray]]:
+    """Evaluate the schema; returns (rule, column, message, failing rows mask) per failed rule."""
+    failed = []
+    factorized: Dict[str, Tuple[np.ndarray, Any]] = {}
+
+    def check(rule: str, column: str, message: str, mask: np.ndarray):
+        if mask.any():
+            failed.append((rule, column, message, mask))
+
+    def factorize(column: str) -> Tuple[np.ndarray, Any]:
+        # String columns are handled through their codes; null values get code -1
+        if column not in factorized:
+            factorized[column] = pd.factorize(data[column], use_na_sentinel=True)
+        return factorized[column]
+
+    for column, spec in UPLOAD_SCHEMA.items():
+        if column not in data.columns:
+            continue
+        values = data[column]
+        numeric = spec['kind'] in ('number', 'integer')
+        missing = values.isna().to_numpy() if numeric else factorize(column)[0] < 0
+        if spec['required']:
+            check(f"{column}.missing", column, f"{column} is required", missing)
+
+        if numeric:
+            numbers = values if pd.api.types.is_numeric_dtype(values) else pd.to_numeric(values, errors='coerce')
+            numbers = numbers.to_numpy(dtype=np.float64, na_value=np.nan)
+            invalid_number = np.isnan(numbers) & ~missing
+            check(f"{column}.type", column, f"{column} must be numeric", invalid_number)
+            with np.errstate(invalid='ignore'):
+                if spec['kind'] == 'integer':
+                    check(f"{column}.integer", column, f"{column} must be a whole number",
+                          np.isfinite(numbers) & (np.mod(numbers, 1) != 0))
+                below = numbers < spec['min'] if 'min' in spec else np.zeros(len(numbers), dtype=bool)
+                above = numbers > spec['max'] if 'max' in spec else np.zeros(len(numbers), dtype=bool)
+            check(f"{column}.range", column,
+                  f"{column} must be between {spec.get('min', '-inf')} and {spec.get('max', 'inf')}",
+                  below | above)
+
+        elif spec['kind'] == 'choice':
+            check(f"{column}.choice", column, f"{column} must be one of: {spec['choices']}",
+                  _choice_mask(factorize(column), spec))
+
+        elif spec['kind'] == 'commodity':
+            # Commodities outside the catalog are fine as long as a valid category is given
+            unknown = _choice_mask(factorize(column), {'choices': COMMODITY_NAMES, 'case_sensitive': True})
+            if 'Commodity_Category' in data.columns:
+                category = factorize('Commodity_Category')
+                unknown &= (category[0] < 0) | _choice_mask(category, UPLOAD_SCHEMA['Commodity_Category'])
+            check(f"{column}.unknown", column,
+                  f"{column} is not a known commodity and no valid Commodity_Category is given",
+                  unknown)
+    return failed
+
+def validate_rows(data: pd.DataFrame, row_offset: int = 0) -> Tuple[np.ndarray, Dict[str, Any], pd.Series]:
+    """
+    Validate an upload (or one chunk of it, starting at data row row_offset).
+    Returns (mask of valid rows, report, failed rule names of each invalid row).
+    Row numbers in the report are 1-based data rows of the whole upload.
+    """
+    n_rows = len(data)
+    missing_columns = [col for col in REQUIRED_UPLOAD_COLUMNS if col not in data.columns]
+    if missing_columns:
+        message = f"Missing required columns: {missing_columns}"
+        report = {
+            "is_valid": False,
+            "error": message,
+            "rows_checked": n_rows,
+            "invalid_rows": n_rows,
+            "errors": [{"rule": "schema.missing_columns", "column": None, "message": message,
+                        "count": n_rows, "rows": []}]
+        }
+        return np.zeros(n_rows, dtype=bool), report, pd.Series("schema.missing_columns", index=data.index)
+
+    failed = _rules(data)
+    invalid = np.zeros(n_rows, dtype=bool)
+    reasons = np.full(n_rows, "", dtype=object)
+    errors = []
+    for rule, column, message, mask in failed:
+        invalid |= mask
+        reasons[mask] += np.where(reasons[mask] == "", rule, ";" + rule)
+        errors.append({
+            "rule": rule,
+            "column": column,
+            "message": message,
+            "count": int(mask.sum()),
+            "rows": (np.flatnonzero(mask)[:MAX_REPORTED_ROWS] + row_offset + 1).tolist()
+        })
+
+    report = {
+        "is_valid": not invalid.any(),
+        "error": errors[0]["message"] if errors else None,
+        "rows_checked": n_rows,
+        "invalid_rows": int(invalid.sum()),
+        "errors": errors
+    }
+    return ~invalid, report, pd.Series(reasons, index=data.index)[invalid]
+
+def merge_reports(total: Optional[Dict[str, Any]], report: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine the reports of consecutive chunks of one upload."""
+    if total is None:
+        return report
+    errors = {error["rule"]: dict(error, rows=list(error["rows"])) for error in total["errors"]}
+    for error in report["errors"]:
+        if error["rule"] in errors:
+            merged = errors[error["rule"]]
+            merged["count"] += error["count"]
+            merged["rows"] = (merged["rows"] + error["rows"])[:MAX_REPORTED_ROWS]
+        else:
+            errors[error["rule"]] = dict(error)
+    merged_errors = list(errors.values())
+    return {
+        "is_valid": total["is_valid"] and report["is_valid"],
+        "error": merged_errors[0]["message"] if merged_errors else None,
+        "rows_checked": total["rows_checked"] + report["rows_checked"],
+        "invalid_rows": total["invalid_rows"] + report["invalid_rows"],
+        "errors": merged_errors
+    }
+
+def quarantine_path(filename: str, quarantine_dir: str = UPLOAD_QUARANTINE_DIR) -> str:
+    """New quarantine file for an upload."""
+    stem = os.path.basename(filename or "upload").split('.')[0] or "upload"
+    name = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}-{stem}.csv"
+    return os.path.join(quarantine_dir, name)
+
+def quarantine_rows(data: pd.DataFrame, valid: np.ndarray, reasons: pd.Series, row_offset: int, path: str):
+    """Append the invalid rows, with their upload row number and failed rules, to path."""
+    invalid = ~valid
+    if not invalid.any():
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rows = data[invalid].copy()
+    rows.insert(0, "_row", np.flatnonzero(invalid) + row_offset + 1)
+    rows["_errors"] = reasons.to_numpy()
+    rows.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
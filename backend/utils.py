@@ -5,17 +5,9 @@ Includes model loading, feature engineering, data preprocessing, and retraining
 
 import pandas as pd
 import numpy as np
-import joblib
 import os
 import logging
-from typing import Dict, Any, List, Tuple
-from datetime import datetime
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, classification_report
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
+from typing import Dict, Any, List, Optional
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -166,9 +158,10 @@ def load_model(model_path: str):
             logger.warning(f"Model file not found: {model_path}")
             return create_fallback_model()
         
-        # Try to load the existing model
+        # Try to load the existing model (compressed or memory-mapped, see artifact_compression.py)
         try:
-            model = joblib.load(model_path)
+            from artifact_compression import load_artifact
+            model = load_artifact(model_path)
             logger.info(f"Model loaded successfully from {model_path}")
             return model
         except (AttributeError, ImportError, ValueError) as e:
@@ -209,101 +202,154 @@ def get_perishability_score(category: str) -> int:
     }
     return perishability_map.get(category, 3)
 
-def engineer_features(df: pd.DataFrame) -> pd.DataFrame:
+# Derived features that are computed from other derived features
+FEATURE_DEPENDENCIES = {
+    'Environmental_Stress': ['Temp_Extreme', 'Humidity_Extreme', 'Is_Monsoon'],
+    'Is_Highly_Perishable': ['Commodity_Perishability'],
+    'Degradation_Rate': ['Commodity_Perishability'],
+}
+
+def required_features(features: Optional[List[str]]) -> Optional[set]:
+    """The requested features plus the derived features they are computed from (None: all)."""
+    if features is None:
+        return None
+    required = set()
+    pending = list(features)
+    while pending:
+        feature = pending.pop()
+        if feature not in required:
+            required.add(feature)
+            pending.extend(FEATURE_DEPENDENCIES.get(feature, []))
+    return required
+
+def engineer_features(df: pd.DataFrame, copy: bool = True,
+                      features: Optional[List[str]] = None) -> pd.DataFrame:
     """
     Apply feature engineering to the input data.
     Based on your notebook's feature engineering logic.
+    Pass copy=False to add the features to df in place (e.g. for chunks
+    that are discarded afterwards). Pass features to compute only those
+    derived features (and what they depend on), e.g. the feature set a
+    pruned model was trained on.
     """
-    df_engineered = df.copy()
+    df_engineered = df.copy() if copy else df
+    required = required_features(features)
+
+    def want(feature: str) -> bool:
+        return required is None or feature in required
     
     # 1. Temperature-based features
-    df_engineered['Temp_Squared'] = df_engineered['Temperature'] ** 2
-    df_engineered['Temp_Category'] = pd.cut(df_engineered['Temperature'],
-                                          bins=[0, 20, 25, 30, 35, 50],
-                                          labels=['Very_Cool', 'Cool', 'Moderate', 'Warm', 'Hot'])
-    df_engineered['Temp_Extreme'] = ((df_engineered['Temperature'] < 15) |
-                                    (df_engineered['Temperature'] > 35)).astype(int)
+    if want('Temp_Squared'):
+        df_engineered['Temp_Squared'] = df_engineered['Temperature'] ** 2
+    if want('Temp_Category'):
+        df_engineered['Temp_Category'] = pd.cut(df_engineered['Temperature'],
+                                              bins=[0, 20, 25, 30, 35, 50],
+                                              labels=['Very_Cool', 'Cool', 'Moderate', 'Warm', 'Hot'])
+    if want('Temp_Extreme'):
+        df_engineered['Temp_Extreme'] = ((df_engineered['Temperature'] < 15) |
+                                        (df_engineered['Temperature'] > 35)).astype(int)
 
     # 2. Humidity-based features
-    df_engineered['Humidity_Category'] = pd.cut(df_engineered['Humidity'],
-                                               bins=[0, 60, 75, 85, 100],
-                                               labels=['Low', 'Moderate', 'High', 'Very_High'])
-    df_engineered['Humidity_Extreme'] = ((df_engineered['Humidity'] < 55) |
-                                        (df_engineered['Humidity'] > 90)).astype(int)
+    if want('Humidity_Category'):
+        df_engineered['Humidity_Category'] = pd.cut(df_engineered['Humidity'],
+                                                   bins=[0, 60, 75, 85, 100],
+                                                   labels=['Low', 'Moderate', 'High', 'Very_High'])
+    if want('Humidity_Extreme'):
+        df_engineered['Humidity_Extreme'] = ((df_engineered['Humidity'] < 55) |
+                                            (df_engineered['Humidity'] > 90)).astype(int)
 
     # 3. Heat Index (combination of temperature and humidity)
     T = df_engineered['Temperature']
     H = df_engineered['Humidity']
-    df_engineered['Heat_Index'] = (T + H) / 2 + (T * H) / 100
+    if want('Heat_Index'):
+        df_engineered['Heat_Index'] = (T + H) / 2 + (T * H) / 100
 
     # 4. Vapor Pressure Deficit (VPD) - important for plant physiology
-    saturation_vp = 0.611 * np.exp((17.27 * T) / (T + 237.3))  # kPa
-    actual_vp = saturation_vp * (H / 100)
-    df_engineered['VPD'] = saturation_vp - actual_vp
+    if want('VPD'):
+        saturation_vp = 0.611 * np.exp((17.27 * T) / (T + 237.3))  # kPa
+        actual_vp = saturation_vp * (H / 100)
+        df_engineered['VPD'] = saturation_vp - actual_vp
 
     # 5. Storage and transport interaction features
     storage_scores = {'cold_storage': 3, 'room_temperature': 2, 'open_air': 1}
     packaging_scores = {'good': 3, 'average': 2, 'poor': 1}
     
-    df_engineered['Storage_Quality_Score'] = (
-        df_engineered['Storage_Type'].map(storage_scores).fillna(1) * 
-        df_engineered['Packaging_Quality'].map(packaging_scores).fillna(1)
-    )
+    if want('Storage_Quality_Score'):
+        df_engineered['Storage_Quality_Score'] = (
+            df_engineered['Storage_Type'].map(storage_scores).astype(float).fillna(1) * 
+            df_engineered['Packaging_Quality'].map(packaging_scores).astype(float).fillna(1)
+        )
 
     # 6. Time-based features
-    df_engineered['Harvest_Freshness'] = np.where(df_engineered['Days_Since_Harvest'] <= 3, 'Fresh',
-                                                  np.where(df_engineered['Days_Since_Harvest'] <= 7, 'Moderate',
-                                                          'Old'))
+    if want('Harvest_Freshness'):
+        df_engineered['Harvest_Freshness'] = np.where(df_engineered['Days_Since_Harvest'] <= 3, 'Fresh',
+                                                      np.where(df_engineered['Days_Since_Harvest'] <= 7, 'Moderate',
+                                                              'Old'))
 
-    df_engineered['Transport_Category'] = pd.cut(df_engineered['Transport_Duration'],
-                                                bins=[0, 6, 12, 20, 72],
-                                                labels=['Short', 'Medium', 'Long', 'Very_Long'])
+    if want('Transport_Category'):
+        df_engineered['Transport_Category'] = pd.cut(df_engineered['Transport_Duration'],
+                                                    bins=[0, 6, 12, 20, 72],
+                                                    labels=['Short', 'Medium', 'Long', 'Very_Long'])
 
     # 7. Total exposure time (combining harvest time and transport)
-    df_engineered['Total_Exposure_Time'] = (df_engineered['Days_Since_Harvest'] * 24) + df_engineered['Transport_Duration']
+    if want('Total_Exposure_Time'):
+        df_engineered['Total_Exposure_Time'] = (df_engineered['Days_Since_Harvest'] * 24) + df_engineered['Transport_Duration']
 
     # 8. Seasonal features
-    df_engineered['Season'] = df_engineered['Month_num'].apply(get_season)
-    df_engineered['Is_Monsoon'] = df_engineered['Month_num'].isin([6, 7, 8, 9]).astype(int)
-    df_engineered['Is_Winter'] = df_engineered['Month_num'].isin([11, 12, 1, 2]).astype(int)
-    df_engineered['Is_Summer'] = df_engineered['Month_num'].isin([3, 4, 5]).astype(int)
+    if want('Season'):
+        df_engineered['Season'] = df_engineered['Month_num'].apply(get_season)
+    if want('Is_Monsoon'):
+        df_engineered['Is_Monsoon'] = df_engineered['Month_num'].isin([6, 7, 8, 9]).astype(int)
+    if want('Is_Winter'):
+        df_engineered['Is_Winter'] = df_engineered['Month_num'].isin([11, 12, 1, 2]).astype(int)
+    if want('Is_Summer'):
+        df_engineered['Is_Summer'] = df_engineered['Month_num'].isin([3, 4, 5]).astype(int)
 
     # 9. Commodity-specific features
-    df_engineered['Commodity_Perishability'] = df_engineered['Commodity_Category'].map(get_perishability_score)
-    df_engineered['Is_Highly_Perishable'] = (df_engineered['Commodity_Perishability'] >= 4).astype(int)
+    if want('Commodity_Perishability'):
+        df_engineered['Commodity_Perishability'] = df_engineered['Commodity_Category'].map(get_perishability_score).astype(float)
+    if want('Is_Highly_Perishable'):
+        df_engineered['Is_Highly_Perishable'] = (df_engineered['Commodity_Perishability'] >= 4).astype(int)
 
     # 10. Risk interaction features
-    df_engineered['Temp_Humidity_Risk'] = ((df_engineered['Temperature'] > 30) &
-                                          (df_engineered['Humidity'] > 75)).astype(int)
+    if want('Temp_Humidity_Risk'):
+        df_engineered['Temp_Humidity_Risk'] = ((df_engineered['Temperature'] > 30) &
+                                              (df_engineered['Humidity'] > 75)).astype(int)
 
-    df_engineered['Poor_Conditions'] = ((df_engineered['Storage_Type'] == 'open_air') &
-                                       (df_engineered['Packaging_Quality'] == 'poor')).astype(int)
+    if want('Poor_Conditions'):
+        df_engineered['Poor_Conditions'] = ((df_engineered['Storage_Type'] == 'open_air') &
+                                           (df_engineered['Packaging_Quality'] == 'poor')).astype(int)
 
-    df_engineered['High_Exposure_Risk'] = ((df_engineered['Days_Since_Harvest'] > 7) &
-                                          (df_engineered['Transport_Duration'] > 15)).astype(int)
+    if want('High_Exposure_Risk'):
+        df_engineered['High_Exposure_Risk'] = ((df_engineered['Days_Since_Harvest'] > 7) &
+                                              (df_engineered['Transport_Duration'] > 15)).astype(int)
 
     # 11. Environmental stress indicators
-    df_engineered['Environmental_Stress'] = (
-        (df_engineered['Temp_Extreme'] * 2) +
-        (df_engineered['Humidity_Extreme'] * 1) +
-        (df_engineered['Is_Monsoon'] * 1)
-    )
+    if want('Environmental_Stress'):
+        df_engineered['Environmental_Stress'] = (
+            (df_engineered['Temp_Extreme'] * 2) +
+            (df_engineered['Humidity_Extreme'] * 1) +
+            (df_engineered['Is_Monsoon'] * 1)
+        )
 
     # 12. Quality degradation rate
-    base_degradation = df_engineered['Commodity_Perishability'] / 5
-    temp_factor = np.where(df_engineered['Temperature'] > 30,
-                          1 + (df_engineered['Temperature'] - 30) * 0.1,
-                          1)
-    humidity_factor = np.where(df_engineered['Humidity'] > 75,
-                              1 + (df_engineered['Humidity'] - 75) * 0.01,
+    if want('Degradation_Rate'):
+        base_degradation = df_engineered['Commodity_Perishability'] / 5
+        temp_factor = np.where(df_engineered['Temperature'] > 30,
+                              1 + (df_engineered['Temperature'] - 30) * 0.1,
                               1)
-    storage_factor = df_engineered['Storage_Type'].map({'cold_storage': 0.5, 'room_temperature': 1.0, 'open_air': 1.5})
+        humidity_factor = np.where(df_engineered['Humidity'] > 75,
+                                  1 + (df_engineered['Humidity'] - 75) * 0.01,
+                                  1)
+        storage_factor = df_engineered['Storage_Type'].map({'cold_storage': 0.5, 'room_temperature': 1.0, 'open_air': 1.5}).astype(float)
 
-    df_engineered['Degradation_Rate'] = base_degradation * temp_factor * humidity_factor * storage_factor
+        df_engineered['Degradation_Rate'] = base_degradation * temp_factor * humidity_factor * storage_factor
 
     # 13. Polynomial features
-    df_engineered['Temp_Humidity_Interaction'] = df_engineered['Temperature'] * df_engineered['Humidity']
-    df_engineered['Days_Transport_Interaction'] = df_engineered['Days_Since_Harvest'] * df_engineered['Transport_Duration']
+    if want('Temp_Humidity_Interaction'):
+        df_engineered['Temp_Humidity_Interaction'] = df_engineered['Temperature'] * df_engineered['Humidity']
+    if want('Days_Transport_Interaction'):
+        df_engineered['Days_Transport_Interaction'] = df_engineered['Days_Since_Harvest'] * df_engineered['Transport_Duration']
 
     return df_engineered
 
@@ -330,12 +376,15 @@ def preprocess_input(input_df: pd.DataFrame, model=None) -> pd.DataFrame:
                                'Storage_Type', 'Commodity_Category']].copy()
         
         else:
-            # For trained model, apply full feature engineering
-            engineered_df = engineer_features(input_df)
+            # For trained model, apply feature engineering. A model trained with
+            # feature pruning carries its retained feature set, so only those
+            # features are computed
+            feature_set = getattr(model, 'feature_set', None)
+            engineered_df = engineer_features(input_df, features=feature_set)
             
             # Remove columns that are not needed for prediction
             # Keep only the features that were used during training
-            feature_columns = [
+            feature_columns = list(feature_set) if feature_set else [
                 'Temperature', 'Humidity', 'Days_Since_Harvest', 'Transport_Duration', 'Month_num',
                 'Storage_Type', 'Packaging_Quality', 'Commodity_name', 'Commodity_Category',
                 'Temp_Squared', 'Heat_Index', 'VPD', 'Storage_Quality_Score', 'Total_Exposure_Time',
@@ -357,62 +406,39 @@ def preprocess_input(input_df: pd.DataFrame, model=None) -> pd.DataFrame:
         raise
 
 def validate_csv_data(data: pd.DataFrame) -> Dict[str, Any]:
-    """Validate uploaded CSV data structure."""
-    required_columns = [
-        'Temperature', 'Humidity', 'Storage_Type', 'Days_Since_Harvest',
-        'Transport_Duration', 'Packaging_Quality', 'Month_num', 'Commodity_name',
-        'Spoilage_Risk'
-    ]
-    
-    missing_columns = [col for col in required_columns if col not in data.columns]
-    
-    if missing_columns:
-        return {
-            "is_valid": False,
-            "error": f"Missing required columns: {missing_columns}"
-        }
+    """
+    Validate uploaded CSV data against the upload schema (see upload_validation.py).
+    Returns is_valid, the first error message and the per-rule error report.
+    """
+    from upload_validation import validate_rows
     
-    # Check data types and ranges
     try:
-        # Temperature should be numeric and reasonable
-        if not pd.api.types.is_numeric_dtype(data['Temperature']):
-            return {"is_valid": False, "error": "Temperature must be numeric"}
-        
-        # Humidity should be between 0-100
-        if not all(0 <= h <= 100 for h in data['Humidity']):
-            return {"is_valid": False, "error": "Humidity must be between 0-100"}
-        
-        # Spoilage_Risk should be 0, 1, or 2
-        if not all(risk in [0, 1, 2] for risk in data['Spoilage_Risk']):
-            return {"is_valid": False, "error": "Spoilage_Risk must be 0, 1, or 2"}
-        
-        return {"is_valid": True, "error": None}
+        _, report, _ = validate_rows(data)
+        return report
         
     except Exception as e:
         return {"is_valid": False, "error": f"Data validation error: {str(e)}"}
 
-def save_training_data(new_data: pd.DataFrame, training_data_path: str) -> int:
-    """Save new training data to the training dataset."""
+def save_training_data(new_data: pd.DataFrame, training_data_path: str) -> Dict[str, int]:
+    """
+    Save new training data to the training dataset.
+    Uploads go to the append-only segment store (see training_store.py), or to
+    the CSV at training_data_path when the store is disabled.
+    Returns the deduplication report, including rows_added.
+    """
     try:
-        # Load existing data if it exists
-        if os.path.exists(training_data_path):
-            existing_data = pd.read_csv(training_data_path)
-            combined_data = pd.concat([existing_data, new_data], ignore_index=True)
-        else:
-            combined_data = new_data
-        
-        # Remove duplicates
-        initial_len = len(combined_data)
-        combined_data = combined_data.drop_duplicates()
-        final_len = len(combined_data)
+        from training_store import open_training_data
         
-        # Save combined data
-        combined_data.to_csv(training_data_path, index=False)
+        training_data = open_training_data(training_data_path)
         
-        rows_added = len(new_data) - (initial_len - final_len)
-        logger.info(f"Added {rows_added} new rows to training data")
+        # Duplicates of stored rows and repeated rows within the upload are dropped
+        _, report = training_data.append(new_data)
+        logger.info(f"Added {report['rows_added']} new rows to training data "
+                    f"({report['duplicates_existing']} already stored, "
+                    f"{report['duplicates_in_upload']} repeated in the upload)")
         
-        return rows_added
+        # The bounded training sample catches up in the next training job
+        return report
         
     except Exception as e:
         logger.error(f"Error saving training data: {str(e)}")
@@ -420,97 +446,19 @@ def save_training_data(new_data: pd.DataFrame, training_data_path: str) -> int:
 
 def retrain_model_background(training_data_path: str, model_path: str):
     """
-    Retrain the model in the background using new data.
-    This function will run asynchronously when new data is uploaded.
+    Retrain the model in the current process using the training dataset.
+    The API queues retraining to the out-of-process worker (see training_worker.py);
+    this in-process entry point is kept for scripts and manual use.
     """
     try:
         logger.info("Starting background model retraining...")
-        
-        # Load training data
-        data = pd.read_csv(training_data_path)
-        
-        if len(data) < 100:  # Need minimum data for training
-            logger.warning(f"Insufficient data for retraining: {len(data)} rows")
-            return
-        
-        # Prepare features and target
-        X = data.drop(['Spoilage_Risk'], axis=1, errors='ignore')
-        y = data['Spoilage_Risk']
-        
-        # Apply feature engineering
-        X_engineered = engineer_features(X)
-        
-        # Define feature columns for preprocessing
-        categorical_features = [
-            'Storage_Type', 'Packaging_Quality', 'Commodity_name', 'Commodity_Category',
-            'Temp_Category', 'Humidity_Category', 'Harvest_Freshness', 'Transport_Category', 'Season'
-        ]
-        
-        numerical_features = [
-            'Temperature', 'Humidity', 'Days_Since_Harvest', 'Transport_Duration', 'Month_num',
-            'Temp_Squared', 'Heat_Index', 'VPD', 'Storage_Quality_Score', 'Total_Exposure_Time',
-            'Commodity_Perishability', 'Degradation_Rate', 'Environmental_Stress',
-            'Temp_Humidity_Interaction', 'Days_Transport_Interaction',
-            'Temp_Extreme', 'Humidity_Extreme', 'Is_Monsoon', 'Is_Winter', 'Is_Summer',
-            'Is_Highly_Perishable', 'Temp_Humidity_Risk', 'Poor_Conditions', 'High_Exposure_Risk'
-        ]
-        
-        # Filter features that exist in the data
-        categorical_features = [col for col in categorical_features if col in X_engineered.columns]
-        numerical_features = [col for col in numerical_features if col in X_engineered.columns]
-        
-        # Create preprocessing pipeline
-        preprocessor = ColumnTransformer(
-            transformers=[
-                ('num', StandardScaler(), numerical_features),
-                ('cat', OneHotEncoder(handle_unknown='ignore', sparse_output=False), categorical_features)
-            ]
-        )
-        
-        # Create and train new model
-        model_pipeline = Pipeline([
-            ('preprocessor', preprocessor),
-            ('classifier', RandomForestClassifier(
-                n_estimators=150,
-                max_depth=15,
-                min_samples_split=5,
-                random_state=42,
-                n_jobs=-1
-            ))
-        ])
-        
-        # Train-test split
-        X_train, X_test, y_train, y_test = train_test_split(
-            X_engineered, y, test_size=0.2, random_state=42, stratify=y
-        )
-        
-        # Train the model
-        model_pipeline.fit(X_train, y_train)
-        
-        # Evaluate the model
-        y_pred = model_pipeline.predict(X_test)
-        accuracy = accuracy_score(y_test, y_pred)
-        
-        logger.info(f"Model retrained with accuracy: {accuracy:.4f}")
-        
-        # Save the new model
-        backup_path = f"{model_path}.backup"
-        if os.path.exists(model_path):
-            # Create backup of old model
-            os.rename(model_path, backup_path)
-        
-        joblib.dump(model_pipeline, model_path)
-        logger.info(f"New model saved to {model_path}")
-        
-        # Log retraining results
-        with open("retraining_log.txt", "a") as f:
-            f.write(f"{datetime.now().isoformat()}: Retrained with {len(data)} samples, "
-                   f"accuracy: {accuracy:.4f}\n")
+        from training import train_model
+        return train_model(training_data_path, model_path)
         
     except Exception as e:
         logger.error(f"Error during model retraining: {str(e)}")
-        # Restore backup if it exists
+        # Restore backup if the new model could not be written
         backup_path = f"{model_path}.backup"
-        if os.path.exists(backup_path):
+        if not os.path.exists(model_path) and os.path.exists(backup_path):
             os.rename(backup_path, model_path)
             logger.info("Restored backup model due to retraining failure")
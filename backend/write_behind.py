@@ -0,0 +1,360 @@
+"""
+Write-behind logging of prediction and analytics records for Surplus2Serve.
+
+Request handlers hand records to WriteBehindLogger.log, which only puts them
+on a bounded in-memory queue. A background task takes them off in batches of
+up to WRITE_BEHIND_BATCH_SIZE records, or whatever arrived within
+WRITE_BEHIND_FLUSH_INTERVAL_SECONDS, and writes each collection's share with
+one insert_many(ordered=False).
+
+When the queue is full, WRITE_BEHIND_DROP_POLICY decides: 'drop_newest'
+rejects the new record, 'drop_oldest' evicts the oldest queued one, and
+'block' makes the request wait up to WRITE_BEHIND_BLOCK_TIMEOUT_SECONDS for
+room (backpressure) before dropping it. Every drop is counted.
+
+Batches that cannot be written because MongoDB is unavailable are appended
+to WRITE_BEHIND_SPILL_PATH (extended JSON lines, so ObjectIds and datetimes
+survive) and replayed every SPILL_RETRY_SECONDS until MongoDB accepts them.
+Records MongoDB rejects individually (e.g. duplicate keys), and batches that
+fail for any other reason than a lost connection, are counted as failed, not
+retried. stop() drains the queue before the connection closes.
+
+Each API process has its own queue; processes may share the spill file.
+"""
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+try:
+    from pymongo.errors import BulkWriteError, ConnectionFailure
+except ImportError:  # without pymongo no collection is ever available
+    BulkWriteError = ConnectionFailure = ()
+
+logger = logging.getLogger(__name__)
+
+# Buffer prediction and analytics records instead of writing them in the request
+WRITE_BEHIND_LOGGING = os.getenv("WRITE_BEHIND_LOGGING", "true").lower() == "true"
+# Records held in memory before WRITE_BEHIND_DROP_POLICY applies
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+# Records written per insert_many, and the longest a record waits for a batch to fill
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_FLUSH_INTERVAL_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_SECONDS", "1.0"))
+# 'drop_newest', 'drop_oldest' or 'block'
+WRITE_BEHIND_DROP_POLICY = os.getenv("WRITE_BEHIND_DROP_POLICY", "drop_oldest")
+# Longest a request waits for room in the queue under the 'block' policy
+WRITE_BEHIND_BLOCK_TIMEOUT_SECONDS = float(os.getenv("WRITE_BEHIND_BLOCK_TIMEOUT_SECONDS", "0.5"))
+# Records MongoDB could not take are kept here until it is back (empty = drop them)
+WRITE_BEHIND_SPILL_PATH = os.getenv("WRITE_BEHIND_SPILL_PATH", "write_behind_spill.jsonl")
+WRITE_BEHIND_SPILL_MAX_MB = float(os.getenv("WRITE_BEHIND_SPILL_MAX_MB", "100"))
+
+DROP_POLICIES = ('drop_newest', 'drop_oldest', 'block')
+# How often spilled records are offered to MongoDB again
+SPILL_RETRY_SECONDS = 30.0
+# Longest shutdown waits for the queue to drain before spilling the rest
+DRAIN_TIMEOUT_SECONDS = 10.0
+
+class WriteBehindLogger:
+    """
+    Bounded queue of (collection name, document) records flushed to MongoDB
+    by a background task. collections maps each collection name to a function
+    returning the collection, or None while MongoDB is not connected.
+    """
+
+    def __init__(self, collections: Dict[str, Callable[[], Any]],
+                 queue_size: int = WRITE_BEHIND_QUEUE_SIZE,
+                 batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval_seconds: float = WRITE_BEHIND_FLUSH_INTERVAL_SECONDS,
+                 drop_policy: str = WRITE_BEHIND_DROP_POLICY,
+                 block_timeout_seconds: float = WRITE_BEHIND_BLOCK_TIMEOUT_SECONDS,
+                 spill_path: Optional[str] = WRITE_BEHIND_SPILL_PATH,
+                 spill_max_bytes: int = int(WRITE_BEHIND_SPILL_MAX_MB * 1024 * 1024)):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy '{drop_policy}', use one of {list(DROP_POLICIES)}")
+        self.collections = collections
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.drop_policy = drop_policy
+        self.block_timeout_seconds = block_timeout_seconds
+        self.spill_path = spill_path or None
+        self.spill_max_bytes = spill_max_bytes
+        self.mongo_available: Optional[bool] = None
+        self.metrics: Dict[str, Any] = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "dropped_queue_full": 0,
+            "dropped_spill_full": 0,
+            "failed": 0,
+            "blocked": 0,
+            "blocked_seconds": 0.0,
+            "spilled": 0,
+            "replayed": 0,
+            "max_queue_depth": 0,
+            "last_flush_at": None,
+            "last_error": None
+        }
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._last_replay = 0.0
+
+    async def log(self, collection: str, document: Dict[str, Any]) -> bool:
+        """Queue a record for writing; False if it was dropped."""
+        item = (collection, document)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.drop_policy == 'drop_newest':
+                self.metrics["dropped_queue_full"] += 1
+                return False
+            if self.drop_policy == 'drop_oldest':
+                self.queue.get_nowait()
+                self.metrics["dropped_queue_full"] += 1
+                self.queue.put_nowait(item)
+            else:
+                self.metrics["blocked"] += 1
+                start = time.perf_counter()
+                try:
+                    await asyncio.wait_for(self.queue.put(item), self.block_timeout_seconds)
+                except asyncio.TimeoutError:
+                    self.metrics["dropped_queue_full"] += 1
+                    return False
+                finally:
+                    self.metrics["blocked_seconds"] += time.perf_counter() - start
+        self.metrics["enqueued"] += 1
+        self.metrics["max_queue_depth"] = max(self.metrics["max_queue_depth"], self.queue.qsize())
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = DRAIN_TIMEOUT_SECONDS):
+        """Flush everything queued; records still queued after timeout are spilled."""
+        if self._task is None:
+            return
+        self._stopping = True
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Write-behind queue not drained within {timeout}s; spilling {self.queue.qsize()} records")
+            remaining = []
+            while not self.queue.empty():
+                remaining.append(self.queue.get_nowait())
+            await self._spill(remaining)
+        except Exception as e:
+            logger.error(f"Write-behind flusher failed: {str(e)}")
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                batch = await self._next_batch()
+                if batch:
+                    await self._write(batch)
+                if self.spill_path and time.monotonic() - self._last_replay >= SPILL_RETRY_SECONDS:
+                    self._last_replay = time.monotonic()
+                    await self._replay_spill()
+            except Exception as e:
+                # Keep flushing; the records of this batch are lost
+                logger.error(f"Write-behind flush failed: {str(e)}")
+                self.metrics["last_error"] = str(e)
+            if self._stopping and self.queue.empty():
+                break
+
+    async def _next_batch(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Up to batch_size records, waiting at most one flush interval after the first."""
+        loop = asyncio.get_running_loop()
+        try:
+            batch = [self.queue.get_nowait()]
+        except asyncio.QueueEmpty:
+            try:
+                batch = [await asyncio.wait_for(self.queue.get(), self.flush_interval_seconds)]
+            except asyncio.TimeoutError:
+                return []
+        deadline = loop.time() + self.flush_interval_seconds
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if self._stopping or remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: List[Tuple[str, Dict[str, Any]]]):
+        by_collection: Dict[str, List[Dict[str, Any]]] = {}
+        for collection, document in batch:
+            by_collection.setdefault(collection, []).append(document)
+        unwritten = []
+        for collection, documents in by_collection.items():
+            unwritten += [(collection, document) for document in await self._insert(collection, documents)]
+        self.metrics["batches"] += 1
+        self.metrics["last_flush_at"] = datetime.now().isoformat()
+        if unwritten:
+            await self._spill(unwritten)
+
+    async def _insert(self, collection: str, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """insert_many the documents; returns those to retry because MongoDB is unavailable."""
+        try:
+            target = self.collections[collection]()
+            if target is None:
+                raise ConnectionError("MongoDB is not connected")
+            await target.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Some documents were rejected (e.g. duplicate keys); the others were written
+            self.metrics["written"] += e.details.get("nInserted", 0)
+            self.metrics["failed"] += len(e.details.get("writeErrors", []))
+            self.metrics["last_error"] = str(e)
+            self.mongo_available = True
+            return []
+        except (ConnectionError, ConnectionFailure) as e:
+            # Includes server selection timeouts and lost connections
+            if self.mongo_available is not False:
+                logger.warning(f"MongoDB unavailable for write-behind logging: {str(e)}")
+            self.mongo_available = False
+            self.metrics["last_error"] = str(e)
+            return documents
+        except Exception as e:
+            # Not an outage: retrying would fail the same way, so the records are dropped
+            logger.error(f"Failed to write {len(documents)} {collection} records: {type(e).__name__}: {str(e)}")
+            self.metrics["failed"] += len(documents)
+            self.metrics["last_error"] = f"{type(e).__name__}: {str(e)}"
+            return []
+        if self.mongo_available is False:
+            logger.info("MongoDB available again for write-behind logging")
+        self.mongo_available = True
+        self.metrics["written"] += len(documents)
+        return []
+
+    async def _spill(self, records: List[Tuple[str, Dict[str, Any]]]):
+        if not records:
+            return
+        if not self.spill_path:
+            self.metrics["failed"] += len(records)
+            return
+        from bson import json_util
+
+        lines = [json_util.dumps({"collection": collection, "document": document}) + "\n"
+                 for collection, document in records]
+
+        def append() -> int:
+            size = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+            kept = []
+            for line in lines:
+                if size + len(line) > self.spill_max_bytes:
+                    break
+                kept.append(line)
+                size += len(line)
+            if kept:
+                with open(self.spill_path, "a") as f:
+                    f.writelines(kept)
+            return len(kept)
+
+        try:
+            spilled = await asyncio.to_thread(append)
+        except OSError as e:
+            logger.error(f"Failed to spill write-behind records: {str(e)}")
+            spilled = 0
+        self.metrics["spilled"] += spilled
+        self.metrics["dropped_spill_full"] += len(lines) - spilled
+
+    async def _replay_spill(self):
+        """Offer spilled records to MongoDB again; those it still cannot take are spilled anew."""
+        if not os.path.exists(self.spill_path):
+            return
+        from bson import json_util
+
+        # Claim the file so concurrent processes do not replay the same records
+        replay_path = f"{self.spill_path}.replay-{os.getpid()}"
+        try:
+            os.replace(self.spill_path, replay_path)
+        except FileNotFoundError:
+            return
+
+        def read_records() -> List[Tuple[str, Dict[str, Any]]]:
+            records = []
+            with open(replay_path) as f:
+                for line in f:
+                    try:
+                        record = json_util.loads(line)
+                        records.append((record["collection"], record["document"]))
+                    except (ValueError, KeyError):
+                        # e.g. the last line of a spill cut short by a crash
+                        self.metrics["failed"] += 1
+            return records
+
+        def restore():
+            # Give the claimed file back untouched, after anything spilled meanwhile
+            with open(replay_path, "rb") as source, open(self.spill_path, "ab") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(replay_path)
+
+        records: Optional[List[Tuple[str, Dict[str, Any]]]] = None
+        unwritten: List[Tuple[str, Dict[str, Any]]] = []
+        handled = 0
+        try:
+            records = await asyncio.to_thread(read_records)
+            for start in range(0, len(records), self.batch_size):
+                batch = records[start:start + self.batch_size]
+                if not unwritten:
+                    by_collection: Dict[str, List[Dict[str, Any]]] = {}
+                    for collection, document in batch:
+                        by_collection.setdefault(collection, []).append(document)
+                    for collection, documents in by_collection.items():
+                        unwritten += [(collection, document)
+                                      for document in await self._insert(collection, documents)]
+                else:
+                    # MongoDB is still unavailable; keep the rest without trying
+                    unwritten += batch
+                handled = start + len(batch)
+        finally:
+            # Also on errors and cancellation, so no claimed record is left behind
+            if records is None:
+                await asyncio.to_thread(restore)
+            else:
+                replayed = handled - len(unwritten)
+                unwritten += records[handled:]
+                self.metrics["replayed"] += replayed
+                self.metrics["spilled"] -= len(unwritten)
+                await self._spill(unwritten)
+                os.remove(replay_path)
+                if replayed:
+                    logger.info(f"Replayed {replayed} spilled write-behind records")
+
+    def status(self) -> Dict[str, Any]:
+        spill_bytes = 0
+        if self.spill_path and os.path.exists(self.spill_path):
+            spill_bytes = os.path.getsize(self.spill_path)
+        return dict(
+            self.metrics,
+            blocked_seconds=round(self.metrics["blocked_seconds"], 4),
+            queue_depth=self.queue.qsize(),
+            queue_size=self.queue.maxsize,
+            batch_size=self.batch_size,
+            flush_interval_seconds=self.flush_interval_seconds,
+            drop_policy=self.drop_policy,
+            mongo_available=self.mongo_available,
+            spill_path=os.path.abspath(self.spill_path) if self.spill_path else None,
+            spill_bytes=spill_bytes
+        )
+
+def create_write_behind_logger(collections: Dict[str, Callable[[], Any]]) -> Optional[WriteBehindLogger]:
+    """The API's write-behind logger, started; None when WRITE_BEHIND_LOGGING is off."""
+    if not WRITE_BEHIND_LOGGING:
+        return None
+    write_behind = WriteBehindLogger(collections)
+    write_behind.start()
+    return write_behind